@@ -3,6 +3,9 @@
 import lxml.etree as ET
 import yaml
 import os
+import json
+import hashlib
+import tempfile
 import traceback
 import ipaddr as ipaddress
 from operator import itemgetter
@@ -48,6 +51,12 @@ options:
         Name of the connection graph xml file. Override the behavior of looking up connection graph xml file. When
         this option is specified, always use the specified connection graph xml file.
         required: False
+    use_graph_index:
+        Look up the connection graph xml file through the persistent hostname index saved as
+        .conn_graph_index.json next to the graph files. Only graph files changed since the index was saved
+        are parsed again. Set to False to parse every graph file listed in graph_files.yml.
+        required: False
+        default: True
 
     Mutually exclusive options: host, hosts, anchor
 
@@ -337,15 +346,7 @@ class Parse_Lab_Graph():
         return self.links.get(hostname)
 
     def contains_hosts(self, hostnames, part):
-        if not part:
-            return set(hostnames) <= set(self.devices)
-        # It's possible that not all devices are found in connect_graph when using in devutil
-        THRESHOLD = 0.8
-        count = 0
-        for hostname in hostnames:
-            if hostname in self.devices.keys():
-                count += 1
-        return hostnames and (count * 1.0 / len(hostnames) >= THRESHOLD)
+        return graph_contains_hosts(self.devices, hostnames, part)
 
 
     def get_host_console_info(self, hostname):
@@ -403,12 +404,156 @@ class Parse_Lab_Graph():
             return {}
 
 
+def graph_contains_hosts(devices, hostnames, part):
+    """
+    Check whether a graph with the given devices contains the hostnames.
+
+    Parameters:
+        devices: collection of hostnames found in a graph file.
+        hostnames: list of duts in the target testbed.
+        part: return True if over 80% of hosts are found in devices when part is True
+    """
+    if not part:
+        return set(hostnames) <= set(devices)
+    # It's possible that not all devices are found in connect_graph when using in devutil
+    THRESHOLD = 0.8
+    count = 0
+    for hostname in hostnames:
+        if hostname in devices:
+            count += 1
+    return hostnames and (count * 1.0 / len(hostnames) >= THRESHOLD)
+
+
 LAB_CONNECTION_GRAPH_FILE = 'graph_files.yml'
 EMPTY_GRAPH_FILE = 'empty_graph.xml'
 LAB_GRAPHFILE_PATH = 'files/'
+LAB_GRAPH_INDEX_FILE = '.conn_graph_index.json'
+LAB_GRAPH_INDEX_VERSION = 1
+
+
+class Lab_Graph_Index():
+    """
+    Persistent hostname to graph file index
+
+    Parsing every graph file listed in graph_files.yml only to find the one holding the DUTs is slow
+    when there are many large graph files. This index records the hostnames of each graph file keyed
+    by file path, mtime, size and content hash. It is stored next to the graph files and only the
+    graph files that changed since the index was last saved are parsed again.
+    """
+
+    def __init__(self, graph_path, index_file=LAB_GRAPH_INDEX_FILE):
+        self.graph_path = graph_path
+        self.index_file = os.path.join(graph_path, index_file)
+        self.entries = {}
+        self.dirty = False
+        # Graphs parsed while refreshing the index, reused by lookup to avoid parsing twice
+        self.parsed = {}
+
+    def load(self):
+        """
+        Load the index file, a missing or corrupted index is treated as empty
+        """
+        try:
+            with open(self.index_file) as fd:
+                content = json.load(fd)
+            if content.get('version') == LAB_GRAPH_INDEX_VERSION:
+                self.entries = content.get('files', {})
+        except (IOError, OSError, ValueError, AttributeError):
+            self.entries = {}
+
+    def save(self):
+        """
+        Atomically write the index file if it changed, failures are not fatal
+        """
+        if not self.dirty:
+            return
+        content = {'version': LAB_GRAPH_INDEX_VERSION, 'files': self.entries}
+        try:
+            fd, tmp_name = tempfile.mkstemp(dir=self.graph_path, prefix=LAB_GRAPH_INDEX_FILE + '.')
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(content, fp, indent=1, sort_keys=True)
+            # mkstemp creates the file as 0600, the index is shared by all users of the graph directory
+            os.chmod(tmp_name, 0o644)
+            os.rename(tmp_name, self.index_file)
+            self.dirty = False
+        except (IOError, OSError) as e:
+            print_debug_msg(debug_fname, "Failed to save conn graph index %s: %s" % (self.index_file, repr(e)))
+
+    @staticmethod
+    def _file_digest(filename):
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def refresh(self, fn):
+        """
+        Return the hostnames of graph file fn, parsing the file only when its content changed
+
+        Parameters:
+            fn: graph file name relative to graph_path
+        """
+        filename = os.path.join(self.graph_path, fn)
+        st = os.stat(filename)
+        entry = self.entries.get(fn)
+        if entry and entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+            return entry['hosts']
+
+        digest = self._file_digest(filename)
+        if entry and entry['sha1'] == digest:
+            # Touched but not modified, only the stat part of the key needs updating
+            entry['mtime'] = st.st_mtime
+            entry['size'] = st.st_size
+            self.dirty = True
+            return entry['hosts']
+
+        print_debug_msg(debug_fname, "Indexing conn graph file: %s" % fn)
+        lab_graph = Parse_Lab_Graph(filename)
+        lab_graph.parse_graph()
+        self.parsed[fn] = lab_graph
+        self.entries[fn] = {
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'sha1': digest,
+            'hosts': sorted(lab_graph.devices.keys())
+        }
+        self.dirty = True
+        return self.entries[fn]['hosts']
+
+    def prune(self, file_list):
+        """
+        Drop entries of graph files no longer listed in graph_files.yml
+        """
+        for fn in list(self.entries.keys()):
+            if fn not in file_list:
+                del self.entries[fn]
+                self.dirty = True
 
+    def lookup(self, file_list, hostnames, part=False):
+        """
+        Find the first graph file in file_list which contains hostnames, return (file name, parsed graph)
+        or (None, None) when no graph file matches.
+        """
+        self.load()
+        self.prune(file_list)
+        found = None
+        for fn in file_list:
+            hosts = self.refresh(fn)
+            if graph_contains_hosts(hosts, hostnames, part):
+                found = fn
+                break
+        self.save()
+        if found is None:
+            return None, None
+        lab_graph = self.parsed.get(found)
+        if lab_graph is None:
+            lab_graph = Parse_Lab_Graph(os.path.join(self.graph_path, found))
+            lab_graph.parse_graph()
+        return found, lab_graph
 
-def find_graph(hostnames, part=False):
+
+def find_graph(hostnames, part=False, use_index=True):
     """
     Find a graph file contains all devices in testbed.
     duts are spcified by hostnames
@@ -416,22 +561,30 @@ def find_graph(hostnames, part=False):
     Parameters:
         hostnames: list of duts in the target testbed.
         part: select the graph file if over 80% of hosts are found in conn_graph when part is True
+        use_index: look up the graph file through the persistent hostname index instead of
+                   parsing every graph file
     """
     global debug_fname
     filename = os.path.join(LAB_GRAPHFILE_PATH, LAB_CONNECTION_GRAPH_FILE)
     with open(filename) as fd:
         file_list = yaml.safe_load(fd)
 
-    # Finding the graph file contains all duts from hostnames,
-    for fn in file_list:
-        print_debug_msg(debug_fname, "Looking at conn graph file: %s for hosts %s" % (fn, hostnames))
-        filename = os.path.join(LAB_GRAPHFILE_PATH, fn)
-        lab_graph = Parse_Lab_Graph(filename)
-        lab_graph.parse_graph()
-        print_debug_msg(debug_fname, "For file %s, got hostnames %s" % (fn, lab_graph.devices))
-        if lab_graph.contains_hosts(hostnames, part):
-            print_debug_msg(debug_fname, ("Returning lab graph from conn graph file: %s for hosts %s" % (fn, hostnames)))
+    if use_index:
+        fn, lab_graph = Lab_Graph_Index(LAB_GRAPHFILE_PATH).lookup(file_list, hostnames, part)
+        if lab_graph is not None:
+            print_debug_msg(debug_fname, ("Returning lab graph from indexed conn graph file: %s for hosts %s" % (fn, hostnames)))
             return lab_graph
+    else:
+        # Finding the graph file contains all duts from hostnames,
+        for fn in file_list:
+            print_debug_msg(debug_fname, "Looking at conn graph file: %s for hosts %s" % (fn, hostnames))
+            filename = os.path.join(LAB_GRAPHFILE_PATH, fn)
+            lab_graph = Parse_Lab_Graph(filename)
+            lab_graph.parse_graph()
+            print_debug_msg(debug_fname, "For file %s, got hostnames %s" % (fn, lab_graph.devices))
+            if lab_graph.contains_hosts(hostnames, part):
+                print_debug_msg(debug_fname, ("Returning lab graph from conn graph file: %s for hosts %s" % (fn, hostnames)))
+                return lab_graph
     # Fallback to return an empty connection graph, this is
     # needed to bridge the kvm test needs. The KVM test needs
     # A graph file, which used to be whatever hardcoded file.
@@ -524,6 +677,7 @@ def main():
             filepath=dict(required=False),
             anchor=dict(required=False, type='list'),
             ignore_errors=dict(required=False, type='bool', default=False),
+            use_graph_index=dict(required=False, type='bool', default=True),
         ),
         mutually_exclusive=[['host', 'hosts', 'anchor']],
         supports_check_mode=True
@@ -557,7 +711,7 @@ def main():
             # the caller is asking to return the whole graph. This
             # is needed when configuring the root fanout switch.
             target = anchor if anchor else hostnames
-            lab_graph = find_graph(target)
+            lab_graph = find_graph(target, use_index=m_args['use_graph_index'])
 
         # early return for the whole graph or empty graph file(vtestbed)
         if (
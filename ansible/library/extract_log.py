@@ -8,6 +8,12 @@ description: The module scans the 'directory' in search of files which filenames
 The found files are ungzipped and combined together in the rotation order. After that all lines after
 'start_string' are copied into a file with name 'target_filename'. All input strings with 'nsible' in it
 aren't considered as 'start_string' to avoid clashing with ansible output.
+Plain log files are searched backwards through mmap and only the tail after 'start_string' is copied,
+gzip files are scanned line by line.
+When a cursor ('start_inode' and 'start_offset') is given, the file with that inode is looked up among the
+rotated files and everything after the offset is copied without searching for 'start_string'. The search is
+only used when the file was compressed or truncated since the cursor was taken. The cursor of the end of the
+extracted log is returned, so the next extraction can continue from it.
 
 Options:
     - option-name: directory
@@ -30,6 +36,16 @@ Options:
       required: True
       Default: None
 
+    - option-name: start_inode
+      description: inode of the log file when the cursor was taken
+      required: False
+      Default: None
+
+    - option-name: start_offset
+      description: size of the log file when the cursor was taken
+      required: False
+      Default: None
+
 '''
 
 EXAMPLES = '''
@@ -46,6 +62,17 @@ EXAMPLES = '''
     dest: '/tmp/'
     flat: yes
 
+- name: Extract syslog entries appended since the cursor taken with 'stat -c "%i %s" /var/log/syslog'
+  extract_log:
+    directory: '/var/log'
+    file_prefix: 'syslog'
+    start_string: 'start-LogAnalyzer-test'
+    target_filename: '/tmp/syslog'
+    start_inode: 1234567
+    start_offset: 8910
+  register: result
+  # result.cursor: {'inode': ..., 'offset': ..., 'generation': <number of rotations since the cursor, -1 if not found>}
+
 - name: Extract all sairedis.rec entries since the last reboot
   extract_log:
     directory: '/var/log/swss'
@@ -74,10 +101,14 @@ EXAMPLES = '''
 '''
 
 import os
+import datetime
 import gzip
+import locale
+import mmap
 import re
+import shutil
 import sys
-from datetime import datetime
+from functools import cmp_to_key
 from ansible.module_utils.basic import *
 
 
@@ -109,11 +140,22 @@ def extract_number(s):
         return int(ns[0])
 
 
+# Parsed timestamps, keyed by (file ctime, line). The sort comparator parses the same lines many times.
+_date_cache = {}
+
+
 def convert_date(fct, s):
+    key = (fct, s)
+    if key not in _date_cache:
+        _date_cache[key] = _convert_date(fct, s)
+    return _date_cache[key]
+
+
+def _convert_date(fct, s):
     dt = None
     re_result = re.findall(r'^\S{3}\s{1,2}\d{1,2} \d{2}:\d{2}:\d{2}\.?\d*', s)
     # Workaround for pytest-ansible
-    loc = locale.getlocale()
+    loc = locale.setlocale(locale.LC_ALL)
     locale.setlocale(locale.LC_ALL, (None, None))
 
     if len(re_result) > 0:
@@ -177,7 +219,7 @@ def list_files(directory, prefixname):
     (Comparator used is @filename_comparator)"""
 
     return sorted([filename for filename in os.listdir(directory)
-        if filename.startswith(prefixname)], cmp=filename_comparator)
+        if filename.startswith(prefixname)], key=cmp_to_key(filename_comparator))
 
 
 def extract_latest_line_with_string(directory, filenames, start_string):
@@ -228,13 +270,153 @@ def combine_logs_and_save(directory, filenames, start_string, target_filename):
                         fp.write(line)
 
 
-def extract_log(directory, prefixname, target_string, target_filename):
+def extract_log_legacy(directory, prefixname, target_string, target_filename):
     filenames = list_files(directory, prefixname)
     file_with_latest_line, file_create_time, latest_line = extract_latest_line_with_string(directory, filenames, target_string)
     files_to_copy = calculate_files_to_copy(filenames, file_with_latest_line)
     combine_logs_and_save(directory, files_to_copy, latest_line, target_filename)
 
 
+def _to_bytes(s):
+    if isinstance(s, bytes):
+        return s
+    return s.encode('utf-8')
+
+
+def find_latest_offset(path, target_string):
+    """Searches plain file @path backwards for the last line containing @target_string
+    and not containing 'nsible'. Returns the offset of the beginning of that line or None"""
+
+    target = _to_bytes(target_string)
+    skip = b'nsible'
+    with open(path, 'rb') as fp:
+        size = os.fstat(fp.fileno()).st_size
+        if size == 0:
+            return None
+        mm = mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            end = size
+            while True:
+                pos = mm.rfind(target, 0, end)
+                if pos < 0:
+                    return None
+                line_start = mm.rfind(b'\n', 0, pos) + 1
+                line_end = mm.find(b'\n', pos)
+                if line_end < 0:
+                    line_end = size
+                if mm[line_start:line_end].find(skip) < 0:
+                    return line_start
+                end = line_start
+        finally:
+            mm.close()
+
+
+def find_latest_line_number(path, target_string):
+    """Scans gzip file @path for the last line containing @target_string
+    and not containing 'nsible'. Returns the line number of that line or None"""
+
+    target = _to_bytes(target_string)
+    skip = b'nsible'
+    found = None
+    with gzip.GzipFile(path) as fp:
+        for number, line in enumerate(fp):
+            if target in line and skip not in line:
+                found = number
+    return found
+
+
+def copy_tail(path, fp, offset=0, line_number=0):
+    """Copies content of @path starting from byte @offset (plain files)
+    or line @line_number (gzip files) into file object @fp.
+    Returns the offset of the end of the copied content of plain files, 0 for gzip files"""
+
+    if path.endswith('.gz'):
+        with gzip.GzipFile(path) as src:
+            for number, line in enumerate(src):
+                if number >= line_number:
+                    fp.write(line)
+        return 0
+    else:
+        with open(path, 'rb') as src:
+            src.seek(offset)
+            shutil.copyfileobj(src, fp, 1024 * 1024)
+            return src.tell()
+
+
+def copy_newer_files(directory, filenames, index, fp):
+    """Copies files newer than @filenames[@index] into file object @fp, oldest first.
+    Returns the cursor of the end of the newest copied file"""
+
+    end_offset = None
+    for filename in reversed(filenames[:index]):
+        end_offset = copy_tail(os.path.join(directory, filename), fp)
+    return end_offset
+
+
+def find_cursor_file(directory, filenames, inode, offset):
+    """Returns index in @filenames of the plain file with @inode, which is the file the cursor was
+    taken on after @index rotations. Returns None if the file was compressed or truncated"""
+
+    for index, filename in enumerate(filenames):
+        if filename.endswith('.gz'):
+            continue
+        st = os.stat(os.path.join(directory, filename))
+        if st.st_ino == inode:
+            return index if st.st_size >= offset else None
+    return None
+
+
+def extract_log(directory, prefixname, target_string, target_filename):
+    """Extracts log lines starting from the last line with @target_string into @target_filename.
+    Log files are visited from the newest one, the plain ones are searched backwards through mmap,
+    only the gzip ones are scanned line by line. Only the lines after the start line are read again
+    and written to the target file"""
+
+    filenames = list_files(directory, prefixname)
+    offset = line_number = None
+    index = 0
+    for index, filename in enumerate(filenames):
+        path = os.path.join(directory, filename)
+        if filename.endswith('.gz'):
+            line_number = find_latest_line_number(path, target_string)
+        else:
+            offset = find_latest_offset(path, target_string)
+        if offset is not None or line_number is not None:
+            break
+    else:
+        raise Exception("{} was not found in {}".format(target_string, directory))
+
+    with open(target_filename, 'wb') as fp:
+        end_offset = copy_tail(os.path.join(directory, filenames[index]), fp, offset or 0, line_number or 0)
+        newest_end_offset = copy_newer_files(directory, filenames, index, fp)
+    if newest_end_offset is not None:
+        end_offset = newest_end_offset
+    return make_cursor(directory, filenames[0], end_offset, -1)
+
+
+def make_cursor(directory, filename, offset, generation):
+    return {'inode': os.stat(os.path.join(directory, filename)).st_ino, 'offset': offset, 'generation': generation}
+
+
+def extract_log_from_cursor(directory, prefixname, target_string, target_filename, inode, offset):
+    """Extracts log lines appended after the cursor (@inode, @offset) into @target_filename.
+    Falls back to searching for @target_string if the file of the cursor is not found.
+    Returns the cursor of the end of the extracted log, its generation is the number of
+    rotations since the cursor was taken, -1 if the fallback was used"""
+
+    filenames = list_files(directory, prefixname)
+    index = find_cursor_file(directory, filenames, inode, offset)
+    if index is None:
+        return extract_log(directory, prefixname, target_string, target_filename)
+
+    with open(target_filename, 'wb') as fp:
+        end_offset = copy_tail(os.path.join(directory, filenames[index]), fp, offset)
+        newest_end_offset = copy_newer_files(directory, filenames, index, fp)
+    if newest_end_offset is not None:
+        end_offset = newest_end_offset
+    return make_cursor(directory, filenames[0], end_offset, index)
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
@@ -242,16 +424,23 @@ def main():
             file_prefix=dict(required=True, type='str'),
             start_string=dict(required=True, type='str'),
             target_filename=dict(required=True, type='str'),
+            start_inode=dict(required=False, type='int', default=None),
+            start_offset=dict(required=False, type='int', default=None),
         ),
+        required_together=[['start_inode', 'start_offset']],
         supports_check_mode=False)
 
     p = module.params;
     try:
-        extract_log(p['directory'], p['file_prefix'], p['start_string'], p['target_filename'])
+        if p['start_inode'] is not None:
+            cursor = extract_log_from_cursor(p['directory'], p['file_prefix'], p['start_string'], p['target_filename'],
+                                             p['start_inode'], p['start_offset'])
+        else:
+            cursor = extract_log(p['directory'], p['file_prefix'], p['start_string'], p['target_filename'])
     except:
         err = str(sys.exc_info())
         module.fail_json(msg="Error: %s" % err)
-    module.exit_json()
+    module.exit_json(cursor=cursor)
 
 
 if __name__ == '__main__':
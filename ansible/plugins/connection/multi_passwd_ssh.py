@@ -1,5 +1,9 @@
 import imp
+import json
 import os
+import re
+import socket
+import time
 
 from functools import wraps
 from ansible.errors import AnsibleAuthenticationFailure
@@ -58,8 +62,76 @@ def _password_retry(func):
     return wrapped
 
 
+# Environment variables set by the `ssh_pool` pytest plugin, see tests/common/plugins/ssh_pool
+SSH_POOL_DIR_ENV = "SONIC_MGMT_SSH_POOL_DIR"
+SSH_POOL_PERSIST_ENV = "SONIC_MGMT_SSH_POOL_PERSIST"
+SSH_POOL_STATS_ENV = "SONIC_MGMT_SSH_POOL_STATS"
+
+_CONTROL_PERSIST_RE = re.compile(br"ControlPersist=[^\s\"']+", re.IGNORECASE)
+
+
+def _pool_stats(func):
+    """
+    Decorator to record the usage of the shared ControlMaster pool
+
+    A run is a pool hit if a live master connection of the host listens on the ControlPath socket,
+    otherwise the run establishes the master connection and its duration is the connect latency. A
+    socket left behind by a master which died or expired is not a hit. One JSON line per
+    run is appended to the stats file, the runs happen in forked ansible workers of every pytest
+    process so the file is the only place to aggregate them.
+    """
+    @wraps(func)
+    def wrapped(self, *args, **kwargs):
+        stats_file = os.environ.get(SSH_POOL_STATS_ENV)
+        if not stats_file or not self._persistent or not self.control_path:
+            return func(self, *args, **kwargs)
+
+        socket_path = self.control_path % dict(directory=_ssh.unfrackpath(self.control_path_dir))
+        hit = _master_alive(socket_path)
+        start = time.time()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            record = {"host": self.host, "hit": hit, "elapsed": time.time() - start}
+            try:
+                with open(stats_file, "a") as fp:
+                    fp.write(json.dumps(record) + "\n")
+            except (IOError, OSError):
+                pass
+    return wrapped
+
+
+def _master_alive(socket_path):
+    """Whether a master connection listens on the ControlPath socket, without starting an ssh process"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(1)
+        sock.connect(socket_path)
+        return True
+    except (IOError, OSError, socket.error):
+        # A missing socket or one left behind by a master which died or expired refuses the connection
+        return False
+    finally:
+        sock.close()
+
+
 class Connection(_ssh.Connection):
 
+    def _build_command(self, *args, **kwargs):
+        pool_dir = os.environ.get(SSH_POOL_DIR_ENV)
+        if pool_dir:
+            # Keep the ControlPath sockets of the session in the pool directory, apart from the sockets of
+            # other ansible runs of the user in the default ~/.ansible/cp, so the pool can close its own masters
+            self.control_path_dir = pool_dir
+            self.set_option("control_path_dir", pool_dir)
+        b_command = super(Connection, self)._build_command(*args, **kwargs)
+        persist = os.environ.get(SSH_POOL_PERSIST_ENV)
+        if persist:
+            b_persist = b"ControlPersist=" + persist.encode("ascii")
+            b_command = [_CONTROL_PERSIST_RE.sub(b_persist, arg) for arg in b_command]
+        return b_command
+
+    @_pool_stats
     @_password_retry
     def _run(self, *args, **kwargs):
         return super(Connection, self)._run(*args, **kwargs)
@@ -68,6 +68,8 @@ import ast
 
 from arista import Arista
 import sad_path as sp
+from pcap_analyzer import DisruptionAnalyzer
+from ring_sniffer import RingSniffer
 
 
 class StateMachine():
@@ -152,6 +154,7 @@ class ReloadTest(BaseTest):
         self.check_param('nexthop_ips', [], required=False) # nexthops for the routes that will be added during warm-reboot
         self.check_param('allow_vlan_flooding', False, required=False)
         self.check_param('sniff_time_incr', 60, required=False)
+        self.check_param('sniffer', 'ring', required=False) # 'ring': AF_PACKET ring straight to pcap, 'scapy': scapy sniff()
         self.check_param('vnet', False, required=False)
         self.check_param('vnet_pkts', None, required=False)
         self.check_param('target_version', '', required=False)
@@ -792,6 +795,9 @@ class ReloadTest(BaseTest):
         self.routing_always = False
         self.total_disrupt_packets = None
         self.total_disrupt_time = None
+        self.packets = None
+        self.capture_file = None
+        self.sniffer_drops = None
         self.ssh_jobs = []
         for addr in self.ssh_targets:
             q = Queue.Queue(1)
@@ -1145,6 +1151,8 @@ class ReloadTest(BaseTest):
         dataplane_report["downtime"] = str(dataplane_downtime)
         dataplane_report["lost_packets"] = str(self.total_disrupt_packets) \
             if self.total_disrupt_packets is not None else ""
+        dataplane_report["sniffer_drops"] = str(self.sniffer_drops) \
+            if self.sniffer_drops is not None else ""
         controlplane_report = dict()
 
         if self.no_control_stop and self.no_control_start:
@@ -1339,27 +1347,34 @@ class ReloadTest(BaseTest):
         """
         This function listens on all ports, in both directions, for the TCP src=1234 dst=5000 packets, until timeout.
         Once found, all packets are dumped to local pcap file,
-        and all packets are saved to self.packets as scapy type.
-        The native scapy.snif() is used as a background thread, to allow delayed start for the send_in_background().
+        directly by the ring sniffer, or saved to self.packets as scapy type by the native scapy.sniff().
+        The sniffer is used as a background thread, to allow delayed start for the send_in_background().
         """
         if not wait:
             wait = self.time_to_listen + self.test_params['sniff_time_incr']
         sniffer_start = datetime.datetime.now()
         self.log("Sniffer started at %s" % str(sniffer_start))
         sniff_filter = "tcp and tcp dst port 5000 and tcp src port 1234 and not icmp"
-        scapy_sniffer = threading.Thread(target=self.scapy_sniff, kwargs={'wait': wait, 'sniff_filter': sniff_filter})
-        scapy_sniffer.start()
-        time.sleep(2)               # Let the scapy sniff initialize completely.
+        sniff = self.ring_sniff if self.test_params['sniffer'] == 'ring' else self.scapy_sniff
+        sniffer = threading.Thread(target=sniff, kwargs={'wait': wait, 'sniff_filter': sniff_filter})
+        sniffer.start()
+        time.sleep(2)               # Let the sniffer initialize completely.
         self.sniffer_started.set()  # Unblock waiter for the send_in_background.
-        scapy_sniffer.join()
+        sniffer.join()
         self.log("Sniffer has been running for %s" % str(datetime.datetime.now() - sniffer_start))
         self.sniffer_started.clear()
 
+    def get_capture_filename(self):
+        return "/tmp/capture_%s.pcap" % self.sad_oper if self.sad_oper is not None else "/tmp/capture.pcap"
+
     def save_sniffed_packets(self):
-        filename = "/tmp/capture_%s.pcap" % self.sad_oper if self.sad_oper is not None else "/tmp/capture.pcap"
+        filename = self.get_capture_filename()
         if self.packets:
             scapyall.wrpcap(filename, self.packets)
+            self.capture_file = filename
             self.log("Pcap file dumped to %s" % filename)
+        elif self.capture_file:
+            self.log("Pcap file written by the sniffer to %s" % self.capture_file)
         else:
             self.log("Pcap file is empty.")
 
@@ -1368,6 +1383,29 @@ class ReloadTest(BaseTest):
         This method exploits native scapy sniff() method.
         """
         self.packets = scapyall.sniff(timeout = wait, filter = sniff_filter)
+        self.capture_file = None
+        self.sniffer_drops = None
+
+    def ring_sniff(self, wait = 180, sniff_filter = ''):
+        """
+        This method captures the packets with ring_sniffer.RingSniffer, which writes them directly to the pcap file
+        and counts the packets the kernel dropped because the sniffer was too slow.
+        It falls back to scapy_sniff() if the ring can't be set up.
+        """
+        filename = self.get_capture_filename()
+        sniffer = RingSniffer(filename, sniff_filter, log=self.log)
+        try:
+            sniffer.open()
+        except (socket.error, OSError, subprocess.CalledProcessError) as err:
+            self.log("Ring sniffer failed to start: %s. Falling back to scapy sniff." % str(err))
+            return self.scapy_sniff(wait, sniff_filter)
+        try:
+            sniffer.run(wait)
+        finally:
+            sniffer.close()
+        self.packets = None
+        self.capture_file = filename if sniffer.captured else None
+        self.sniffer_drops = sniffer.drops
 
     def send_and_sniff(self):
         """
@@ -1382,137 +1420,55 @@ class ReloadTest(BaseTest):
         self.sniff_thr.join()
         self.sender_thr.join()
 
-    def check_tcp_payload(self, packet):
-        """
-        This method is used by examine_flow() method.
-        It returns True if a packet is not corrupted and has a valid TCP sequential TCP Payload, as created by generate_bidirectional() method'.
-        """
-        try:
-            int(str(packet[scapyall.TCP].payload)) in range(self.packets_to_send)
-            return True
-        except Exception as err:
-            return False
-
-    def no_flood(self, packet):
-        """
-        This method filters packets which are unique (i.e. no floods).
-        """
-        if (not int(str(packet[scapyall.TCP].payload)) in self.unique_id) and (packet[scapyall.Ether].src == self.dut_mac):
-            # This is a unique (no flooded) received packet.
-            self.unique_id.append(int(str(packet[scapyall.TCP].payload)))
-            return True
-        elif packet[scapyall.Ether].dst == self.dut_mac:
-            # This is a sent packet.
-            return True
-        else:
-            return False
-
     def examine_flow(self, filename = None):
         """
-        This method examines pcap file (if given), or self.packets scapy file.
-        The method compares TCP payloads of the packets one by one (assuming all payloads are consecutive integers),
-        and the losses if found - are treated as disruptions in Dataplane forwarding.
+        This method examines pcap file (if given), or the pcap file of the sniffer.
+        The packets are streamed by pcap_analyzer.DisruptionAnalyzer, which compares TCP payloads of the packets
+        one by one (assuming all payloads are consecutive integers), and the losses if found - are treated
+        as disruptions in Dataplane forwarding.
         All disruptions are saved to self.lost_packets dictionary, in format:
         disrupt_start_id = (missing_packets_count, disrupt_time, disrupt_start_timestamp, disrupt_stop_timestamp)
         """
-        if filename:
-            all_packets = scapyall.rdpcap(filename)
-        elif self.packets:
-            all_packets = self.packets
-        else:
+        if not filename:
+            if self.packets and not self.capture_file:
+                self.save_sniffed_packets()
+            filename = self.capture_file
+        if not filename:
             self.log("Filename and self.packets are not defined.")
             self.fails['dut'].add("Filename and self.packets are not defined")
             return None
-        # Filter out packets and remove floods:
-        self.unique_id = list()     # This list will contain all unique Payload ID, to filter out received floods.
-        filtered_packets = [ pkt for pkt in all_packets if
-            scapyall.TCP in pkt and
-            not scapyall.ICMP in pkt and
-            pkt[scapyall.TCP].sport == 1234 and
-            pkt[scapyall.TCP].dport == 5000 and
-            self.check_tcp_payload(pkt) and
-            self.no_flood(pkt)
-            ]
-
-        if self.vnet:
-            decap_packets = [ scapyall.Ether(str(pkt.payload.payload.payload)[8:]) for pkt in all_packets if
-                scapyall.UDP in pkt and
-                pkt[scapyall.UDP].sport == 1234
-                ]
-            filtered_decap_packets = [ pkt for pkt in decap_packets if
-                scapyall.TCP in pkt and
-                not scapyall.ICMP in pkt and
-                pkt[scapyall.TCP].sport == 1234 and
-                pkt[scapyall.TCP].dport == 5000 and
-                self.check_tcp_payload(pkt) and
-                self.no_flood(pkt)
-                ]
-            filtered_packets = filtered_packets + filtered_decap_packets
-
-        # Re-arrange packets, if delayed, by Payload ID and Timestamp:
-        packets = sorted(filtered_packets, key = lambda packet: (int(str(packet[scapyall.TCP].payload)), packet.time ))
-        self.lost_packets = dict()
+        analyzer = DisruptionAnalyzer(self.dut_mac, self.packets_to_send, vnet=self.vnet, log=self.log)
+        analyzer.analyze(filename, keep=True)
+
+        self.lost_packets = analyzer.lost_packets
         self.max_disrupt, self.total_disruption = 0, 0
-        sent_packets = dict()
+        self.disruption_start, self.disruption_stop = analyzer.disruption_start, analyzer.disruption_stop
+        received_counter = analyzer.received_counter
         self.fails['dut'].add("Sniffer failed to capture any traffic")
-        self.assertTrue(packets, "Sniffer failed to capture any traffic")
+        self.assertTrue(received_counter or analyzer.sent_counter, "Sniffer failed to capture any traffic")
         self.fails['dut'].clear()
-        if packets:
-            prev_payload, prev_time = 0, 0
-            sent_payload = 0
-            received_counter = 0    # Counts packets from dut.
-            self.disruption_start, self.disruption_stop = None, None
-            for packet in packets:
-                if packet[scapyall.Ether].dst == self.dut_mac:
-                    # This is a sent packet - keep track of it as payload_id:timestamp.
-                    sent_payload = int(str(packet[scapyall.TCP].payload))
-                    sent_packets[sent_payload] = packet.time
-                    continue
-                if packet[scapyall.Ether].src == self.dut_mac:
-                    # This is a received packet.
-                    received_time = packet.time
-                    received_payload = int(str(packet[scapyall.TCP].payload))
-                    received_counter += 1
-                if not (received_payload and received_time):
-                    # This is the first valid received packet.
-                    prev_payload = received_payload
-                    prev_time = received_time
-                    continue
-                if received_payload - prev_payload > 1:
-                    # Packets in a row are missing, a disruption.
-                    lost_id = (received_payload -1) - prev_payload # How many packets lost in a row.
-                    disrupt = (sent_packets[received_payload] - sent_packets[prev_payload + 1]) # How long disrupt lasted.
-                    # Add disrupt to the dict:
-                    self.lost_packets[prev_payload] = (lost_id, disrupt, received_time - disrupt, received_time)
-                    self.log("Disruption between packet ID %d and %d. For %.4f " % (prev_payload, received_payload, disrupt))
-                    if not self.disruption_start:
-                        self.disruption_start = datetime.datetime.fromtimestamp(prev_time)
-                    self.disruption_stop = datetime.datetime.fromtimestamp(received_time)
-                prev_payload = received_payload
-                prev_time = received_time
         self.fails['dut'].add("Sniffer failed to filter any traffic from DUT")
         self.assertTrue(received_counter, "Sniffer failed to filter any traffic from DUT")
         self.fails['dut'].clear()
-        self.disrupts_count = len(self.lost_packets) # Total disrupt counter.
+        self.disrupts_count = analyzer.disrupts_count # Total disrupt counter.
+        self.max_lost_id = analyzer.max_lost_id
+        self.max_disrupt_time = analyzer.max_disrupt_time
+        self.total_disrupt_packets = analyzer.total_disrupt_packets
+        self.total_disrupt_time = analyzer.total_disrupt_time
         if self.lost_packets:
-            # Find the longest loss with the longest time:
-            max_disrupt_from_id, (self.max_lost_id, self.max_disrupt_time, self.no_routing_start, self.no_routing_stop) = \
-                max(self.lost_packets.items(), key = lambda item:item[1][0:2])
-            self.total_disrupt_packets = sum([item[0] for item in self.lost_packets.values()])
-            self.total_disrupt_time = sum([item[1] for item in self.lost_packets.values()])
+            # The longest loss with the longest time:
+            self.no_routing_start, self.no_routing_stop = analyzer.no_routing_start, analyzer.no_routing_stop
             self.log("Disruptions happen between %s and %s after the reboot." % \
                 (str(self.disruption_start - self.reboot_start), str(self.disruption_stop - self.reboot_start)))
         else:
-            self.max_lost_id = 0
-            self.max_disrupt_time = 0
-            self.total_disrupt_packets = 0
-            self.total_disrupt_time = 0
             self.log("Gaps in forwarding not found.")
         self.log("Total incoming packets captured %d" % received_counter)
-        if packets:
-            filename = '/tmp/capture_filtered.pcap' if self.sad_oper is None else "/tmp/capture_filtered_%s.pcap" % self.sad_oper
-            scapyall.wrpcap(filename, packets)
-            self.log("Filtered pcap dumped to %s" % filename)
+        if self.sniffer_drops:
+            # Packets dropped by the sniffer look like lost by the dataplane
+            self.log("Sniffer dropped %d packet(s), the disruptions may include packets lost by the sniffer" % self.sniffer_drops)
+        filtered = '/tmp/capture_filtered.pcap' if self.sad_oper is None else "/tmp/capture_filtered_%s.pcap" % self.sad_oper
+        analyzer.save_filtered(filename, filtered)
+        self.log("Filtered pcap dumped to %s" % filtered)
 
     def check_forwarding_stop(self, signal):
         self.asic_start_recording_vlan_reachability()
@@ -5,6 +5,9 @@ Description:    This file contains the FIB test for SONIC
 
 Usage:          Examples of how to use log analyzer
                 ptf --test-dir ptftests fib_test.FibTest --platform-dir ptftests --qlen=2000 --platform remote -t 'setup_info="/root/test_fib_setup_info.json";testbed_mtu=1514;ipv4=True;test_balancing=True;ipv6=True' --relax --debug info --log-file /tmp/fib_test.FibTest.ipv4.True.ipv6.True.2020-12-22-08:17:05.log --socket-recv-size 16384
+
+                Add 'pipelined=True' to the test params to verify every range of the FIB with probes sent back to back,
+                instead of one packet at a time on a sample of 150 ranges.
 '''
 
 #---------------------------------------------------------------------
@@ -14,6 +17,10 @@ import logging
 import random
 import time
 import json
+import struct
+
+from collections import namedtuple
+from collections import OrderedDict
 
 import ptf
 import ptf.packet as scapy
@@ -27,8 +34,13 @@ from ptf.testutils import simple_tcpv6_packet
 from ptf.testutils import send_packet
 from ptf.testutils import verify_packet_any_port
 from ptf.testutils import verify_no_packet_any
+from ptf.testutils import dp_poll
 
 import fib
+import tagged_packet
+
+# A probe of the pipelined verification, the packets of a probe carry its flow ID in their payload
+Probe = namedtuple('Probe', ['flow_id', 'ip_range', 'dst_ip', 'src_port', 'exp_ports', 'pkt', 'exp_pkt'])
 
 class FibTest(BaseTest):
     '''
@@ -66,6 +78,12 @@ class FibTest(BaseTest):
     DEFAULT_BALANCING_TEST_NUMBER = 1
     ACTION_FWD = 'fwd'
     ACTION_DROP = 'drop'
+    DEFAULT_PIPELINE_WINDOW = 1000
+    DEFAULT_PIPELINE_TIMEOUT = 2
+    PIPELINE_POLL_INTERVAL = 0.01
+    FLOW_TAG = b'FIBT'
+    IPV4_SRC = '30.0.0.1'
+    IPV6_SRC = '2000:0030::1'
 
     _required_params = [
         'fib_info_files',
@@ -103,6 +121,9 @@ class FibTest(BaseTest):
          - dst_vid                vlan tag id of dst pkts. Default: None(untag)
          - ignore_ttl:            mask the ttl field in the expected packet
          - single_fib_for_duts:   have a single fib file for all DUTs in multi-dut case. Default: False
+         - pipelined:             check all the ranges with flow tagged probes kept in flight. Default: False
+         - pipeline_window:       maximum number of probes in flight, below the qlen of ptf. Default: 1000
+         - pipeline_timeout:      seconds to wait for a probe before it is failed. Default: 2
         '''
         self.dataplane = ptf.dataplane_instance
 
@@ -137,6 +158,12 @@ class FibTest(BaseTest):
         self.ignore_ttl = self.test_params.get('ignore_ttl', False)
         self.single_fib = self.test_params.get('single_fib_for_duts', False)
 
+        self.pipelined = self.test_params.get('pipelined', False)
+        self.pipeline_window = self.test_params.get('pipeline_window', self.DEFAULT_PIPELINE_WINDOW)
+        self.pipeline_timeout = self.test_params.get('pipeline_timeout', self.DEFAULT_PIPELINE_TIMEOUT)
+        self.flow_id = 0
+        self.router_mac_bytes = tagged_packet.RouterMacBytes(self.router_macs, self.ptf_test_port_map)
+
     def check_ip_ranges(self, ipv4=True):
         for dut_index, fib in enumerate(self.fibs):
             if ipv4:
@@ -144,14 +171,18 @@ class FibTest(BaseTest):
             else:
                 ip_ranges = fib.ipv6_ranges()
 
-            if len(ip_ranges) > 150:
-                covered_ip_ranges = ip_ranges[:100] + random.sample(ip_ranges[100:], 50)  # Limit test execution time
+            if self.pipelined:
+                covered_ip_ranges = [ip_range for ip_range in ip_ranges if ip_range.get_first_ip() in fib]
+                self.check_ip_ranges_pipelined(covered_ip_ranges, dut_index, ipv4)
             else:
-                covered_ip_ranges = ip_ranges[:]
+                if len(ip_ranges) > 150:
+                    covered_ip_ranges = ip_ranges[:100] + random.sample(ip_ranges[100:], 50)  # Limit test execution time
+                else:
+                    covered_ip_ranges = ip_ranges[:]
 
-            for ip_range in covered_ip_ranges:
-                if ip_range.get_first_ip() in fib:
-                    self.check_ip_range(ip_range, dut_index, ipv4)
+                for ip_range in covered_ip_ranges:
+                    if ip_range.get_first_ip() in fib:
+                        self.check_ip_range(ip_range, dut_index, ipv4)
 
             random.shuffle(covered_ip_ranges)
             self.check_balancing(covered_ip_ranges, dut_index, ipv4)
@@ -201,14 +232,161 @@ class FibTest(BaseTest):
                 # Change balancing_test_times according to number of next hop groups
                 logging.info('Checking ip range balancing {}, src_port={}, exp_ports={}, dst_ip={}, dut_index={}'\
                     .format(ip_range, src_port, exp_port_list, dst_ip, dut_index))
-                for i in range(0, self.balancing_test_times*len(exp_port_list)):
-                    (matched_index, received) = self.check_ip_route(src_port, dst_ip, exp_port_list, ipv4)
-                    hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
+                if self.pipelined:
+                    hit_count_map = self.check_balancing_pipelined(ip_range, src_port, dst_ip, exp_port_list, ipv4)
+                else:
+                    for i in range(0, self.balancing_test_times*len(exp_port_list)):
+                        (matched_index, received) = self.check_ip_route(src_port, dst_ip, exp_port_list, ipv4)
+                        hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
                 self.check_hit_count_map(next_hop.get_next_hop(), hit_count_map)
                 self.balancing_test_count += 1
                 if self.balancing_test_count >= self.balancing_test_number:
                     break
 
+    def tag_flow(self, pkt, flow_id):
+        '''
+        @summary: Write the flow tag and the flow ID at the head of the TCP payload, keeping the packet length
+        '''
+        tagged_packet.tag_payload(pkt, self.FLOW_TAG + struct.pack('!I', flow_id))
+
+    def build_probe(self, ip_range, dst_ip, src_port, exp_ports, ipv4=True):
+        self.flow_id = (self.flow_id + 1) & 0xFFFFFFFF
+        sport = random.randint(0, 65535)
+        dport = random.randint(0, 65535)
+        if ipv4:
+            pkt, exp_pkt = self.build_ipv4_pkts(src_port, dst_ip, sport, dport, self.flow_id)
+        else:
+            pkt, exp_pkt = self.build_ipv6_pkts(src_port, dst_ip, sport, dport, self.flow_id)
+        return Probe(self.flow_id, ip_range, dst_ip, src_port, exp_ports, pkt, exp_pkt)
+
+    def verify_probe(self, probe, rcvd_port, rcvd_pkt):
+        '''
+        @summary: Verify the packet received for a probe like check_ipv4_route and check_ipv6_route do
+        @return: None when the probe passed, else the reason of the failure
+        '''
+        if self.pkt_action == self.ACTION_DROP:
+            if rcvd_port is not None and rcvd_port in probe.exp_ports:
+                return 'dst_ip {} from port {} was forwarded to port {}'.format(probe.dst_ip, probe.src_port, rcvd_port)
+            return None
+        if rcvd_port is None:
+            return 'dst_ip {} from port {} was not received on any of ports {}'\
+                .format(probe.dst_ip, probe.src_port, probe.exp_ports)
+        if rcvd_port not in probe.exp_ports:
+            return 'dst_ip {} from port {} was received on port {} instead of one of ports {}'\
+                .format(probe.dst_ip, probe.src_port, rcvd_port, probe.exp_ports)
+        if not probe.exp_pkt.pkt_match(rcvd_pkt):
+            return 'dst_ip {} from port {} was received on port {} modified'\
+                .format(probe.dst_ip, probe.src_port, rcvd_port)
+        if rcvd_pkt[6:12] != self.router_mac_bytes.get(rcvd_port):
+            return 'dst_ip {} from port {} was received on port {} but the src mac doesn\'t match, expected {}'\
+                .format(probe.dst_ip, probe.src_port, rcvd_port,
+                        self.router_macs[self.ptf_test_port_map[str(rcvd_port)]['target_dut']])
+        return None
+
+    def drain_probes(self, in_flight, timeout):
+        '''
+        @summary: Match the packets received from the dataplane queues to the probes in flight by their flow ID,
+            then expire the probes sent more than pipeline_timeout ago
+        @param in_flight: OrderedDict of flow_id -> (probe, send time), in order of sending
+        @param timeout: seconds to wait for the first packet
+        @return: list of (probe, rcvd_port, rcvd_pkt), rcvd_port is None for the expired probes
+        '''
+        results = []
+        while in_flight:
+            result = dp_poll(self, device_number=0, timeout=timeout)
+            if not isinstance(result, self.dataplane.PollSuccess):
+                break
+            timeout = 0
+            index = result.packet.find(self.FLOW_TAG)
+            if index < 0 or len(result.packet) < index + len(self.FLOW_TAG) + 4:
+                continue
+            flow_id = struct.unpack_from('!I', result.packet, index + len(self.FLOW_TAG))[0]
+            entry = in_flight.pop(flow_id, None)
+            if entry is None:
+                # flooded copy of a probe already matched, or a probe of an earlier check
+                continue
+            results.append((entry[0], result.port, result.packet))
+
+        now = time.time()
+        while in_flight:
+            flow_id = next(iter(in_flight))
+            probe, sent = in_flight[flow_id]
+            if now - sent < self.pipeline_timeout:
+                break
+            del in_flight[flow_id]
+            results.append((probe, None, None))
+        return results
+
+    def run_probes(self, probes):
+        '''
+        @summary: Send the probes back to back keeping at most pipeline_window of them in flight
+        @param probes: iterable of Probe
+        @return: generator of (probe, rcvd_port, rcvd_pkt) in order of completion
+        '''
+        self.dataplane.flush()
+        in_flight = OrderedDict()
+        for probe in probes:
+            while len(in_flight) >= self.pipeline_window:
+                for result in self.drain_probes(in_flight, self.PIPELINE_POLL_INTERVAL):
+                    yield result
+            send_packet(self, probe.src_port, probe.pkt)
+            in_flight[probe.flow_id] = (probe, time.time())
+            if len(in_flight) % 64 == 0:
+                for result in self.drain_probes(in_flight, 0):
+                    yield result
+        while in_flight:
+            for result in self.drain_probes(in_flight, self.PIPELINE_POLL_INTERVAL):
+                yield result
+
+    def iter_range_probes(self, ip_ranges, ipv4=True):
+        for ip_range in ip_ranges:
+            dst_ips = [ip_range.get_first_ip()]
+            if ip_range.length > 1:
+                dst_ips.append(ip_range.get_last_ip())
+            if ip_range.length > 2:
+                dst_ips.append(ip_range.get_random_ip())
+            for dst_ip in dst_ips:
+                src_port, exp_ports, _ = self.get_src_and_exp_ports(dst_ip)
+                if not exp_ports:
+                    logging.info('Skip checking ip range {} with exp_ports {}'.format(ip_range, exp_ports))
+                    break
+                yield self.build_probe(ip_range, dst_ip, src_port, exp_ports, ipv4)
+
+    def check_ip_ranges_pipelined(self, ip_ranges, dut_index, ipv4=True):
+        '''
+        @summary: Check all the ip ranges with the pipelined probes and report the failed ranges
+        '''
+        start = time.time()
+        (count, failures) = (0, OrderedDict())
+        for probe, rcvd_port, rcvd_pkt in self.run_probes(self.iter_range_probes(ip_ranges, ipv4)):
+            count += 1
+            error = self.verify_probe(probe, rcvd_port, rcvd_pkt)
+            if error:
+                failures.setdefault(str(probe.ip_range), []).append(error)
+        logging.info('Checked {} ip ranges with {} probes in {:.1f}s, dut_index={}, {} ranges failed'\
+            .format(len(ip_ranges), count, time.time() - start, dut_index, len(failures)))
+        for ip_range, errors in failures.items():
+            logging.error('ip range {} failed: {}'.format(ip_range, '; '.join(errors)))
+        if failures:
+            ip_range, errors = next(iter(failures.items()))
+            self.fail('{} of {} ip ranges failed, first failed ip range {}: {}'\
+                .format(len(failures), len(ip_ranges), ip_range, errors[0]))
+
+    def check_balancing_pipelined(self, ip_range, src_port, dst_ip, exp_port_list, ipv4=True):
+        '''
+        @summary: Send the balancing packets of a range with the pipelined probes
+        @return: dict of port -> number of packets received
+        '''
+        count = self.balancing_test_times*len(exp_port_list)
+        probes = (self.build_probe(ip_range, dst_ip, src_port, exp_port_list, ipv4) for _ in range(count))
+        hit_count_map = {}
+        for probe, rcvd_port, rcvd_pkt in self.run_probes(probes):
+            error = self.verify_probe(probe, rcvd_port, rcvd_pkt)
+            if error:
+                self.fail('ip range {} balancing failed: {}'.format(ip_range, error))
+            hit_count_map[rcvd_port] = hit_count_map.get(rcvd_port, 0) + 1
+        return hit_count_map
+
     def check_ip_route(self, src_port, dst_ip_addr, dst_port_list, ipv4=True):
         if ipv4:
             res = self.check_ipv4_route(src_port, dst_ip_addr, dst_port_list)
@@ -228,16 +406,13 @@ class FibTest(BaseTest):
 
         return (matched_port, received)
 
-    def check_ipv4_route(self, src_port, dst_ip_addr, dst_port_list):
+    def build_ipv4_pkts(self, src_port, dst_ip_addr, sport, dport, flow_id=None):
         '''
-        @summary: Check IPv4 route works.
-        @param src_port: index of port to use for sending packet to switch
-        @param dest_ip_addr: destination IP to build packet with.
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        @summary: Build the IPv4 packet sent to the switch and the masked packet expected back.
+        @param flow_id: flow ID tagged in the payload of both packets, None to keep the default payload
+        @return (pkt, masked_exp_pkt)
         '''
-        sport = random.randint(0, 65535)
-        dport = random.randint(0, 65535)
-        ip_src = "30.0.0.1"
+        ip_src = self.IPV4_SRC
         ip_dst = dst_ip_addr
         src_mac = self.dataplane.get_mac(0, src_port)
 
@@ -265,6 +440,9 @@ class FibTest(BaseTest):
                             ip_options=self.ip_options,
                             dl_vlan_enable=self.dst_vid is not None,
                             vlan_vid=self.dst_vid or 0)
+        if flow_id is not None:
+            self.tag_flow(pkt, flow_id)
+            self.tag_flow(exp_pkt, flow_id)
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "dst")
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "src")
@@ -275,6 +453,21 @@ class FibTest(BaseTest):
             masked_exp_pkt.set_do_not_care_scapy(scapy.IP, "chksum")
             masked_exp_pkt.set_do_not_care_scapy(scapy.TCP, "chksum")
 
+        return pkt, masked_exp_pkt
+
+    def check_ipv4_route(self, src_port, dst_ip_addr, dst_port_list):
+        '''
+        @summary: Check IPv4 route works.
+        @param src_port: index of port to use for sending packet to switch
+        @param dest_ip_addr: destination IP to build packet with.
+        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        '''
+        sport = random.randint(0, 65535)
+        dport = random.randint(0, 65535)
+        ip_src = self.IPV4_SRC
+        ip_dst = dst_ip_addr
+        pkt, masked_exp_pkt = self.build_ipv4_pkts(src_port, ip_dst, sport, dport)
+
         send_packet(self, src_port, pkt)
         logging.info('Sent Ether(src={}, dst={})/IP(src={}, dst={})/TCP(sport={}, dport={}) on port {}'\
             .format(pkt.src,
@@ -305,17 +498,13 @@ class FibTest(BaseTest):
             return verify_no_packet_any(self, masked_exp_pkt, dst_port_list)
     #---------------------------------------------------------------------
 
-    def check_ipv6_route(self, src_port, dst_ip_addr, dst_port_list):
+    def build_ipv6_pkts(self, src_port, dst_ip_addr, sport, dport, flow_id=None):
         '''
-        @summary: Check IPv6 route works.
-        @param source_port_index: index of port to use for sending packet to switch
-        @param dest_ip_addr: destination IP to build packet with.
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
-        @return Boolean
+        @summary: Build the IPv6 packet sent to the switch and the masked packet expected back.
+        @param flow_id: flow ID tagged in the payload of both packets, None to keep the default payload
+        @return (pkt, masked_exp_pkt)
         '''
-        sport = random.randint(0, 65535)
-        dport = random.randint(0, 65535)
-        ip_src = '2000:0030::1'
+        ip_src = self.IPV6_SRC
         ip_dst = dst_ip_addr
         src_mac = self.dataplane.get_mac(0, src_port)
 
@@ -341,6 +530,9 @@ class FibTest(BaseTest):
                                 ipv6_hlim=max(self.ttl-1, 0),
                                 dl_vlan_enable=self.dst_vid is not None,
                                 vlan_vid=self.dst_vid or 0)
+        if flow_id is not None:
+            self.tag_flow(pkt, flow_id)
+            self.tag_flow(exp_pkt, flow_id)
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether,"dst")
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether,"src")
@@ -351,6 +543,22 @@ class FibTest(BaseTest):
             masked_exp_pkt.set_do_not_care_scapy(scapy.IPv6, "chksum")
             masked_exp_pkt.set_do_not_care_scapy(scapy.TCP, "chksum")
 
+        return pkt, masked_exp_pkt
+
+    def check_ipv6_route(self, src_port, dst_ip_addr, dst_port_list):
+        '''
+        @summary: Check IPv6 route works.
+        @param source_port_index: index of port to use for sending packet to switch
+        @param dest_ip_addr: destination IP to build packet with.
+        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        @return Boolean
+        '''
+        sport = random.randint(0, 65535)
+        dport = random.randint(0, 65535)
+        ip_src = self.IPV6_SRC
+        ip_dst = dst_ip_addr
+        pkt, masked_exp_pkt = self.build_ipv6_pkts(src_port, ip_dst, sport, dport)
+
         send_packet(self, src_port, pkt)
         logging.info('Sent Ether(src={}, dst={})/IPv6(src={}, dst={})/TCP(sport={}, dport={}) on port {}'\
             .format(pkt.src,
@@ -9,6 +9,8 @@ import logging
 import random
 import json
 import time
+import math
+import struct
 
 from ipaddress import ip_address, ip_network
 
@@ -22,9 +24,50 @@ from ptf.testutils import simple_tcp_packet
 from ptf.testutils import simple_tcpv6_packet
 from ptf.testutils import send_packet
 from ptf.testutils import verify_packet_any_port
+from ptf.testutils import dp_poll
 
 import fib
 import lpm
+import tagged_packet
+
+def chi_square_pvalue(statistic, dof):
+    '''
+    @summary: Probability of a chi-square statistic at least this large under an even distribution,
+        the regularized upper incomplete gamma function Q(dof/2, statistic/2)
+    '''
+    if dof <= 0:
+        return 1.0
+    (a, x) = (dof / 2.0, statistic / 2.0)
+    if x <= 0:
+        return 1.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # series of the lower incomplete gamma function
+        (term, total, n) = (1.0 / a, 1.0 / a, a)
+        while abs(term) > abs(total) * 1e-12:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    # continued fraction of the upper incomplete gamma function (modified Lentz)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-12:
+            break
+    return math.exp(log_prefix) * h
 
 class HashTest(BaseTest):
 
@@ -33,6 +76,8 @@ class HashTest(BaseTest):
     #---------------------------------------------------------------------
     DEFAULT_BALANCING_RANGE = 0.25
     BALANCING_TEST_TIMES = 625
+    DEFAULT_BATCH_TIMEOUT = 5
+    BATCH_TAG = b'HASH'
 
     _required_params = [
         'fib_info_files',
@@ -82,6 +127,14 @@ class HashTest(BaseTest):
         self.ignore_ttl = self.test_params.get('ignore_ttl', False)
         self.single_fib = self.test_params.get('single_fib_for_duts', False)
 
+        # batch_mode: send all the packets of a hash key back to back, else one by one for debugging
+        self.batch_mode = self.test_params.get('batch_mode', True)
+        self.batch_timeout = self.test_params.get('batch_timeout', self.DEFAULT_BATCH_TIMEOUT)
+        # chi_square_alpha: fail when the p-value of the hit count distribution is below, None to only report it
+        self.chi_square_alpha = self.test_params.get('chi_square_alpha', None)
+        self.batch_id = 0
+        self.router_mac_bytes = tagged_packet.RouterMacBytes(self.router_macs, self.ptf_test_port_map)
+
     def get_src_and_exp_ports(self, dst_ip):
         while True:
             src_port = int(random.choice(self.src_ports))
@@ -139,6 +192,13 @@ class HashTest(BaseTest):
                 hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
             logging.info("hit count map: {}".format(hit_count_map))
             assert True if len(hit_count_map.keys()) == 1 else False
+        elif self.batch_mode:
+            logging.info('Checking hash key {} in batch, src_port={}, exp_ports={}, dst_ip={}'\
+                .format(hash_key, src_port, exp_port_list, dst_ip))
+            hit_count_map = self.check_hash_batch(hash_key, src_port, dst_ip, exp_port_list)
+            logging.info("hash_key={}, hit count map: {}".format(hash_key, hit_count_map))
+
+            self.check_balancing(next_hop.get_next_hop(), hit_count_map)
         else:
             for _ in range(0, self.balancing_test_times*len(exp_port_list)):
                 logging.info('Checking hash key {}, src_port={}, exp_ports={}, dst_ip={}'\
@@ -149,6 +209,97 @@ class HashTest(BaseTest):
 
             self.check_balancing(next_hop.get_next_hop(), hit_count_map)
 
+    def check_hash_batch(self, hash_key, src_port, dst_ip, dst_port_list):
+        '''
+        @summary: Send all the packets varying the hash key back to back and count them on the egress ports
+        @return: dict of port -> number of packets received
+        '''
+        count = self.balancing_test_times*len(dst_port_list)
+        ipv4 = ip_network(unicode(dst_ip)).version == 4
+        self.batch_id += 1
+
+        # pre-generate the packets, each one tagged with the batch ID and its index
+        (pkts, masks) = ([], [])
+        for index in range(count):
+            tag = self.BATCH_TAG + struct.pack('!II', self.batch_id, index)
+            if ipv4:
+                (pkt, masked_exp_pkt, _, _, _, _) = self.build_ipv4_pkts(hash_key, src_port, tag)
+            else:
+                (pkt, masked_exp_pkt, _, _, _, _) = self.build_ipv6_pkts(hash_key, src_port, tag)
+            pkts.append(bytes(pkt))
+            masks.append(masked_exp_pkt)
+
+        self.dataplane.flush()
+        received = {}
+        start = time.time()
+        for index, pkt in enumerate(pkts):
+            send_packet(self, src_port, pkt)
+            # keep the ptf queues below qlen
+            if index % 256 == 255:
+                self.drain_batch(received, 0)
+        logging.info("hash_key={}, sent {} packets on port {} in {:.2f}s"\
+            .format(hash_key, count, src_port, time.time() - start))
+        deadline = time.time() + self.batch_timeout
+        while len(received) < count and time.time() < deadline:
+            self.drain_batch(received, max(deadline - time.time(), 0))
+
+        hit_count_map = {}
+        errors = []
+        for index, masked_exp_pkt in enumerate(masks):
+            if index not in received:
+                errors.append("packet {} was not received on any of ports {}".format(index, dst_port_list))
+                continue
+            (rcvd_port, rcvd_pkt) = received[index]
+            if rcvd_port not in dst_port_list:
+                errors.append("packet {} was received on port {} instead of one of ports {}"\
+                    .format(index, rcvd_port, dst_port_list))
+            elif not masked_exp_pkt.pkt_match(rcvd_pkt):
+                errors.append("packet {} was received on port {} modified".format(index, rcvd_port))
+            elif rcvd_pkt[6:12] != self.router_mac_bytes.get(rcvd_port):
+                errors.append("packet {} was received on port {} but the src mac doesn't match, expected {}"\
+                    .format(index, rcvd_port, self.router_macs[self.ptf_test_port_map[str(rcvd_port)]['target_dut']]))
+            hit_count_map[rcvd_port] = hit_count_map.get(rcvd_port, 0) + 1
+        if errors:
+            logging.error("hash_key={}, {} of {} packets failed: {}".format(hash_key, len(errors), count, errors[:10]))
+        assert not errors
+        return hit_count_map
+
+    def drain_batch(self, received, timeout):
+        '''
+        @summary: Read the packets of the current batch from the dataplane queues
+        @param received: dict of packet index -> (port, packet), updated
+        '''
+        while True:
+            result = dp_poll(self, device_number=0, timeout=timeout)
+            if not isinstance(result, self.dataplane.PollSuccess):
+                return
+            timeout = 0
+            offset = result.packet.find(self.BATCH_TAG)
+            if offset < 0 or len(result.packet) < offset + len(self.BATCH_TAG) + 8:
+                continue
+            (batch_id, index) = struct.unpack_from('!II', result.packet, offset + len(self.BATCH_TAG))
+            if batch_id != self.batch_id or index in received:
+                # packet of an earlier batch or flooded copy
+                continue
+            received[index] = (result.port, result.packet)
+
+    def chi_square(self, dest_port_list, port_hit_cnt):
+        '''
+        @summary: Pearson's chi-square statistic of the hit counts against an even distribution over the ECMP
+            entries and over the LAG members of each entry
+        @return (statistic, degrees of freedom, p-value)
+        '''
+        total_hit_cnt = sum(port_hit_cnt.values())
+        statistic = 0.0
+        dof = -1
+        for ecmp_entry in dest_port_list:
+            for member in ecmp_entry:
+                expected = float(total_hit_cnt) / len(dest_port_list) / len(ecmp_entry)
+                if expected > 0:
+                    statistic += (port_hit_cnt.get(member, 0) - expected) ** 2 / expected
+                dof += 1
+        return (statistic, dof, chi_square_pvalue(statistic, dof))
+
     def check_ip_route(self, hash_key, src_port, dst_ip, dst_port_list):
         if ip_network(unicode(dst_ip)).version == 4:
             (matched_index, received) = self.check_ipv4_route(hash_key, src_port, dst_port_list)
@@ -177,12 +328,11 @@ class HashTest(BaseTest):
             if ip_proto not in skip_ports:
                 return ip_proto
 
-    def check_ipv4_route(self, hash_key, src_port, dst_port_list):
+    def build_ipv4_pkts(self, hash_key, src_port, tag=None):
         '''
-        @summary: Check IPv4 route works.
-        @param hash_key: hash key to build packet with.
-        @param src_port: index of port to use for sending packet to switch
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        @summary: Build the IPv4 packet varying the hash key field and the masked packet expected back.
+        @param tag: bytes written at the head of the TCP payload of both packets, None to keep the default payload
+        @return (pkt, masked_exp_pkt, ip_src, ip_dst, sport, dport)
         '''
         base_mac = self.dataplane.get_mac(0, 0)
         ip_src = self.src_ip_interval.get_random_ip() if hash_key == 'src-ip' else self.src_ip_interval.get_first_ip()
@@ -219,6 +369,9 @@ class HashTest(BaseTest):
         if hash_key == 'ip-proto':
             pkt['IP'].proto = ip_proto
             exp_pkt['IP'].proto = ip_proto
+        if tag is not None:
+            tagged_packet.tag_payload(pkt, tag)
+            tagged_packet.tag_payload(exp_pkt, tag)
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "dst")
         # mask the chksum also if masking the ttl
@@ -228,6 +381,17 @@ class HashTest(BaseTest):
             masked_exp_pkt.set_do_not_care_scapy(scapy.TCP, "chksum")
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "src")
 
+        return (pkt, masked_exp_pkt, ip_src, ip_dst, sport, dport)
+
+    def check_ipv4_route(self, hash_key, src_port, dst_port_list):
+        '''
+        @summary: Check IPv4 route works.
+        @param hash_key: hash key to build packet with.
+        @param src_port: index of port to use for sending packet to switch
+        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        '''
+        (pkt, masked_exp_pkt, ip_src, ip_dst, sport, dport) = self.build_ipv4_pkts(hash_key, src_port)
+
         send_packet(self, src_port, pkt)
         logging.info('Sent Ether(src={}, dst={})/IP(src={}, dst={})/TCP(sport={}, dport={} on port {})'\
             .format(pkt.src,
@@ -254,13 +418,11 @@ class HashTest(BaseTest):
                             format(ip_src, ip_dst, src_port, dst_port_list[rcvd_port], exp_src_mac, actual_src_mac))
         return (rcvd_port, rcvd_pkt)
 
-    def check_ipv6_route(self, hash_key, src_port, dst_port_list):
+    def build_ipv6_pkts(self, hash_key, src_port, tag=None):
         '''
-        @summary: Check IPv6 route works.
-        @param hash_key: hash key to build packet with.
-        @param in_port: index of port to use for sending packet to switch
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
-        @return Boolean
+        @summary: Build the IPv6 packet varying the hash key field and the masked packet expected back.
+        @param tag: bytes written at the head of the TCP payload of both packets, None to keep the default payload
+        @return (pkt, masked_exp_pkt, ip_src, ip_dst, sport, dport)
         '''
         base_mac = self.dataplane.get_mac(0, 0)
         ip_src = self.src_ip_interval.get_random_ip() if hash_key == 'src-ip' else self.src_ip_interval.get_first_ip()
@@ -298,6 +460,9 @@ class HashTest(BaseTest):
             pkt['IPv6'].nh = ip_proto
             exp_pkt['IPv6'].nh = ip_proto
 
+        if tag is not None:
+            tagged_packet.tag_payload(pkt, tag)
+            tagged_packet.tag_payload(exp_pkt, tag)
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether,"dst")
         # mask the chksum also if masking the ttl
@@ -307,6 +472,18 @@ class HashTest(BaseTest):
             masked_exp_pkt.set_do_not_care_scapy(scapy.TCP, "chksum")
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "src")
 
+        return (pkt, masked_exp_pkt, ip_src, ip_dst, sport, dport)
+
+    def check_ipv6_route(self, hash_key, src_port, dst_port_list):
+        '''
+        @summary: Check IPv6 route works.
+        @param hash_key: hash key to build packet with.
+        @param in_port: index of port to use for sending packet to switch
+        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        @return Boolean
+        '''
+        (pkt, masked_exp_pkt, ip_src, ip_dst, sport, dport) = self.build_ipv6_pkts(hash_key, src_port)
+
         send_packet(self, src_port, pkt)
         logging.info('Sent Ether(src={}, dst={})/IPv6(src={}, dst={})/TCP(sport={}, dport={} on port {})'\
             .format(pkt.src,
@@ -371,6 +548,11 @@ class HashTest(BaseTest):
                             % ("LAG", str(member), total_entry_hit_cnt//len(ecmp_entry), port_hit_cnt.get(member, 0), str(round(p, 4)*100) + '%'))
                 result &= r
 
+        (statistic, dof, pvalue) = self.chi_square(dest_port_list, port_hit_cnt)
+        logging.info("chi-square {:.2f} with {} degrees of freedom, p-value {:.4f}".format(statistic, dof, pvalue))
+        if self.chi_square_alpha is not None:
+            result &= pvalue >= self.chi_square_alpha
+
         assert result
 
     def runTest(self):
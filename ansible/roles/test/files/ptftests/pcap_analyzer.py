@@ -0,0 +1,381 @@
+'''
+Streaming analyzer of the advanced-reboot capture.
+
+The pcap file is read in blocks and every record is parsed by the header offsets,
+without building scapy packets. The TCP payload of the probes is the packet ID
+(see ReloadTest.generate_bidirectional), so the sent and received timestamps are kept
+in arrays indexed by the ID, the floods are filtered out with a bitmap of the received IDs
+and the gaps in the received IDs are the dataplane disruptions.
+
+Usage:
+    python pcap_analyzer.py <capture.pcap> <dut_mac> <packets_to_send> [--vnet]
+    python pcap_analyzer.py --bench [packets]
+'''
+
+import os
+import sys
+import time
+import array
+import struct
+import binascii
+import datetime
+import tempfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAP_GLOBAL_HEADER_LEN = 24
+PCAP_RECORD_HEADER_LEN = 16
+LINKTYPE_ETHERNET = 1
+
+ETH_HEADER_LEN = 14
+ETH_P_IP = 0x0800
+ETH_P_8021Q = 0x8100
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+UDP_HEADER_LEN = 8
+VXLAN_HEADER_LEN = 8
+
+PROBE_SPORT = 1234
+PROBE_DPORT = 5000
+
+ETH_TYPE = struct.Struct('!H')
+IPV4_HEADER = struct.Struct('!B8xB')     # version/ihl, protocol
+L4_PORTS = struct.Struct('!HH')
+TCP_DATA_OFFSET = struct.Struct('!12xB')
+
+BLOCK_SIZE = 4 * 1024 * 1024
+NO_TIME = -1.0
+
+
+def mac_to_bytes(mac):
+    return binascii.unhexlify(mac.replace(':', '').replace('-', '').replace('.', ''))
+
+
+class PcapError(Exception):
+    pass
+
+
+def iter_pcap_records(filename, block_size=BLOCK_SIZE):
+    '''
+    @summary: Stream the records of a libpcap file.
+    @param filename: pcap file name
+    @param block_size: size of the blocks read from the file
+    @return: generator of (buffer, frame offset in buffer, frame length, timestamp, frame position in file)
+    '''
+    with open(filename, 'rb') as pcap:
+        header = pcap.read(PCAP_GLOBAL_HEADER_LEN)
+        if len(header) < PCAP_GLOBAL_HEADER_LEN:
+            raise PcapError("%s: truncated pcap header" % filename)
+        for endian in '<>':
+            magic, = struct.unpack(endian + 'I', header[:4])
+            if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+                break
+        else:
+            raise PcapError("%s: not a libpcap file" % filename)
+        linktype, = struct.unpack(endian + 'I', header[20:24])
+        if linktype != LINKTYPE_ETHERNET:
+            raise PcapError("%s: unsupported link type %d" % (filename, linktype))
+        scale = 1e-9 if magic == PCAP_MAGIC_NSEC else 1e-6
+        record = struct.Struct(endian + 'IIII')
+
+        position = PCAP_GLOBAL_HEADER_LEN    # File position of buf[0]
+        buf = b''
+        while True:
+            block = pcap.read(block_size)
+            if not block:
+                break
+            buf = buf + block if buf else block
+            offset, size = 0, len(buf)
+            while offset + PCAP_RECORD_HEADER_LEN <= size:
+                sec, frac, caplen, _ = record.unpack_from(buf, offset)
+                start = offset + PCAP_RECORD_HEADER_LEN
+                if start + caplen > size:
+                    break
+                yield buf, start, caplen, sec + frac * scale, position + start
+                offset = start + caplen
+            position += offset
+            buf = buf[offset:]
+
+
+class DisruptionAnalyzer(object):
+    '''
+    @summary: Computes the dataplane disruptions from the capture of the advanced-reboot probes.
+
+    The results are the ones of ReloadTest.examine_flow():
+        lost_packets: disrupt_start_id = (missing_packets_count, disrupt_time, disrupt_start_timestamp, disrupt_stop_timestamp)
+        max_lost_id, max_disrupt_time, no_routing_start, no_routing_stop: the longest disruption
+        total_disrupt_packets, total_disrupt_time, disrupts_count: all the disruptions
+        disruption_start, disruption_stop: datetime of the first and the last disruptions
+        received_counter: unique packets received from the DUT
+    '''
+    def __init__(self, dut_mac, packets_to_send, vnet=False, log=None):
+        self.dut_mac = mac_to_bytes(dut_mac)
+        self.packets_to_send = packets_to_send
+        self.vnet = vnet
+        self.log = log if log else lambda message: None
+        self.reset()
+
+    def reset(self):
+        count = self.packets_to_send
+        self.sent_time = array.array('d', [NO_TIME]) * count
+        self.recv_time = array.array('d', [NO_TIME]) * count
+        self.received = bytearray(count)    # Bitmap of the received IDs, filters out the floods
+        # The decapsulated packets are filtered after the plain ones, as examine_flow() does
+        self.decap_time = array.array('d', [NO_TIME]) * count if self.vnet else None
+        self.decap_received = bytearray(count) if self.vnet else None
+        self.captured = 0
+        self.sent_counter = 0
+        self.floods = 0
+        # Filtered records for save_filtered(): frame position in file, length, ID, timestamp
+        self.records = (array.array('L'), array.array('L'), array.array('L'), array.array('d'))
+
+    def parse_probe(self, buf, offset, length):
+        '''
+        @summary: Parse the Ethernet/IPv4/TCP headers of a probe.
+        @return: (probe ID, Ethernet offset) or None if the frame is not a valid probe
+        '''
+        l3 = offset + ETH_HEADER_LEN
+        if length < ETH_HEADER_LEN + 20:
+            return None
+        eth_type, = ETH_TYPE.unpack_from(buf, offset + 12)
+        if eth_type == ETH_P_8021Q:
+            eth_type, = ETH_TYPE.unpack_from(buf, offset + 16)
+            l3 += 4
+        if eth_type != ETH_P_IP:
+            return None
+        ver_ihl, proto = IPV4_HEADER.unpack_from(buf, l3)
+        l4 = l3 + (ver_ihl & 0x0f) * 4
+        end = offset + length
+        if proto == IPPROTO_TCP and l4 + 20 <= end:
+            sport, dport = L4_PORTS.unpack_from(buf, l4)
+            if sport != PROBE_SPORT or dport != PROBE_DPORT:
+                return None
+            data_offset, = TCP_DATA_OFFSET.unpack_from(buf, l4)
+            try:
+                probe_id = int(buf[l4 + (data_offset >> 4) * 4:end])
+            except ValueError:
+                return None
+            if not 0 <= probe_id < self.packets_to_send:
+                return None
+            return probe_id, offset
+        if proto == IPPROTO_UDP and self.vnet and l4 + UDP_HEADER_LEN <= end:
+            sport, _ = L4_PORTS.unpack_from(buf, l4)
+            if sport != PROBE_SPORT:
+                return None
+            inner = l4 + UDP_HEADER_LEN + VXLAN_HEADER_LEN
+            result = self.parse_probe(buf, inner, end - inner)
+            if result is None or result[1] < 0:
+                return None
+            return result[0], -inner - 1     # Negative offset marks a decapsulated probe
+        return None
+
+    def add_record(self, buf, offset, length, timestamp, position, keep=False):
+        self.captured += 1
+        probe = self.parse_probe(buf, offset, length)
+        if probe is None:
+            return
+        probe_id, eth = probe
+        if eth < 0:
+            eth = -eth - 1
+            received, recv_time = self.decap_received, self.decap_time
+        else:
+            received, recv_time = self.received, self.recv_time
+        if buf[eth + 6:eth + 12] == self.dut_mac:
+            if received[probe_id]:
+                self.floods += 1
+                return
+            received[probe_id] = 1
+            recv_time[probe_id] = timestamp
+        elif buf[eth:eth + 6] == self.dut_mac:
+            self.sent_counter += 1
+            if timestamp > self.sent_time[probe_id]:
+                self.sent_time[probe_id] = timestamp
+        else:
+            return
+        if keep:
+            positions, lengths, ids, times = self.records
+            positions.append(position + eth - offset)
+            lengths.append(length - (eth - offset))
+            ids.append(probe_id)
+            times.append(timestamp)
+
+    def analyze(self, filename, keep=False):
+        '''
+        @summary: Stream the pcap file and compute the disruptions.
+        @param filename: pcap file of the probes
+        @param keep: keep the positions of the filtered probes for save_filtered()
+        '''
+        self.reset()
+        start = time.time()
+        add_record = self.add_record
+        for buf, offset, length, timestamp, position in iter_pcap_records(filename):
+            add_record(buf, offset, length, timestamp, position, keep)
+        if self.vnet:
+            for probe_id in range(self.packets_to_send):
+                if self.decap_received[probe_id] and not self.received[probe_id]:
+                    self.received[probe_id] = 1
+                    self.recv_time[probe_id] = self.decap_time[probe_id]
+        self.compute_disruptions()
+        self.log("Analyzed %d captured packets in %.3f seconds: %d sent, %d received, %d flooded" % \
+            (self.captured, time.time() - start, self.sent_counter, self.received_counter, self.floods))
+        return self
+
+    def find_gaps(self):
+        '''
+        @summary: Find the gaps in the received IDs.
+        @return: list of (previous received ID, previous received time, received ID, received time)
+        '''
+        if numpy is not None:
+            received = numpy.frombuffer(bytes(self.received), dtype=numpy.uint8)
+            ids = numpy.flatnonzero(received)
+            times = numpy.frombuffer(self.recv_time, dtype=numpy.float64)[ids]
+            prev_ids = numpy.concatenate(([0], ids[:-1]))
+            prev_times = numpy.concatenate(([0.0], times[:-1]))
+            gaps = numpy.flatnonzero(ids - prev_ids > 1)
+            return list(zip(prev_ids[gaps].tolist(), prev_times[gaps].tolist(),
+                            ids[gaps].tolist(), times[gaps].tolist()))
+        gaps = []
+        prev_id, prev_time = 0, 0.0
+        recv_time = self.recv_time
+        for probe_id, received in enumerate(self.received):
+            if received:
+                if probe_id - prev_id > 1:
+                    gaps.append((prev_id, prev_time, probe_id, recv_time[probe_id]))
+                prev_id, prev_time = probe_id, recv_time[probe_id]
+        return gaps
+
+    def compute_disruptions(self):
+        self.received_counter = self.received.count(b'\x01')
+        self.lost_packets = dict()
+        self.disruption_start, self.disruption_stop = None, None
+        for prev_id, prev_time, probe_id, received_time in self.find_gaps():
+            lost_id = (probe_id - 1) - prev_id    # How many packets lost in a row.
+            if self.sent_time[probe_id] != NO_TIME and self.sent_time[prev_id + 1] != NO_TIME:
+                disrupt = self.sent_time[probe_id] - self.sent_time[prev_id + 1]    # How long disrupt lasted.
+            else:
+                disrupt = received_time - prev_time
+            self.lost_packets[prev_id] = (lost_id, disrupt, received_time - disrupt, received_time)
+            self.log("Disruption between packet ID %d and %d. For %.4f " % (prev_id, probe_id, disrupt))
+            if not self.disruption_start:
+                self.disruption_start = datetime.datetime.fromtimestamp(prev_time)
+            self.disruption_stop = datetime.datetime.fromtimestamp(received_time)
+
+        self.disrupts_count = len(self.lost_packets)
+        if self.lost_packets:
+            # Find the longest loss with the longest time, the first one on a tie:
+            _, (self.max_lost_id, self.max_disrupt_time, self.no_routing_start, self.no_routing_stop) = \
+                max(sorted(self.lost_packets.items()), key=lambda item: item[1][0:2])
+            self.total_disrupt_packets = sum([item[0] for item in self.lost_packets.values()])
+            self.total_disrupt_time = sum([item[1] for item in self.lost_packets.values()])
+        else:
+            self.max_lost_id = 0
+            self.max_disrupt_time = 0
+            self.no_routing_start, self.no_routing_stop = None, None
+            self.total_disrupt_packets = 0
+            self.total_disrupt_time = 0
+
+    def save_filtered(self, src, dst):
+        '''
+        @summary: Write the filtered probes of the analyzed file, ordered by ID and timestamp.
+        @param src: pcap file given to analyze(keep=True)
+        @param dst: pcap file to write
+        '''
+        positions, lengths, ids, times = self.records
+        order = sorted(range(len(ids)), key=lambda index: (ids[index], times[index]))
+        record = struct.Struct('<IIII')
+        with open(src, 'rb') as infile, open(dst, 'wb') as outfile:
+            outfile.write(struct.pack('<IHHiIII', PCAP_MAGIC_USEC, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET))
+            for index in order:
+                infile.seek(positions[index])
+                frame = infile.read(lengths[index])
+                timestamp = times[index]
+                sec = int(timestamp)
+                outfile.write(record.pack(sec, int(round((timestamp - sec) * 1e6)), len(frame), len(frame)))
+                outfile.write(frame)
+        return len(order)
+
+
+def write_synthetic_pcap(filename, packets, dut_mac, disruptions, floods=2, interval=0.0001):
+    '''
+    @summary: Write a capture of the probes as advanced-reboot sees it: every probe is sent to the DUT
+              and received from it, except during the disruptions, and the received probes are flooded.
+    @param disruptions: list of (first lost ID, lost count)
+    @return: number of packets written
+    '''
+    dut = mac_to_bytes(dut_mac)
+    peer = mac_to_bytes('00:01:02:03:04:05')
+    header = struct.pack('!HBBHHHBBH4s4s', ETH_P_IP, 0x45, 0, 0, 1, 0, 64, IPPROTO_TCP, 0,
+                         b'\x0a\x00\x00\x01', b'\xc0\xa8\x00\x02')
+    tcp = struct.pack('!HHIIBBHHH', PROBE_SPORT, PROBE_DPORT, 0, 0, 0x50, 0x02, 8192, 0, 0)
+    lost = set()
+    for first, count in disruptions:
+        lost.update(range(first, first + count))
+    record = struct.Struct('<IIII')
+    written = 0
+    with open(filename, 'wb') as pcap:
+        pcap.write(struct.pack('<IHHiIII', PCAP_MAGIC_USEC, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET))
+        chunk = []
+        for probe_id in range(packets):
+            payload = ('0' * 60 + str(probe_id)).encode('ascii')
+            timestamp = 1600000000 + probe_id * interval
+            frames = [(timestamp, dut + peer)]
+            if probe_id not in lost:
+                frames += [(timestamp + interval / 2, peer + dut)] * (1 + floods)
+            for stamp, macs in frames:
+                frame = macs + header + tcp + payload
+                sec = int(stamp)
+                chunk.append(record.pack(sec, int((stamp - sec) * 1e6), len(frame), len(frame)) + frame)
+            written += len(frames)
+            if len(chunk) >= 10000:
+                pcap.write(b''.join(chunk))
+                chunk = []
+        pcap.write(b''.join(chunk))
+    return written
+
+
+def benchmark(packets):
+    dut_mac = '4c:76:25:f5:48:80'
+    disruptions = [(packets // 4, 10), (packets // 2, 1000), (packets - 100, 50)]
+    filename = os.path.join(tempfile.gettempdir(), 'bench_capture.pcap')
+    start = time.time()
+    written = write_synthetic_pcap(filename, packets, dut_mac, disruptions)
+    print("Synthetic pcap: %d probes, %d packets, %d MB, written in %.1f s" % \
+        (packets, written, os.path.getsize(filename) // (1024 * 1024), time.time() - start))
+
+    start = time.time()
+    analyzer = DisruptionAnalyzer(dut_mac, packets).analyze(filename)
+    elapsed = max(time.time() - start, 0.000001)
+    expected = dict((first - 1, count) for first, count in disruptions)
+    found = dict((first, value[0]) for first, value in analyzer.lost_packets.items())
+    print("Streaming analyzer: %.1f s, %.0f packets/s, numpy %s" % (elapsed, written / elapsed, numpy is not None))
+    print("Disruptions %d, longest %d packets %.4f s, total %d packets %.4f s, expected %s" % \
+        (analyzer.disrupts_count, analyzer.max_lost_id, analyzer.max_disrupt_time,
+         analyzer.total_disrupt_packets, analyzer.total_disrupt_time, found == expected))
+    os.remove(filename)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+        return
+    if len(sys.argv) < 4:
+        print(__doc__)
+        sys.exit(1)
+    analyzer = DisruptionAnalyzer(sys.argv[2], int(sys.argv[3]), vnet='--vnet' in sys.argv, log=print_log)
+    analyzer.analyze(sys.argv[1])
+    print("Disruptions %d, longest %d packets %.4f s, total %d packets %.4f s" % \
+        (analyzer.disrupts_count, analyzer.max_lost_id, analyzer.max_disrupt_time,
+         analyzer.total_disrupt_packets, analyzer.total_disrupt_time))
+
+
+def print_log(message):
+    print(message)
+
+
+if __name__ == '__main__':
+    main()
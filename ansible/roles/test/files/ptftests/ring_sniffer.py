@@ -0,0 +1,242 @@
+'''
+Capture backend of the advanced-reboot probes.
+
+The frames are captured with a memory-mapped AF_PACKET ring (TPACKET_V3): the BPF filter
+runs in the kernel, the kernel fills the ring blocks, and the frames of every retired block are
+written with their timestamps straight to a pcap file, so the memory used by the capture is
+the size of the ring whatever the length of the capture. The kernel counts the frames dropped
+because the ring was full (tp_drops), which tells the sniffer loss from the dataplane loss.
+
+Usage:
+    python ring_sniffer.py <capture.pcap> <seconds> [filter] [--iface <iface>]
+'''
+
+import sys
+import time
+import mmap
+import ctypes
+import select
+import socket
+import struct
+import subprocess
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+SO_ATTACH_FILTER = 26
+ETH_P_ALL = 0x0003
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TP_STATUS_VLAN_VALID = 0x10
+TP_STATUS_VLAN_TPID_VALID = 0x40
+ETH_P_8021Q = 0x8100
+
+TPACKET_REQ3 = struct.Struct('IIIIIII')
+TPACKET_STATS_V3 = struct.Struct('III')      # tp_packets, tp_drops, tp_freeze_q_cnt
+BLOCK_HEADER = struct.Struct('8xIII')       # block_status, num_pkts, offset_to_first_pkt
+BLOCK_STATUS_OFFSET = 8
+# tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac, tp_net, tp_rxhash, tp_vlan_tci, tp_vlan_tpid
+TPACKET3_HEADER = struct.Struct('IIIIIIHHIIH')
+BPF_INSTRUCTION = struct.Struct('HBBI')
+SOCK_FPROG = struct.Struct('HL')
+
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAP_HEADER = struct.Struct('IHHiIII')
+PCAP_RECORD = struct.Struct('IIII')
+LINKTYPE_ETHERNET = 1
+SNAPLEN = 65535
+
+TCPDUMP = '/usr/sbin/tcpdump'
+DEFAULT_COMPILE_IFACE = 'eth0'
+
+
+def compile_filter(sniff_filter, iface=None):
+    '''
+    @summary: Compile the filter expression to BPF instructions, as scapy does, with tcpdump -ddd.
+    @return: list of (code, jt, jf, k)
+    '''
+    output = subprocess.check_output([TCPDUMP, '-i', iface or DEFAULT_COMPILE_IFACE, '-ddd',
+                                      '-s', str(SNAPLEN), sniff_filter])
+    lines = output.decode('ascii').strip().splitlines()
+    return [tuple(int(value) for value in line.split()) for line in lines[1:int(lines[0]) + 1]]
+
+
+def attach_bpf(sock, instructions):
+    '''
+    @summary: Attach the BPF instructions to the socket, the kernel drops the frames not matching them.
+    '''
+    program = ctypes.create_string_buffer(b''.join(BPF_INSTRUCTION.pack(*ins) for ins in instructions))
+    fprog = SOCK_FPROG.pack(len(instructions), ctypes.addressof(program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+class RingSniffer(object):
+    '''
+    @summary: Captures the frames of all interfaces (or of one interface) to a pcap file through an AF_PACKET ring.
+    @param filename: pcap file to write, with nanosecond timestamps
+    @param sniff_filter: BPF filter expression, as in tcpdump
+    @param iface: interface to capture, all interfaces if None
+    @param block_size: size of a ring block, multiple of the page size
+    @param block_count: number of the ring blocks
+    @param retire_timeout: milliseconds after which the kernel hands over a block not filled yet
+    '''
+    def __init__(self, filename, sniff_filter='', iface=None, block_size=1024 * 1024, block_count=64,
+                 frame_size=2048, retire_timeout=100, log=None):
+        self.filename = filename
+        self.sniff_filter = sniff_filter
+        self.iface = iface
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+        self.retire_timeout = retire_timeout
+        self.log = log if log else lambda message: None
+        self.sock = None
+        self.ring = None
+        self.pcap = None
+        self.block = 0
+        self.captured = 0
+        self.packets = 0
+        self.drops = 0
+        self.freeze_q_cnt = 0
+
+    def open(self):
+        '''
+        @summary: Create the ring and start the capture. The filter is attached before the ring is set:
+                  the frames received before are left in the socket queue, out of the ring.
+                  A socket of one interface receives nothing until it is bound.
+        '''
+        protocol = 0 if self.iface else socket.htons(ETH_P_ALL)
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, protocol)
+        try:
+            if self.sniff_filter:
+                attach_bpf(self.sock, compile_filter(self.sniff_filter, self.iface))
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            frame_count = self.block_size * self.block_count // self.frame_size
+            self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING,
+                                 TPACKET_REQ3.pack(self.block_size, self.block_count, self.frame_size,
+                                                   frame_count, self.retire_timeout, 0, 0))
+            self.ring = mmap.mmap(self.sock.fileno(), self.block_size * self.block_count,
+                                  mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            if self.iface:
+                self.sock.bind((self.iface, ETH_P_ALL))
+        except Exception:
+            self.close()
+            raise
+        self.pcap = open(self.filename, 'wb')
+        self.pcap.write(PCAP_HEADER.pack(PCAP_MAGIC_NSEC, 2, 4, 0, 0, SNAPLEN, LINKTYPE_ETHERNET))
+        self.block = 0
+        self.captured = 0
+        self.packets, self.drops, self.freeze_q_cnt = 0, 0, 0
+        self.log("Ring sniffer started on %s with filter '%s', ring of %d x %d bytes" % \
+            (self.iface or 'all interfaces', self.sniff_filter, self.block_count, self.block_size))
+
+    def close(self):
+        if self.sock:
+            self.update_stats()
+        if self.ring:
+            self.ring.close()
+            self.ring = None
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        if self.pcap:
+            self.pcap.close()
+            self.pcap = None
+
+    def update_stats(self):
+        '''
+        @summary: Accumulate the kernel counters of the socket, which are reset when read.
+        '''
+        packets, drops, freeze_q_cnt = TPACKET_STATS_V3.unpack(
+            self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS_V3.size))
+        self.packets += packets
+        self.drops += drops
+        self.freeze_q_cnt += freeze_q_cnt
+
+    def read_block(self):
+        '''
+        @summary: Write the frames of the current block to the pcap file if the kernel handed it over.
+        @return: True if a block was read
+        '''
+        ring, base = self.ring, self.block * self.block_size
+        status, num_pkts, offset = BLOCK_HEADER.unpack_from(ring, base)
+        if not status & TP_STATUS_USER:
+            return False
+        write = self.pcap.write
+        offset += base
+        for _ in range(num_pkts):
+            (next_offset, sec, nsec, snaplen, length, tp_status, mac, _,
+             _, vlan_tci, vlan_tpid) = TPACKET3_HEADER.unpack_from(ring, offset)
+            frame = ring[offset + mac:offset + mac + snaplen]
+            if tp_status & TP_STATUS_VLAN_VALID:
+                # The kernel strips the VLAN tag into the header, put it back as scapy sniff does
+                tpid = vlan_tpid if tp_status & TP_STATUS_VLAN_TPID_VALID else ETH_P_8021Q
+                frame = frame[:12] + struct.pack('!HH', tpid, vlan_tci & 0xffff) + frame[12:]
+                snaplen, length = snaplen + 4, length + 4
+            write(PCAP_RECORD.pack(sec, nsec, snaplen, length))
+            write(frame)
+            offset += next_offset
+        self.captured += num_pkts
+        struct.pack_into('I', ring, base + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+        self.block = (self.block + 1) % self.block_count
+        return True
+
+    def run(self, timeout, stop_event=None):
+        '''
+        @summary: Capture until the timeout expires or the stop event is set.
+        @return: number of the captured frames
+        '''
+        deadline = time.time() + timeout
+        while stop_event is None or not stop_event.is_set():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            if not self.read_block():
+                select.select([self.sock], [], [], min(remaining, 0.1))
+        # Let the kernel retire the last block, then drain the ring
+        time.sleep(self.retire_timeout / 1000.0)
+        while self.read_block():
+            pass
+        self.update_stats()
+        self.pcap.flush()
+        self.log("Ring sniffer captured %d packets to %s, kernel counted %d packets, %d dropped" % \
+            (self.captured, self.filename, self.packets, self.drops))
+        return self.captured
+
+
+def sniff_to_pcap(filename, timeout, sniff_filter='', iface=None, log=None):
+    '''
+    @summary: Capture to the pcap file for timeout seconds.
+    @return: the closed RingSniffer, with the captured and drops counters
+    '''
+    sniffer = RingSniffer(filename, sniff_filter, iface, log=log)
+    sniffer.open()
+    try:
+        sniffer.run(timeout)
+    finally:
+        sniffer.close()
+    return sniffer
+
+
+def print_log(message):
+    print(message)
+
+
+def main():
+    args = sys.argv[1:]
+    iface = None
+    if '--iface' in args:
+        index = args.index('--iface')
+        iface = args[index + 1]
+        del args[index:index + 2]
+    if len(args) < 2:
+        print(__doc__)
+        sys.exit(1)
+    sniff_to_pcap(args[0], float(args[1]), args[2] if len(args) > 2 else '', iface, log=print_log)
+
+
+if __name__ == '__main__':
+    main()
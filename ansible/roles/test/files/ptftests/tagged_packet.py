@@ -0,0 +1,39 @@
+'''
+Helpers of the tests which tag the TCP payload of the packets they send and check the
+received frames as raw bytes (fib_test.py, hash_test.py).
+
+tag_payload() writes the tag at the head of the TCP payload of a packet, the received
+frames are then matched to the sent packets by looking for the tag in the raw bytes.
+RouterMacBytes gives the router MAC of the DUT behind a PTF port as the bytes of the
+source MAC of the frames received on that port.
+'''
+
+import binascii
+
+import ptf.packet as scapy
+
+
+def tag_payload(pkt, tag):
+    '''
+    @summary: Write the tag at the head of the TCP payload, keeping the packet length
+    '''
+    tcp = pkt[scapy.TCP]
+    payload = bytes(tcp.payload)
+    tcp.remove_payload()
+    tcp.add_payload(tag + payload[len(tag):])
+
+
+class RouterMacBytes(object):
+    def __init__(self, router_macs, ptf_test_port_map):
+        self.router_macs = router_macs
+        self.ptf_test_port_map = ptf_test_port_map
+        self.mac_bytes = {}
+
+    def get(self, port):
+        '''
+        @summary: Router MAC of the DUT of the PTF port as 6 bytes, converted once per DUT
+        '''
+        target_dut = self.ptf_test_port_map[str(port)]['target_dut']
+        if target_dut not in self.mac_bytes:
+            self.mac_bytes[target_dut] = binascii.unhexlify(self.router_macs[target_dut].replace(':', ''))
+        return self.mac_bytes[target_dut]
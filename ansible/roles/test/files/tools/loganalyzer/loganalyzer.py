@@ -19,7 +19,10 @@ Usage:          Examples of how to use log analyzer
 import sys
 import getopt
 import re
+import sre_constants
+import sre_parse
 import csv
+import json
 import pprint
 import logging
 import logging.handlers
@@ -41,6 +44,158 @@ err_no_start_marker = -4
 err_invalid_string_format = -5
 err_invalid_input = -6
 
+class MessageMatcher:
+    '''
+    @summary: Matches log lines against a list of regular expressions.
+
+    Instead of one alternation of all regular expressions, every expression is
+    compiled separately together with the longest literal string which any
+    line matching it must contain. A line is first searched for all those
+    literals at once and only the expressions whose literal is found in the
+    line are run. Expressions without a usable literal are always run.
+
+    A few literals are searched with one alternation of the escaped literals.
+    Many literals are indexed by one of their substrings of gram_size
+    characters (the one shared by the fewest literals), the substrings of the
+    line are then looked up in the index, Aho-Corasick style.
+
+    findall() returns the list of expressions matching the line, so the object
+    can be used in place of a compiled alternation regex. Matched expressions
+    are counted in 'hits', which gives unused expressions without rescanning
+    matched lines.
+    '''
+
+    min_literal_len = 3
+    max_gram_size = 4
+    max_alternation_literals = 32
+
+    def __init__(self, messages_regex):
+        self.messages_regex = list(messages_regex)
+        self.hits = dict.fromkeys(self.messages_regex, 0)
+        self.by_literal = {}
+        self.unfiltered = []
+
+        for regex in self.messages_regex:
+            literal = self.required_literal(regex)
+            if literal and len(literal) >= self.min_literal_len:
+                self.by_literal.setdefault(literal, []).append((regex, re.compile(regex)))
+            else:
+                self.unfiltered.append((regex, re.compile(regex)))
+
+        literals = sorted(self.by_literal, key=len, reverse=True)
+        self.prefilter = None
+        self.gram_index = {}
+        self.gram_size = 0
+        if 0 < len(literals) <= self.max_alternation_literals:
+            # Longest literals first, the prefilter only needs to tell if any literal is present
+            self.prefilter = re.compile('|'.join(map(re.escape, literals)))
+        elif literals:
+            self.gram_size = min(self.max_gram_size, len(literals[-1]))
+            grams_per_literal = {}
+            gram_count = {}
+            for literal in literals:
+                grams = set(literal[i:i + self.gram_size] for i in range(len(literal) - self.gram_size + 1))
+                grams_per_literal[literal] = grams
+                for gram in grams:
+                    gram_count[gram] = gram_count.get(gram, 0) + 1
+            for literal, grams in grams_per_literal.iteritems():
+                gram = min(grams, key=lambda item: (gram_count[item], item))
+                self.gram_index.setdefault(gram, []).append(literal)
+            self.grams = frozenset(self.gram_index)
+    #---------------------------------------------------------------------
+
+    @staticmethod
+    def required_literal(regex):
+        '''
+        @summary: Find the longest literal string which must be present in a line
+                  matching the regular expression.
+
+        Only literals at the top level of the expression are considered, anything
+        inside groups, branches or repeats is treated as unknown.
+
+        @return: Literal string or None if no literal can be derived.
+        '''
+        try:
+            parsed = sre_parse.parse(regex)
+        except (sre_constants.error, TypeError):
+            return None
+        if parsed.pattern.flags & (sre_constants.SRE_FLAG_IGNORECASE | sre_constants.SRE_FLAG_LOCALE):
+            return None
+
+        best = []
+        current = []
+        for op, av in parsed.data:
+            if op == sre_constants.LITERAL and av < 256:
+                current.append(chr(av))
+                continue
+            if len(current) > len(best):
+                best = current
+            current = []
+        if len(current) > len(best):
+            best = current
+        return ''.join(best) or None
+    #---------------------------------------------------------------------
+
+    def candidates(self, line):
+        '''
+        @summary: List (regex, compiled regex) pairs which may match the line.
+        '''
+        result = list(self.unfiltered)
+        if self.prefilter is not None:
+            if self.prefilter.search(line):
+                for literal, regex_list in self.by_literal.iteritems():
+                    if literal in line:
+                        result.extend(regex_list)
+        elif self.gram_index:
+            size = self.gram_size
+            line_grams = set([line[i:i + size] for i in xrange(len(line) - size + 1)])
+            for gram in self.grams.intersection(line_grams):
+                for literal in self.gram_index[gram]:
+                    if literal in line:
+                        result.extend(self.by_literal[literal])
+        return result
+    #---------------------------------------------------------------------
+
+    def search(self, line):
+        '''
+        @summary: Check if any of the regular expressions matches the line.
+        '''
+        for regex, compiled in self.candidates(line):
+            if compiled.search(line):
+                return True
+        return False
+    #---------------------------------------------------------------------
+
+    def findall(self, line):
+        '''
+        @summary: List regular expressions matching the line and count their hits.
+        '''
+        result = []
+        for regex, compiled in self.candidates(line):
+            if compiled.search(line):
+                self.hits[regex] += 1
+                result.append(regex)
+        return result
+    #---------------------------------------------------------------------
+
+    def unused(self):
+        '''
+        @summary: List regular expressions which did not match any line passed to findall().
+        '''
+        return [regex for regex in self.messages_regex if not self.hits[regex]]
+#---------------------------------------------------------------------
+
+def create_matcher(messages_regex):
+    '''
+    @summary: Create MessageMatcher for the list of regular expressions.
+
+    @return: MessageMatcher instance or None for an empty list.
+    '''
+    if not messages_regex:
+        return None
+    return MessageMatcher(messages_regex)
+#---------------------------------------------------------------------
+
 class AnsibleLogAnalyzer:
     '''
     @summary: Overview of functionality
@@ -204,7 +359,8 @@ class AnsibleLogAnalyzer:
 
         @param file_list : List of file paths, contains search expressions.
 
-        @return: A regex class instance, corresponding to loaded regex expressions.
+        @return: A MessageMatcher instance, corresponding to loaded regex expressions
+            and the list of loaded regex expressions.
             Will be used for matching operations by callers.
         '''
         messages_regex = []
@@ -252,11 +408,7 @@ class AnsibleLogAnalyzer:
                         print repr(e)
                         sys.exit(err_invalid_string_format)
 
-        if (len(messages_regex)):
-            regex = re.compile('|'.join(messages_regex))
-        else:
-            regex = None
-        return regex, messages_regex
+        return create_matcher(messages_regex), messages_regex
     #---------------------------------------------------------------------
 
     def line_matches(self, str, match_messages_regex, ignore_messages_regex):
@@ -270,21 +422,21 @@ class AnsibleLogAnalyzer:
             'ignore' set - will not be reported (will be ignored)
 
         @param match_messages_regex:
-            regex class instance containing messages to match against.
+            regex class or MessageMatcher instance containing messages to match against.
 
         @param ignore_messages_regex:
-            regex class instance containing messages to ignore match against.
+            regex class or MessageMatcher instance containing messages to ignore match against.
 
         @return: True is str matches regex criteria, otherwise False.
         '''
 
         ret_code = False
 
-        if ((match_messages_regex is not None) and (match_messages_regex.findall(str))):
+        if ((match_messages_regex is not None) and (match_messages_regex.search(str))):
             if (ignore_messages_regex is None):
                 ret_code = True
 
-            elif (not ignore_messages_regex.findall(str)):
+            elif (not ignore_messages_regex.search(str)):
                 self.print_diagnostic_message('matching line: %s' % str)
                 ret_code = True
 
@@ -436,6 +588,8 @@ def usage():
     print '                                 to all log files specified in --logs parameter.'
     print '                                 analyze - perform log analysis of files specified in --logs parameter.'
     print '                                 add_end_marker - add end marker to all log files specified in --logs parameter.'
+    print '                                 analyze_on_dut - analyze files specified in --logs parameter with regular'
+    print '                                 expressions from --regex_file and print matching lines as JSON.'
     print '--out_dir path                   Directory path where to place output files, '
     print '                                 must be present when --action == analyze'
     print '--logs path{,path}               List of full paths to log files to be analyzed.'
@@ -454,10 +608,12 @@ def usage():
     print '                                 All the strings from these files will be expected to present'
     print '                                 in one of specified log files during the analysis. Must be present'
     print '                                 when action == analyze.'
+    print '--regex_file path                Path to JSON file with "match", "ignore" and "expect" lists of regular'
+    print '                                 expressions. Must be present when action == analyze_on_dut.'
 
 #---------------------------------------------------------------------
 
-def check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in):
+def check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in, regex_file=None):
     '''
     @summary: This function validates command line parameter 'action' and
         other related parameters.
@@ -480,6 +636,10 @@ def check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in,
             print 'ERROR: missing required match_files_in for analyze action'
             ret_code = False
 
+    elif (action == 'analyze_on_dut'):
+        if regex_file is None or len(regex_file) == 0:
+            print 'ERROR: missing required regex_file for analyze_on_dut action'
+            ret_code = False
 
     else:
         ret_code = False
@@ -506,7 +666,7 @@ def check_run_id(run_id):
     return ret_code
 #---------------------------------------------------------------------
 
-def write_result_file(run_id, out_dir, analysis_result_per_file, messages_regex_e, unused_regex_messages):
+def write_result_file(run_id, out_dir, analysis_result_per_file, expect_messages_regex, unused_regex_messages):
     '''
     @summary: Write results of analysis into a file.
 
@@ -516,6 +676,10 @@ def write_result_file(run_id, out_dir, analysis_result_per_file, messages_regex_
 
     @param analysis_result_per_file: map file_name: [list of found matching strings]
 
+    @param expect_messages_regex: MessageMatcher instance used for expected messages during analysis.
+
+    @param unused_regex_messages: list to be filled with expected regex not found in log files.
+
     @return: void
     '''
 
@@ -543,13 +707,9 @@ def write_result_file(run_id, out_dir, analysis_result_per_file, messages_regex_
 
         out_file.write("\n-------------------------------------------------\n\n")
         out_file.write('Total matches:%d\n' % match_cnt)
-        # Find unused regex matches
-        for regex in messages_regex_e:
-            for line in expected_lines_total:
-                if re.search(regex, line):
-                    break
-            else:
-                unused_regex_messages.append(regex)
+        # Expected regex which did not match any line during analysis
+        if expect_messages_regex is not None:
+            unused_regex_messages.extend(expect_messages_regex.unused())
 
         out_file.write('Total expected and found matches:%d\n' % expected_cnt)
         out_file.write('Total expected but not found matches: %d\n\n' % len(unused_regex_messages))
@@ -597,6 +757,39 @@ def write_summary_file(run_id, out_dir, analysis_result_per_file, unused_regex_m
     out_file.close()
 #---------------------------------------------------------------------
 
+def load_regex_file(regex_file):
+    '''
+    @summary: Load match, ignore and expect regular expressions from a JSON file.
+
+    @param regex_file: Path to JSON file with "match", "ignore" and "expect" lists of regular expressions.
+
+    @return: Tuple of match, ignore and expect MessageMatcher instances, None for an empty list.
+    '''
+
+    with open(regex_file) as in_file:
+        regex = json.load(in_file)
+
+    result = []
+    for key in ("match", "ignore", "expect"):
+        result.append(create_matcher([item.encode('utf-8') for item in regex.get(key, [])]))
+    return tuple(result)
+#---------------------------------------------------------------------
+
+def dump_analysis_result(analysis_result_per_file):
+    '''
+    @summary: Print results of analysis as JSON, the caller parses it from stdout.
+
+    @param analysis_result_per_file: map file_name: [list of matching strings, list of expected strings]
+
+    @return: void
+    '''
+
+    result = {}
+    for key, val in analysis_result_per_file.iteritems():
+        result[key] = [[line.decode('utf-8', 'replace') for line in lines] for lines in val]
+    print json.dumps(result)
+#---------------------------------------------------------------------
+
 def main(argv):
 
     action = None
@@ -607,10 +800,11 @@ def main(argv):
     match_files_in = None
     ignore_files_in = None
     expect_files_in = None
+    regex_file = None
     verbose = False
 
     try:
-        opts, args = getopt.getopt(argv, "a:r:s:l:o:m:i:e:vh", ["action=", "run_id=", "start_marker=", "logs=", "out_dir=", "match_files_in=", "ignore_files_in=", "expect_files_in=", "verbose", "help"])
+        opts, args = getopt.getopt(argv, "a:r:s:l:o:m:i:e:vh", ["action=", "run_id=", "start_marker=", "logs=", "out_dir=", "match_files_in=", "ignore_files_in=", "expect_files_in=", "regex_file=", "verbose", "help"])
 
     except getopt.GetoptError:
         print "Invalid option specified"
@@ -646,10 +840,13 @@ def main(argv):
         elif (opt in ("-e", "--expect_files_in")):
             expect_files_in = arg
 
+        elif (opt == "--regex_file"):
+            regex_file = arg
+
         elif (opt in ("-v", "--verbose")):
             verbose = True
 
-    if not (check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in) and check_run_id(run_id)):
+    if not (check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in, regex_file) and check_run_id(run_id)):
         usage()
         sys.exit(err_invalid_input)
 
@@ -679,11 +876,21 @@ def main(argv):
         result = analyzer.analyze_file_list(log_file_list, match_messages_regex,
                                             ignore_messages_regex, expect_messages_regex)
         unused_regex_messages = []
-        write_result_file(run_id, out_dir, result, messages_regex_e, unused_regex_messages)
+        write_result_file(run_id, out_dir, result, expect_messages_regex, unused_regex_messages)
         write_summary_file(run_id, out_dir, result, unused_regex_messages)
     elif (action == "add_end_marker"):
         analyzer.place_marker(log_file_list, analyzer.create_end_marker())
         return 0
+    elif (action == "analyze_on_dut"):
+        match_messages_regex, ignore_messages_regex, expect_messages_regex = load_regex_file(regex_file)
+
+        if not log_file_list:
+            log_file_list.append(system_log_file)
+
+        result = analyzer.analyze_file_list(log_file_list, match_messages_regex,
+                                            ignore_messages_regex, expect_messages_regex)
+        dump_analysis_result(result)
+        return 0
 
     else:
         print 'Unknown action:%s specified' % action
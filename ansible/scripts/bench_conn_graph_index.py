@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Benchmark conn_graph_facts.find_graph with and without the persistent graph index.
+
+A synthetic set of connection graph files is generated in a temporary directory, then the lookup
+of the DUT in the last graph file is timed for:
+    - the legacy scan, parsing every graph file
+    - a cold indexed lookup, building the index from scratch
+    - a warm indexed lookup, reusing the saved index
+
+Usage:
+    python bench_conn_graph_index.py [--files 100] [--devices 50] [--links 400] [--rounds 5]
+"""
+
+import argparse
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ANSIBLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')
+if ANSIBLE_PATH not in sys.path:
+    sys.path.append(ANSIBLE_PATH)
+
+
+def generate_graph(filename, index, devices, links):
+    dut = "bench-dut-%03d" % index
+    fanouts = ["bench-fanout-%03d-%03d" % (index, i) for i in range(devices)]
+    with open(filename, 'w') as fp:
+        fp.write('<LabConnectionGraph>\n  <PhysicalNetworkGraphDeclaration>\n    <Devices>\n')
+        fp.write('      <Device Hostname="%s" HwSku="Force10-S6000" Type="DevSonic"/>\n' % dut)
+        for fanout in fanouts:
+            fp.write('      <Device Hostname="%s" HwSku="Arista-7260QX-64" Type="FanoutLeaf"/>\n' % fanout)
+        fp.write('    </Devices>\n    <DeviceInterfaceLinks>\n')
+        for i in range(links):
+            fp.write('      <DeviceInterfaceLink BandWidth="40000" EndDevice="%s" EndPort="Ethernet%d" '
+                     'StartDevice="%s" StartPort="Ethernet%d"/>\n' % (fanouts[i % devices], i, dut, i * 4))
+        fp.write('    </DeviceInterfaceLinks>\n  </PhysicalNetworkGraphDeclaration>\n  <DataPlaneGraph>\n')
+        for fanout in fanouts:
+            fp.write('    <DevicesL3Info Hostname="%s">\n' % fanout)
+            fp.write('      <ManagementIPInterface Name="ManagementIp" Prefix="10.0.0.1/24"/>\n')
+            fp.write('    </DevicesL3Info>\n')
+            fp.write('    <DevicesL2Info Hostname="%s">\n' % fanout)
+            for i in range(links // devices):
+                fp.write('      <InterfaceVlan mode="Access" portname="Ethernet%d" vlanids="%d"/>\n' % (i, 100 + i))
+            fp.write('    </DevicesL2Info>\n')
+        fp.write('  </DataPlaneGraph>\n</LabConnectionGraph>\n')
+    return dut
+
+
+def timeit(func, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark conn graph lookup with persistent index")
+    parser.add_argument("--files", type=int, default=100, help="number of graph files")
+    parser.add_argument("--devices", type=int, default=50, help="fanout devices per graph file")
+    parser.add_argument("--links", type=int, default=400, help="links per graph file")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds per measurement, best is reported")
+    args = parser.parse_args()
+
+    utils = imp.load_source('conn_graph_utils', os.path.join(ANSIBLE_PATH, 'library/conn_graph_facts.py'))
+    graph_path = tempfile.mkdtemp(prefix="conn_graph_bench_")
+    try:
+        utils.LAB_GRAPHFILE_PATH = graph_path
+        utils.debug_fname = os.path.join(graph_path, "debug.txt")
+        file_list = []
+        dut = None
+        for index in range(args.files):
+            fn = "bench_graph_%03d.xml" % index
+            dut = generate_graph(os.path.join(graph_path, fn), index, args.devices, args.links)
+            file_list.append(fn)
+        with open(os.path.join(graph_path, utils.LAB_CONNECTION_GRAPH_FILE), 'w') as fp:
+            fp.write("---\n")
+            for fn in file_list:
+                fp.write("- %s\n" % fn)
+        shutil.copy(os.path.join(ANSIBLE_PATH, 'files', utils.EMPTY_GRAPH_FILE), graph_path)
+        index_file = os.path.join(graph_path, utils.LAB_GRAPH_INDEX_FILE)
+
+        def legacy():
+            utils.find_graph([dut], use_index=False)
+
+        def cold():
+            if os.path.exists(index_file):
+                os.remove(index_file)
+            utils.find_graph([dut])
+
+        def warm():
+            utils.find_graph([dut])
+
+        results = [
+            ("legacy scan", timeit(legacy, args.rounds)),
+            ("indexed cold", timeit(cold, args.rounds)),
+            ("indexed warm", timeit(warm, args.rounds)),
+        ]
+        print("%d graph files, DUT %s in the last one" % (args.files, dut))
+        for name, elapsed in results:
+            print("%-14s %8.3f s  (x%.1f)" % (name, elapsed, results[0][1] / elapsed))
+    finally:
+        shutil.rmtree(graph_path)
+
+
+if __name__ == '__main__':
+    main()
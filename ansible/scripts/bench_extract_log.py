@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Benchmark the extract_log module engine against the legacy line by line extraction.
+
+Rotated syslog files are generated in a temporary directory: a plain 'syslog' and 'syslog.1' of
+--size-mb megabytes each and a small 'syslog.2.gz'. The start marker is written into 'syslog' at
+--marker-at fraction of its size. Both engines extract the log since the marker and the outputs
+are compared.
+
+Usage:
+    python bench_extract_log.py [--size-mb 1024] [--marker-at 0.9] [--dir /var/tmp]
+"""
+
+import argparse
+import filecmp
+import gzip
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ANSIBLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')
+if ANSIBLE_PATH not in sys.path:
+    sys.path.append(ANSIBLE_PATH)
+
+MARKER = "start-LogAnalyzer-bench.2021-01-01-00:00:00"
+LINE = "Jan  1 00:00:%02d.%06d sonic INFO swss#orchagent: :- doTask: benchmark log line number %09d padding\n"
+
+
+def generate_log(path, size, marker_at=None):
+    marker_offset = int(size * marker_at) if marker_at is not None else None
+    written = 0
+    number = 0
+    with open(path, 'w') as fp:
+        while written < size:
+            if marker_offset is not None and written >= marker_offset:
+                line = "Jan  1 00:00:00.000000 sonic INFO logger: %s\n" % MARKER
+                marker_offset = None
+            else:
+                line = LINE % (number % 60, number % 1000000, number)
+            fp.write(line)
+            written += len(line)
+            number += 1
+
+
+def run(func, directory, target):
+    start = time.time()
+    func(directory, 'syslog', MARKER, target)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extract_log engines")
+    parser.add_argument("--size-mb", type=int, default=1024, help="size of each plain log file in MB")
+    parser.add_argument("--marker-at", type=float, default=0.9, help="position of the marker in the newest file")
+    parser.add_argument("--dir", default=None, help="directory for the generated logs")
+    args = parser.parse_args()
+
+    module = imp.load_source('extract_log', os.path.join(ANSIBLE_PATH, 'library/extract_log.py'))
+    directory = tempfile.mkdtemp(prefix="extract_log_bench_", dir=args.dir)
+    try:
+        size = args.size_mb * 1024 * 1024
+        generate_log(os.path.join(directory, 'syslog'), size, args.marker_at)
+        generate_log(os.path.join(directory, 'syslog.1'), size)
+        small = os.path.join(directory, 'syslog.2')
+        generate_log(small, 1024 * 1024)
+        with open(small, 'rb') as src, gzip.open(small + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(small)
+
+        out_legacy = os.path.join(directory, 'out.legacy')
+        out_new = os.path.join(directory, 'out.new')
+        legacy = run(module.extract_log_legacy, directory, out_legacy)
+        new = run(module.extract_log, directory, out_new)
+        print("logs: 2 x %d MB plain + 1 MB gzip, marker at %.0f%% of the newest file"
+              % (args.size_mb, args.marker_at * 100))
+        print("legacy  %8.3f s" % legacy)
+        print("mmap    %8.3f s  (x%.1f)" % (new, legacy / new))
+        print("outputs identical: %s" % filecmp.cmp(out_legacy, out_new, shallow=False))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
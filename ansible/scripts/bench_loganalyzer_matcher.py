@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Benchmark the loganalyzer MessageMatcher against the legacy alternation regex.
+
+The match/ignore/expect regular expressions are loaded from the shipped loganalyzer_common_*.txt
+files, optionally extended with --extra-patterns synthetic expressions per set, and a syslog of
+--lines lines with start/end markers is generated. The file is analyzed with analyze_file using:
+    - legacy: one '|'.join() regex per set, unused expected regex found by rescanning expected lines
+    - matcher: MessageMatcher per set, unused expected regex taken from hit counters
+
+The legacy alternation gets very slow with many '.*' prefixed expressions, start with a small --lines
+value when using --extra-patterns. The loganalyzer module is python2 code, run this script with python2.
+
+Usage:
+    python bench_loganalyzer_matcher.py [--lines 1000000] [--extra-patterns 100]
+"""
+
+import argparse
+import imp
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+ANSIBLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')
+LOGANALYZER_PATH = os.path.join(ANSIBLE_PATH, 'roles/test/files/tools/loganalyzer')
+RUN_ID = 'bench'
+
+PROGRAMS = ['swss#orchagent', 'syncd#syncd', 'bgp#bgpd', 'pmon#xcvrd', 'kernel', 'snmp#snmp-subagent', 'lldp#lldpd']
+LEVELS = ['INFO'] * 40 + ['NOTICE'] * 10 + ['WARNING'] * 2 + ['ERR']
+
+
+def generate_syslog(path, lines):
+    rand = random.Random(0)
+    with open(path, 'w') as fp:
+        fp.write("Jan  1 00:00:00.000000 sonic INFO start-LogAnalyzer-%s\n" % RUN_ID)
+        for number in range(lines):
+            fp.write("Jan  1 00:%02d:%02d.%06d sonic %s %s: :- doTask: processing entry %d of table ENTRY_%d 0x%x\n"
+                     % (number // 60 % 60, number % 60, number % 1000000, rand.choice(LEVELS), rand.choice(PROGRAMS),
+                        number, rand.randint(0, 1000), rand.randint(0, 0xffff)))
+        fp.write("Jan  1 01:00:00.000000 sonic INFO end-LogAnalyzer-%s\n" % RUN_ID)
+
+
+def extra_patterns(kind, count):
+    return [r".* ERR %s#daemon%d:.*unexpected event %d.*" % (kind, index, index) for index in range(count)]
+
+
+def run(analyzer, log_file, match, ignore, expect, make):
+    start = time.time()
+    match_regex, ignore_regex, expect_regex = make(match), make(ignore), make(expect)
+    matching, expected = analyzer.analyze_file(log_file, match_regex, ignore_regex, expect_regex)
+    if isinstance(expect_regex, type(re.compile(''))):
+        unused = [regex for regex in expect if not any(re.search(regex, line) for line in expected)]
+    elif expect_regex is not None:
+        unused = expect_regex.unused()
+    else:
+        unused = list(expect)
+    return time.time() - start, len(matching), len(expected), len(unused)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loganalyzer regex matching")
+    parser.add_argument("--lines", type=int, default=1000000, help="number of generated syslog lines")
+    parser.add_argument("--extra-patterns", type=int, default=0, help="synthetic regex added to each set")
+    args = parser.parse_args()
+
+    module = imp.load_source('loganalyzer_module', os.path.join(LOGANALYZER_PATH, 'loganalyzer.py'))
+    analyzer = module.AnsibleLogAnalyzer(RUN_ID, False)
+    regex = {}
+    for kind in ('match', 'ignore', 'expect'):
+        loaded = analyzer.create_msg_regex([os.path.join(LOGANALYZER_PATH, 'loganalyzer_common_%s.txt' % kind)])
+        regex[kind] = (loaded[1] if loaded else []) + extra_patterns(kind, args.extra_patterns)
+
+    directory = tempfile.mkdtemp(prefix="loganalyzer_bench_")
+    try:
+        log_file = os.path.join(directory, 'syslog')
+        generate_syslog(log_file, args.lines)
+
+        def legacy(messages):
+            return re.compile('|'.join(messages)) if messages else None
+
+        results = [
+            ('legacy', run(analyzer, log_file, regex['match'], regex['ignore'], regex['expect'], legacy)),
+            ('matcher', run(analyzer, log_file, regex['match'], regex['ignore'], regex['expect'], module.create_matcher)),
+        ]
+        print("%d lines, %d match / %d ignore / %d expect regex"
+              % (args.lines, len(regex['match']), len(regex['ignore']), len(regex['expect'])))
+        for name, (elapsed, matching, expected, unused) in results:
+            print("%-8s %8.3f s  (x%.1f)  match %d  expected %d  unused expected %d"
+                  % (name, elapsed, results[0][1][0] / elapsed, matching, expected, unused))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
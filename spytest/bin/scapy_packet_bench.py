@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Packets per second of the scapy and compiled stream paths of the scapy traffic generator per stream type.
+The frames built by both paths are compared.
+
+Usage:
+    python bin/scapy_packet_bench.py [packets-per-stream]
+"""
+
+import os
+import sys
+import time
+import random
+
+SCAPY_TGEN = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'spytest', 'tgen', 'scapy'))
+if SCAPY_TGEN not in sys.path:
+    sys.path.insert(0, SCAPY_TGEN)
+
+from packet import ScapyPacket  # noqa: E402
+from port import ScapyStream  # noqa: E402
+from ut_streams import ut_stream_get  # noqa: E402
+
+extra_streams = {
+    "ipv4-udp-incr": dict(l3_protocol='ipv4', l4_protocol='udp', udp_src_port=1024, udp_dst_port=2048,
+                          ip_src_mode='increment', ip_dst_mode='decrement', udp_src_port_mode='increment',
+                          udp_dst_port_mode='decrement', udp_src_port_count=100, udp_dst_port_count=50),
+    "ipv4-tcp-incr": dict(l3_protocol='ipv4', l4_protocol='tcp', tcp_src_port=1024, tcp_dst_port=179,
+                          frame_size=128, ip_src_mode='increment', tcp_src_port_mode='incr',
+                          tcp_dst_port_mode='increment', tcp_dst_port_count=7),
+    "ipv6-udp-incr": dict(l3_protocol='ipv6', l4_protocol='udp', udp_src_port=1024, udp_dst_port=2048,
+                          frame_size=128, ipv6_src_addr='2001::1', ipv6_src_mode='increment',
+                          ipv6_dst_addr='2002::1', ipv6_dst_mode='decrement', udp_src_port_mode='increment'),
+    "mac-list": dict(mac_dst_mode='list', mac_dst="00.00.00.00.00.02 00.00.00.00.00.04 00.00.00.00.00.06"),
+}
+
+def get_streams():
+    streams = []
+    for index in range(100):
+        kwargs = ut_stream_get(index)
+        if not kwargs: break
+        streams.append(("ut-{}".format(index), kwargs))
+    for name, kws in extra_streams.items():
+        streams.append((name, ut_stream_get(0, **kws)))
+    return streams
+
+def run(packet, kwargs, count):
+    random.seed(count)
+    stream = ScapyStream(0, 1, None, None, **kwargs)
+    pwa = packet.build_first(stream)
+    frames = []
+    start = time.time()
+    for _ in range(count):
+        if not pwa: break
+        frames.append(packet.send_packet(pwa, None, "bench", pwa.left))
+        pwa = packet.build_next_dma(pwa)
+    elapsed = max(time.time() - start, 0.000001)
+    return (frames, elapsed, bool(pwa and pwa.compiled))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    packet = ScapyPacket(None, dry=True)
+
+    print("{:<16} {:>12} {:>12} {:>8} {:>9} {}".format("stream", "scapy pps", "compiled pps",
+                                                       "speedup", "compiled", "identical"))
+    for name, kwargs in get_streams():
+        packet.compiled_streams = 0
+        (frames1, elapsed1, _) = run(packet, kwargs, count)
+        packet.compiled_streams = 1
+        (frames2, elapsed2, compiled) = run(packet, kwargs, count)
+        (pps1, pps2) = (len(frames1)/elapsed1, len(frames2)/elapsed2)
+        print("{:<16} {:>12.0f} {:>12.0f} {:>7.1f}x {:>9} {}".format(name, pps1, pps2,
+              pps2/pps1, compiled, frames1 == frames2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Received frames per second of the stream statistics of the scapy traffic generator per number of tracked streams.
+linear: match_stream scan over track_streams per frame, index: signature index
+
+Usage:
+    python bin/scapy_stats_bench.py [frames]
+"""
+
+import os
+import sys
+import time
+import random
+
+SCAPY_TGEN = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'spytest', 'tgen', 'scapy'))
+if SCAPY_TGEN not in sys.path:
+    sys.path.insert(0, SCAPY_TGEN)
+
+from port import ScapyPort, ScapyStream  # noqa: E402
+
+
+def linear_stats(driver, frames):
+    for _, pktlen, signature in frames:
+        driver.port.incrStat('framesReceived')
+        driver.port.incrStat('bytesReceived', pktlen)
+        for stream in driver.port.track_streams:
+            if stream.get_sid().encode("ascii") == signature:
+                stream.incrStat('framesReceived')
+                stream.incrStat('bytesReceived', pktlen)
+                break
+
+def run(func, driver, frames, block=64):
+    start = time.time()
+    for index in range(0, len(frames), block):
+        func(driver, frames[index:index+block])
+    return len(frames) / max(time.time() - start, 0.000001)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    tx_port = ScapyPort("1", None, dry=True)
+    rx_port = ScapyPort("2", None, dry=True)
+
+    print("{:>8} {:>12} {:>12} {:>8} {}".format("streams", "linear pps", "index pps", "speedup", "identical"))
+    for num_streams in [1, 100, 1000]:
+        streams = [ScapyStream(tx_port.name, index, "stream-1-{}".format(index), rx_port)
+                   for index in range(num_streams)]
+        rx_port.driver.rx_track_update()
+        random.seed(num_streams)
+        sids = [stream.get_sid() for stream in streams] + ["DeadBeef"]
+        frames = [(0, 64, random.choice(sids).encode("ascii")) for _ in range(count)]
+
+        pps1 = run(linear_stats, rx_port.driver, frames)
+        linear = [stream.stats["framesReceived"] for stream in streams]
+        pps2 = run(lambda driver, block: driver.handle_stats(block), rx_port.driver, frames)
+        index = [stream.getStats()["framesReceived"] for stream in streams]
+        print("{:>8} {:>12.0f} {:>12.0f} {:>7.1f}x {}".format(num_streams, pps1, pps2,
+              pps2/pps1, linear == index))
+
+        for stream in streams:
+            rx_port.track_streams.remove(stream)
+            stream.track_port = None
+
+if __name__ == '__main__':
+    main()
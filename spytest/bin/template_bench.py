@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Benchmark the spytest template engine against the legacy per call TextFSM compilation.
+
+Sample outputs are taken from templates/test (<template or command>[_N].txt files), each parsed with
+apply_textfsm using the template of the same name, and from a few generated show command outputs
+parsed with apply which also looks up the template in the index. Every sample is parsed --rounds
+times for each of --duts Template instances, like Net does with one Template per device:
+    - legacy: clitable.CliTable.ParseCmd and textfsm.TextFSM compiled from the file on each call
+    - registry: Template.apply and Template.apply_textfsm with the compiled template registry
+    - bulk: Template.apply_bulk over all the generated outputs
+The parsed results of the legacy and registry engines are compared.
+
+Usage:
+    python bin/template_bench.py [--rounds 20] [--duts 4] [--rows 200]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import textfsm  # noqa: E402
+from spytest.template import Template, clitable  # noqa: E402
+
+
+def generate_outputs(rows):
+    mac = ["No.    Vlan  MacAddress         Port         Type",
+           "-----  ------  -----------------  -----------  -------"]
+    arp = ["Address        MacAddress         Iface        Vlan",
+           "-------------  -----------------  -----------  ------"]
+    intf = ["  Interface            Lanes    Speed    MTU    FEC    Alias    Vlan    Oper    Admin    Type    Asym PFC",
+            "-----------  ---------------  -------  -----  -----  -------  ------  ------  -------  ------  ----------"]
+    for i in range(rows):
+        mac_addr = "00:11:22:{:02x}:{:02x}:{:02x}".format(i // 65536 % 256, i // 256 % 256, i % 256)
+        mac.append("{:<6} {:<7} {}  Ethernet{:<4} Dynamic".format(i + 1, 100 + i % 10, mac_addr, i % 64))
+        arp.append("10.0.{}.{}  {}  Ethernet{:<4} {}".format(i // 256 % 256, i % 256, mac_addr, i % 64, 100 + i % 10))
+        intf.append("Ethernet{:<4} {},{},{},{}  100G  9100  rs  etp{}  trunk  up  up  QSFP28  off".format(
+            i, i * 4, i * 4 + 1, i * 4 + 2, i * 4 + 3, i))
+    mac.append("Total number of entries {}".format(rows))
+    arp.append("Total number of entries {}".format(rows))
+    return [("show mac", "\n".join(mac) + "\n"),
+            ("show arp", "\n".join(arp) + "\n"),
+            ("show interfaces status", "\n".join(intf) + "\n")]
+
+
+def load_samples(template):
+    samples = []
+    if not os.path.isdir(template.samples):
+        return samples
+    for name in sorted(os.listdir(template.samples)):
+        stem = re.sub(r"_\d+$", "", os.path.splitext(name)[0])
+        if os.path.isfile(os.path.join(template.root, stem + ".tmpl")):
+            with open(os.path.join(template.samples, name), "r") as fh:
+                samples.append((stem + ".tmpl", fh.read()))
+    return samples
+
+
+def legacy_apply(cli_table, output, cmd):
+    cli_table.ParseCmd(output, dict(Command=cmd))
+    header = [key.lower() for key in cli_table.header]
+    return [dict(zip(header, row)) for row in cli_table]
+
+
+def legacy_apply_textfsm(root, tmpl_file, data):
+    with open(os.path.join(root, tmpl_file), "r") as tmpl_fp:
+        return textfsm.TextFSM(tmpl_fp).ParseText(data)
+
+
+def timeit(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark spytest template engine")
+    parser.add_argument("--rounds", type=int, default=20, help="parses of each sample per device")
+    parser.add_argument("--duts", type=int, default=4, help="number of Template instances")
+    parser.add_argument("--rows", type=int, default=200, help="rows of the generated outputs")
+    args = parser.parse_args()
+
+    templates = [Template() for _ in range(args.duts)]
+    samples = load_samples(templates[0])
+    outputs = generate_outputs(args.rows)
+    legacy_tables = [clitable.CliTable(t.index_file, t.root) for t in templates]
+
+    def legacy():
+        results = []
+        for _ in range(args.rounds):
+            for template, cli_table in zip(templates, legacy_tables):
+                for tmpl_file, data in samples:
+                    results.append(legacy_apply_textfsm(template.root, tmpl_file, data))
+                for cmd, output in outputs:
+                    results.append(legacy_apply(cli_table, output, cmd))
+        return results
+
+    def registry():
+        results = []
+        for _ in range(args.rounds):
+            for template in templates:
+                for tmpl_file, data in samples:
+                    results.append(template.apply_textfsm(tmpl_file, data))
+                for cmd, output in outputs:
+                    results.append(template.apply(output, cmd)[1])
+        return results
+
+    def bulk():
+        results = []
+        items = [(output, cmd) for cmd, output in outputs]
+        for _ in range(args.rounds):
+            for template in templates:
+                results.extend(parsed for _, parsed in template.apply_bulk(items))
+        return results
+
+    legacy_time, legacy_results = timeit(legacy)
+    registry_time, registry_results = timeit(registry)
+    bulk_time, _ = timeit(bulk)
+    parses = len(legacy_results)
+    print("{} samples from {}, {} generated outputs of {} rows, {} devices, {} rounds: {} parses".format(
+        len(samples), templates[0].samples, len(outputs), args.rows, args.duts, args.rounds, parses))
+    print("legacy    {:8.3f} s  {:8.3f} ms/parse".format(legacy_time, legacy_time * 1000 / parses))
+    print("registry  {:8.3f} s  {:8.3f} ms/parse  (x{:.1f})".format(
+        registry_time, registry_time * 1000 / parses, legacy_time / registry_time))
+    print("bulk      {:8.3f} s  (generated outputs only)".format(bulk_time))
+    print("results identical: {}".format(legacy_results == registry_results))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import re
 import sys
 import csv
 import shutil
+import heapq
 import logging
 from random import randint
 from random import Random
@@ -106,6 +107,42 @@ def load_module_csv():
         module_row.extend(row[3:])
         wa.module_rows.append(module_row)
 
+def load_module_history():
+    """
+    read the module execution times from the functions result csv files of
+    the previous runs given in SPYTEST_BATCH_HISTORY (comma separated files,
+    directories or patterns), returns ({module: seconds}, seconds per function)
+    the time of a module is the average over the runs that executed it
+    """
+    (totals, counts, secs, funcs) = ({}, {}, 0, 0)
+    for entry in env.get("SPYTEST_BATCH_HISTORY", "").split(","):
+        entry = entry.strip()
+        if not entry: continue
+        for filepath in utils.list_files(entry, "*functions*.csv"):
+            run = {}
+            try:
+                with open(filepath, 'r') as fd:
+                    for row in csv.DictReader(fd):
+                        name = row.get("Module")
+                        if not name or "TimeTaken" not in row: continue
+                        value = utils.time_parse(row["TimeTaken"])
+                        run[name] = run.get(name, 0) + value
+                        secs, funcs = secs + value, funcs + 1
+            except Exception as exp:
+                trace("failed to read module history {}: {}".format(filepath, exp))
+                continue
+            for name, value in run.items():
+                totals[name] = totals.get(name, 0) + value
+                counts[name] = counts.get(name, 0) + 1
+    history = {}
+    for name, value in totals.items():
+        history[name] = float(value) / counts[name]
+        history.setdefault(os.path.basename(name), history[name])
+    func_time = float(secs) / funcs if funcs else None
+    if history:
+        trace("module history: {} modules {} functions".format(len(totals), funcs))
+    return history, func_time
+
 def init_type_nodes():
 
     backup_nodes = env.get("SPYTEST_BATCH_BACKUP_NODES")
@@ -275,6 +312,18 @@ class SpyTestScheduling(object):
         self.max_order = self.default_order
         self._load_buckets()
 
+        # longest processing time first using the module history
+        self.lpt_support = bool(env.get("SPYTEST_BATCH_LPT", "1") != "0")
+        self.history, func_time = load_module_history()
+        self.history_ratio = 1.0
+        default_func_time = float(env.get("SPYTEST_BATCH_DEFAULT_FUNC_TIME", "60"))
+        self.func_time = func_time or default_func_time
+        self.item_modules = {}
+        self.module_stats = SpyTestDict()
+        self.makespan = SpyTestDict(start=None, predicted=0, legacy=0, current=0, plan={})
+        (self.actual_secs, self.actual_funcs) = (0, 0)
+        (self.history_secs, self.history_actual) = (0, 0)
+
         self.test_spytest_infra_first = None
         self.test_spytest_infra_second = None
         self.test_spytest_infra_last = None
@@ -425,6 +474,16 @@ class SpyTestScheduling(object):
         report("save", "", "")
         self.update_matching_modes(self.main_modules, True)
 
+        # predicted makespan with and without the longest modules first
+        self.makespan.start = get_timenow()
+        self.makespan.legacy, _ = self._simulate(self.main_modules, False)
+        self.makespan.predicted, self.makespan.plan = self._simulate(self.main_modules, self.lpt_support)
+        self.makespan.current = self.makespan.predicted
+        msg = "Predicted Makespan: {} Legacy Order: {}"
+        trace(msg.format(utils.time_format(int(self.makespan.predicted)),
+                         utils.time_format(int(self.makespan.legacy))))
+        self.save_makespan()
+
     def find_active_nodes(self, names):
         active = []
         for name in names:
@@ -542,7 +601,7 @@ class SpyTestScheduling(object):
         _show_testbed_info()
 
     def _show_module_info(self, show=True):
-        header = ["#", "Module", "Bucket", "Tests", "Pref", "Topology", "Nodes"]
+        header = ["#", "Module", "Bucket", "Tests", "Estimate", "Pref", "Topology", "Nodes"]
         (mcount, tcount, rows) = (0, 0, [])
         for mname, minfo in self.main_modules.items():
             count = len(minfo.node_indexes)
@@ -551,7 +610,8 @@ class SpyTestScheduling(object):
             nodes = " ".join(minfo.nodes)
             md = self.get_module_data(mname, minfo.used_tpref)
             mname2 = paths.get_mlog_basename(mname)
-            rows.append([mname2, md.bucket, count, md.tpref, md.topo, nodes])
+            estimate = utils.time_format(int(self.estimate_module(mname, minfo)))
+            rows.append([mname2, md.bucket, count, estimate, md.tpref, md.topo, nodes])
         rows = sorted(rows, key=itemgetter(1), reverse=True)
         for index, row in enumerate(rows):
             row.insert(0, index+1)
@@ -575,6 +635,7 @@ class SpyTestScheduling(object):
             self.node_modules[node].remove(item_index)
             report("finish", self.collection[item_index], node.gateway.id)
             debug("============== completed", item_index, self.collection[item_index])
+            self._module_progress(item_index, duration)
         else:
             trace("============== already completed", item_index, self.collection[item_index])
         self._schedule_node(node)
@@ -592,24 +653,148 @@ class SpyTestScheduling(object):
                 return True
         return False
 
-    def _assign_test(self, node, name, modules):
-        slave = self.wa.slaves[name]
+    def estimate_module(self, mname, minfo):
+        secs = self.history.get(mname, self.history.get(os.path.basename(mname)))
+        if secs is not None:
+            return secs * self.history_ratio
+        return len(minfo.node_indexes) * self.func_time
+
+    def _pick_module(self, name, modules, lpt):
+        # lowest order first, longest estimate first within the order
         for order in range(0, self.max_order + 1):
-            for mname,minfo in modules.items():
+            (picked, longest) = (None, -1)
+            for mname, minfo in modules.items():
                 if name not in minfo.nodes: continue
-                md = self.get_module_data(name, minfo.used_tpref)
+                md = self.get_module_data(mname, minfo.used_tpref)
                 if self.order_support and md.order != order:
                     continue
-                if not self._assign_pretest(node, name):
-                    del modules[mname]
-                    self.node_modules[node].extend(minfo.node_indexes)
-                    slave.assigned = slave.assigned + len(minfo.node_indexes)
-                    debug("ASSIGNED", name, md.order, mname, minfo.node_indexes)
-                    for item_index in minfo.node_indexes:
-                        report("add", self.collection[item_index], node.gateway.id)
-                    report("save", "", "")
-                return True
-        return False
+                if not lpt: return mname
+                estimate = self.estimate_module(mname, minfo)
+                if estimate > longest:
+                    (picked, longest) = (mname, estimate)
+            if picked: return picked
+        return None
+
+    def _simulate(self, modules, lpt, busy=None):
+        # list scheduling of the modules on the active main nodes
+        # returns predicted makespan in seconds and {module: (node, finish)}
+        # the modules are sorted once in the order _pick_module picks them,
+        # a node takes the first remaining module it can run
+        busy = busy or {}
+        pending = []
+        for index, (mname, minfo) in enumerate(modules.items()):
+            order = 0
+            if self.order_support:
+                order = self.get_module_data(mname, minfo.used_tpref).order
+                if order > self.max_order: continue
+            estimate = self.estimate_module(mname, minfo)
+            pending.append((order, -estimate if lpt else 0, index, mname, estimate, minfo.nodes))
+        pending.sort(key=itemgetter(0, 1, 2))
+        heap = []
+        for slave in self.wa.slaves.values():
+            if slave.node_type != "Main" or slave.excluded or slave.completed: continue
+            heap.append((busy.get(slave.name, 0), slave.name))
+        heapq.heapify(heap)
+        (makespan, plan) = (max([free for free, _ in heap] or [0]), {})
+        while heap and pending:
+            (free, name) = heapq.heappop(heap)
+            for pos, (_, _, _, mname, estimate, nodes) in enumerate(pending):
+                if name in nodes: break
+            else:
+                continue
+            del pending[pos]
+            finish = free + estimate
+            plan[mname] = (name, finish)
+            makespan = max(makespan, finish)
+            heapq.heappush(heap, (finish, name))
+        return makespan, plan
+
+    def _predict_makespan(self):
+        # elapsed time plus the list scheduling of the pending modules
+        # after the estimated remaining time of the running modules
+        elapsed = get_elapsed(self.makespan.start)
+        busy = {}
+        for ms in self.module_stats.values():
+            if ms.finish is not None: continue
+            remaining = max(ms.predicted - (elapsed - ms.start), 0)
+            busy[ms.node] = busy.get(ms.node, 0) + remaining
+        makespan, _ = self._simulate(self.main_modules, self.lpt_support, busy)
+        self.makespan.current = elapsed + makespan
+
+    def _module_started(self, name, mname, minfo):
+        ms = SpyTestDict(node=name, funcs=len(minfo.node_indexes))
+        ms.pending = len(minfo.node_indexes)
+        ms.history = self.history.get(mname, self.history.get(os.path.basename(mname)))
+        ms.predicted = self.estimate_module(mname, minfo)
+        ms.start = get_elapsed(self.makespan.start)
+        (ms.duration, ms.finish, ms.actual) = (0, None, None)
+        self.module_stats[mname] = ms
+        for item_index in minfo.node_indexes:
+            self.item_modules[item_index] = mname
+
+    def _module_progress(self, item_index, duration):
+        mname = self.item_modules.pop(item_index, None)
+        if mname is None: return
+        ms = self.module_stats[mname]
+        ms.duration = ms.duration + (duration or 0)
+        ms.pending = ms.pending - 1
+        if ms.pending > 0: return
+
+        # re-estimate the pending modules with the actual time
+        ms.finish = get_elapsed(self.makespan.start)
+        ms.actual = ms.duration or (ms.finish - ms.start)
+        self.actual_secs = self.actual_secs + ms.actual
+        self.actual_funcs = self.actual_funcs + ms.funcs
+        self.func_time = float(self.actual_secs) / self.actual_funcs
+        if ms.history:
+            self.history_secs = self.history_secs + ms.history
+            self.history_actual = self.history_actual + ms.actual
+            self.history_ratio = float(self.history_actual) / self.history_secs
+        self._predict_makespan()
+        msg = "module {} completed in {} predicted {} makespan predicted {} re-estimated {}"
+        debug(msg.format(mname, utils.time_format(int(ms.actual)), utils.time_format(int(ms.predicted)),
+              utils.time_format(int(self.makespan.predicted)), utils.time_format(int(self.makespan.current))))
+        self.save_makespan()
+
+    def save_makespan(self):
+        header = ["#", "Module", "Node", "Tests", "Predicted", "Actual",
+                  "Predicted Finish", "Actual Finish"]
+        rows = []
+        for mname, ms in self.module_stats.items():
+            actual = "" if ms.actual is None else utils.time_format(int(ms.actual))
+            finish = "" if ms.finish is None else utils.time_format(int(ms.finish))
+            plan = self.makespan.plan.get(mname)
+            predicted_finish = utils.time_format(int(plan[1])) if plan else ""
+            rows.append([len(rows)+1, paths.get_mlog_basename(mname), ms.node, ms.funcs,
+                         utils.time_format(int(ms.predicted)), actual, predicted_finish, finish])
+        finished = [ms.finish for ms in self.module_stats.values()]
+        actual = utils.time_format(max(finished)) if finished and None not in finished else ""
+        rows.append(["", "Makespan", "", "", utils.time_format(int(self.makespan.predicted)),
+                     actual, "legacy order {}".format(utils.time_format(int(self.makespan.legacy))),
+                     "re-estimated {}".format(utils.time_format(int(self.makespan.current)))])
+        filepath = os.path.join(wa.logs_path, "batch_makespan.csv")
+        utils.write_csv_file(header, rows, filepath)
+        filepath = os.path.splitext(filepath)[0]+'.html'
+        align = {col: True for col in ["Module", "Node"]}
+        utils.write_html_table3(header, rows, filepath, align=align, total=False)
+
+    def _assign_test(self, node, name, modules):
+        slave = self.wa.slaves[name]
+        mname = self._pick_module(name, modules, self.lpt_support)
+        if mname is None:
+            return False
+        minfo = modules[mname]
+        if not self._assign_pretest(node, name):
+            md = self.get_module_data(mname, minfo.used_tpref)
+            del modules[mname]
+            self.node_modules[node].extend(minfo.node_indexes)
+            slave.assigned = slave.assigned + len(minfo.node_indexes)
+            debug("ASSIGNED", name, md.order, mname, minfo.node_indexes)
+            self._module_started(name, mname, minfo)
+            for item_index in minfo.node_indexes:
+                report("add", self.collection[item_index], node.gateway.id)
+            report("save", "", "")
+        return True
 
     def _schedule_node(self, node):
         name = node.gateway.id
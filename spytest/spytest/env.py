@@ -6,6 +6,10 @@ defaults = {
     "SPYTEST_NO_CONSOLE_LOG": "0",
     "SPYTEST_PROMPTS_FILENAME": None,
     "SPYTEST_TEXTFSM_INDEX_FILENAME": "index",
+    "SPYTEST_TEXTFSM_PARSE_CACHE_SIZE": "256",
+    "SPYTEST_CONSOLE_TRANSFER_BLOCK_SIZE": "32768",
+    "SPYTEST_CONSOLE_TRANSFER_COMPRESS": "1",
+    "SPYTEST_SFTP_RETRY_INTERVAL": "300",
     "SPYTEST_UI_POSITIVE_CASES_ONLY": "0",
     "SPYTEST_REPEAT_MODULE_SUPPORT": "0",
     "SPYTEST_FILE_PREFIX": "results",
@@ -86,6 +90,9 @@ dev_defaults = {
     "SPYTEST_BATCH_MODULE_TOPO_PREF": None,
     "SPYTEST_BATCH_MATCHING_BUCKET_ORDER": "larger,largest",
     "SPYTEST_BATCH_RERUN": None,
+    "SPYTEST_BATCH_HISTORY": "",
+    "SPYTEST_BATCH_LPT": "1",
+    "SPYTEST_BATCH_DEFAULT_FUNC_TIME": "60",
     "SPYTEST_TESTBED_FILE": "testbed.yaml",
     "SPYTEST_FILE_MODE": "0",
     "SPYTEST_SCHEDULING": None,
@@ -2550,6 +2550,8 @@ class WorkArea(object):
             ofh.write("\nTOTAL HELPER Time = {}".format(stats.helper_cmd_time))
             ofh.write("\nTOTAL TG Time = {}".format(stats.tg_cmd_time))
             ofh.write("\nTOTAL PROMPT NFOUND = {}".format(stats.pnfound))
+            ofh.write("\nTOTAL PARSE CACHE HITS = {}/{}".format(stats.parse_cache_hits,
+                      stats.parse_cache_hits + stats.parse_cache_misses))
             for [start_time, thid, ctype, dut, cmd, ctime] in stats.cmds:
                 start_msg = "\n{} {}".format(get_timestamp(this=start_time), thid)
                 if ctype == "CMD":
@@ -5190,6 +5192,12 @@ def _report_data_generation(execution_start, execution_end,
     align = {col: True for col in ["Module", "TestFunction", "LogMessage"]}
     Result.write_report_html(syslog_htm, syslog_rows, ReportType.SYSLOGS, False, links=links, align=align)
 
+    # syslog pattern hits
+    classifier = syslog.get_classifier()
+    if classifier.report():
+        classifier.save_report(paths.get_syslog_patterns_csv(logs_path),
+                               paths.get_syslog_patterns_htm(logs_path))
+
     # stats
     stats_csv = paths.get_stats_csv(logs_path)
     stats_rows = Result.read_report_csv(stats_csv)
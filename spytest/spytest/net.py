@@ -21,7 +21,7 @@ import utilities.parallel as putils
 from spytest import profile
 from spytest.dicts import SpyTestDict
 from spytest.logger import Logger, get_thread_name
-from spytest.template import Template
+from spytest.template import Template, ParseCache
 from spytest.access.connection import DeviceConnection, DeviceConnectionTimeout
 from spytest.access.connection import DeviceFileUpload, DeviceFileDownload
 from spytest.access.connection import initDeviceConnectionDebug
@@ -72,6 +72,7 @@ class Net(object):
         self.rest = dict()
         self.gnmi = dict()
         self.syslogs = dict()
+        self.syslogs_seen = dict()
         self.memory_checks = dict()
         self.skip_trans_helper = dict()
         self.last_mode = dict()
@@ -99,6 +100,7 @@ class Net(object):
             self.trace_callback_support = True
         self.use_sample_data = bool(env.get("SPYTEST_USE_SAMPLE_DATA", "0") != "0")
         self.cmd_tmpl_cache = dict()
+        self.parse_cache = ParseCache(int(env.get("SPYTEST_TEXTFSM_PARSE_CACHE_SIZE", "256")))
         self.debug_find_prompt = bool(env.get("SPYTEST_DEBUG_FIND_PROMPT", "0") != "0")
         self.dry_run_cmd_delay = env.get("SPYTEST_DRYRUN_CMD_DELAY", "0")
         self.dry_run_cmd_delay = int(self.dry_run_cmd_delay)
@@ -106,6 +108,11 @@ class Net(object):
         self.orig_time_sleep = time.sleep
         self.force_console_transfer = False
         self.max_cmds_once = 100
+        self.sftp_failed = dict()
+        self.sftp_retry_interval = int(env.get("SPYTEST_SFTP_RETRY_INTERVAL", "300"))
+        self.transfer_line_width = 76
+        self.transfer_block_size = int(env.get("SPYTEST_CONSOLE_TRANSFER_BLOCK_SIZE", "32768"))
+        self.transfer_compress = bool(env.get("SPYTEST_CONSOLE_TRANSFER_COMPRESS", "1") != "0")
         self.pending_downloads = dict()
         self.log_dutid_fmt = env.get("SPYTEST_LOG_DUTID_FMT", "LABEL")
         self.dut_log_lock = putils.Lock()
@@ -122,6 +129,7 @@ class Net(object):
         if devname not in self.topo["duts"]:
             self.topo["duts"].update({devname: {}})
             self.syslogs.update({devname: []})
+            self.syslogs_seen.update({devname: set()})
 
         access = self._get_dev_access(devname)
         access["type"] = "unknown"
@@ -2357,9 +2365,24 @@ class Net(object):
 
     def _tmpl_apply(self, devname, cmd, output):
         try:
-            [tmpl, parsed] = self.tmpl[devname].apply(output, cmd)
+            template = self.tmpl[devname]
+            key = None
+            if self.parse_cache.size > 0:
+                tmpl = template.get_apply_tmpl(cmd)
+                key = self.parse_cache.make_key(template.root, tmpl, template.platform,
+                                                template.cli, output)
+                parsed = self.parse_cache.get(key)
+                profile.parse_cache(parsed is not None)
+                if parsed is not None:
+                    msg = "PARSED OUTPUT REUSED: {} rows".format(len(parsed))
+                    self.dut_log(devname, msg, lvl=logging.DEBUG)
+                    self._trace_tmpl(cmd, template.get_tmpl(cmd))
+                    return parsed
+            [tmpl, parsed] = template.apply(output, cmd)
             self.dut_log(devname, str(parsed), lvl=logging.DEBUG)
             self._trace_tmpl(cmd, tmpl)
+            if key:
+                self.parse_cache.put(key, parsed)
             return parsed
         except Exception as e:
             self.logger.exception(e)
@@ -3166,45 +3189,81 @@ class Net(object):
 
         return False
 
-    def _transfer_base64(self, access, src_file, dst_file):
+    def _transfer_log(self, devname, method, size, wire_size, start_time):
+        elapsed = max(time.time() - start_time, 0.001)
+        msg = "Transfer: {} bytes ({} bytes sent) via {} in {:.2f} secs - {:.1f} KB/s"
+        msg = msg.format(size, wire_size, method, elapsed, size / elapsed / 1024.0)
+        self.dut_log(devname, msg)
+
+    def _transfer_remote_size(self, access, remote_file, prompt):
+        script_cmd = "stat -c %s {} 2>/dev/null || echo 0".format(remote_file)
+        output = self._send_command(access, script_cmd, prompt, True)
+        sizes = re.findall(r"^\s*(\d+)\s*$", output or "", re.M)
+        return int(sizes[-1]) if sizes else 0
+
+    def _transfer_base64(self, access, src_file, dst_file, resume=True):
+        """
+        console transfer: the file is compressed and base64 encoded, the
+        encoded lines are appended to a temporary file in heredoc blocks,
+        which is decoded and verified with a single md5sum at the end.
+        The temporary file is named after the content checksum, so an
+        interrupted transfer of the same content resumes after the last
+        complete line found on the device.
+        """
         devname = access["devname"]
         prompt = self._get_cli_prompt(devname)
-        script_cmd = "rm -f {0}.tmp {0}".format(dst_file)
-        self._exec(devname, script_cmd, prompt)
-        redir = ">"
-        lines = utils.b64encode(src_file)
-        (count, split) = (len(lines), self.max_cmds_once)
-        for i in range(0, count, split):
-            script_cmds = []
-            for j in range(i, i+split):
-                if j >= count:
-                    break
-                script_cmds.append(lines[j])
-            if script_cmds:
-                line = "".join(script_cmds)
-                script_cmd = "echo {} {} {}.tmp".format(line, redir, dst_file)
-                self._send_command(access, script_cmd, prompt, True)
-                redir = ">>"
-        script_cmd = "base64 -d {0}.tmp > {0}".format(dst_file)
-        self._exec(devname, script_cmd, prompt)
+        start_time = time.time()
+        compress = bool(self.transfer_compress and not self._is_gzip_file(src_file))
+        (lines, md5sum, size) = utils.b64encode_gzip(src_file, self.transfer_line_width, compress)
+        tmp_file = "{}.{}.b64".format(dst_file, md5sum[:12])
+        line_size = self.transfer_line_width + 1
+        block = max(self.transfer_block_size // line_size, 1)
+
+        for attempt in range(2):
+            done = 0
+            if resume and attempt == 0:
+                remote_size = self._transfer_remote_size(access, tmp_file, prompt)
+                # drop the partially written line if any
+                done = min(remote_size // line_size, len(lines))
+            if done:
+                msg = "Transfer: resuming {} after {}/{} lines".format(tmp_file, done, len(lines))
+                self.dut_log(devname, msg)
+                script_cmd = "rm -f {0}; truncate -s {1} {2}".format(dst_file, done * line_size, tmp_file)
+            else:
+                script_cmd = "rm -f {0} {1}".format(dst_file, tmp_file)
+            self._exec(devname, script_cmd, prompt)
+
+            for i in range(done, len(lines), block):
+                content = nl.join(lines[i:i+block])
+                script_cmd = "cat >> {} <<'SPYTEST_EOF'{}{}{}SPYTEST_EOF".format(tmp_file, nl, content, nl)
+                self._send_command(access, script_cmd, prompt, True, trace_dut_log=1)
+
+            decoder = "base64 -d {} | gunzip -c".format(tmp_file) if compress else "base64 -d {}".format(tmp_file)
+            script_cmd = "{} > {} && md5sum {}".format(decoder, dst_file, dst_file)
+            output = self._send_command(access, script_cmd, prompt, True)
+            if md5sum in (output or ""):
+                self._exec(devname, "rm -f {}".format(tmp_file), prompt)
+                wire_size = len(lines) * line_size
+                self._transfer_log(devname, "console", size, wire_size, start_time)
+                return True
+            msg = "Transfer: checksum mismatch for {} - restarting".format(dst_file)
+            self.dut_log(devname, msg, lvl=logging.WARNING)
+
+        self._exec(devname, "rm -f {} {}".format(dst_file, tmp_file), prompt)
+        msg = "Transfer: failed to transfer {} over console".format(src_file)
+        self.dut_log(devname, msg, lvl=logging.ERROR)
+        return False
 
     def _transfer_base64_small(self, access, src_file, dst_file):
-        script_cmds = []
-        script_cmd = "rm -f {0}.tmp {0}".format(dst_file)
-        script_cmds.append(script_cmd)
-        redir = ">"
-        lines = utils.b64encode(src_file)
-        for line in lines:
-            script_cmd = "echo {} {} {}.tmp".format(line, redir, dst_file)
-            script_cmds.append(script_cmd)
-            redir = ">>"
-        script_cmd = "base64 -d {0}.tmp > {0}".format(dst_file)
-        script_cmds.append(script_cmd)
+        return self._transfer_base64(access, src_file, dst_file, resume=False)
 
-        script_cmd = ";".join(script_cmds)
-        devname = access["devname"]
-        cli_prompt = self._get_cli_prompt(devname)
-        self._exec(devname, script_cmd, cli_prompt)
+    @staticmethod
+    def _is_gzip_file(src_file):
+        try:
+            with open(src_file, "rb") as fh:
+                return bool(fh.read(2) == b"\x1f\x8b")
+        except Exception:
+            return False
 
     def _save_json_to_remote_file(self, devname, data, dst_file, do_indent = False):
         devname = self._check_devname(devname)
@@ -3270,15 +3329,29 @@ class Net(object):
             self._transfer_base64(access, src_file, dst_file)
             return dst_file
         try:
+            start_time = time.time()
             connection_param = access["connection_param"]
-            msg = "Doing SFTP transfer {}".format(connection_param["mgmt-ip"])
-            self.dut_log(devname, msg)
             self._fetch_mgmt_ip(devname)
+            mgmt_ip = connection_param.get("mgmt-ip")
+            (failed_ip, failed_time) = self.sftp_failed.get(devname, (None, 0))
+            if mgmt_ip and failed_ip == mgmt_ip and \
+               time.time() - failed_time < self.sftp_retry_interval:
+                # no need to wait for the SFTP timeout again on the same
+                # address until the retry interval since the failure expires
+                self._transfer_base64(access, src_file, dst_file)
+                return dst_file
+            msg = "Doing SFTP transfer {}".format(mgmt_ip)
+            self.dut_log(devname, msg)
             DeviceFileUpload(self._get_handle(devname), src_file,
                              dst_file, connection_param)
+            size = os.path.getsize(src_file)
+            self._transfer_log(devname, "SFTP", size, size, start_time)
+            self.sftp_failed.pop(devname, None)
         except Exception as e:
             print(e)
             self.dut_log(devname, "SFTP Failed - Doing Console transfer")
+            if access["connection_param"].get("mgmt-ip"):
+                self.sftp_failed[devname] = (access["connection_param"]["mgmt-ip"], time.time())
             self._transfer_base64(access, src_file, dst_file)
         return dst_file
 
@@ -4027,7 +4100,7 @@ class Net(object):
         dut_name = self._get_dut_label(devname)
         access = self._get_dev_access(devname)
         entries = syslog.parse(lvl, msgtype, dut_name, output, access["filemode"])
-        failmsg = syslog.store(self.syslogs[devname], entries)
+        failmsg = syslog.store(self.syslogs[devname], entries, self.syslogs_seen[devname])
         if failmsg is not None:
             self.wa.report_dut_fail("unexpected_syslog_msg", failmsg)
 
@@ -4045,6 +4118,7 @@ class Net(object):
             retval.extend(self.syslogs[devname])
             if clear:
                 self.syslogs[devname] = []
+                self.syslogs_seen[devname] = set()
         return retval
 
     def do_audit(self, phase, dut, func_name, res):
@@ -53,6 +53,12 @@ def get_syslog_csv(prefix=None, consolidated=False):
 def get_syslog_htm(prefix=None, consolidated=False):
     return get_file_path("syslog", "html", prefix, consolidated)
 
+def get_syslog_patterns_csv(prefix=None, consolidated=False):
+    return get_file_path("syslog_patterns", "csv", prefix, consolidated)
+
+def get_syslog_patterns_htm(prefix=None, consolidated=False):
+    return get_file_path("syslog_patterns", "html", prefix, consolidated)
+
 def get_sysinfo_csv(prefix=None, consolidated=False):
     return get_file_path("sysinfo", "csv", prefix, consolidated)
 
@@ -19,6 +19,8 @@ class Profile(object):
         self.cmds = []
         self.profile_ids = dict()
         self.canbe_parallel = []
+        self.parse_cache_hits = 0
+        self.parse_cache_misses = 0
 
     def init(self):
         self.__init__()
@@ -70,6 +72,12 @@ class Profile(object):
         self.pnfound = self.pnfound + 1
         self.cmds.append([start_time, thid, "PROMPT_NFOUND", None, cmd, ""])
 
+    def parse_cache(self, hit):
+        if hit:
+            self.parse_cache_hits = self.parse_cache_hits + 1
+        else:
+            self.parse_cache_misses = self.parse_cache_misses + 1
+
     def get_stats(self):
         stats = SpyTestDict()
         stats.tg_total_wait = self.tg_total_wait
@@ -83,6 +91,8 @@ class Profile(object):
         stats.cmds = self.cmds
         stats.canbe_parallel = self.canbe_parallel
         stats.pnfound = self.pnfound
+        stats.parse_cache_hits = self.parse_cache_hits
+        stats.parse_cache_misses = self.parse_cache_misses
         return stats
 
 obj = Profile()
@@ -104,3 +114,6 @@ def get_stats():
 def prompt_nfound(cmd):
     return obj.prompt_nfound(cmd)
 
+def parse_cache(hit):
+    return obj.parse_cache(hit)
+
@@ -1,12 +1,16 @@
 import os
 import re
 import random
+from collections import OrderedDict
 import spytest.env as env
 from spytest.ordyaml import OrderedYaml
 import utilities.common as utils
 
 config = None
+classifier = None
 levels = ['emerg', 'alert', 'crit', 'err', 'warning', 'notice', 'info', 'debug', 'none']
+colors = ["yellow", "green", "red"]
+match_cres = {}
 
 def get_config():
     global config
@@ -17,17 +21,125 @@ def get_config():
         filename = os.path.join(root, "reporting", "syslogs.yaml")
         oyaml = OrderedYaml(filename,[])
         data = oyaml.get_data() or dict()
-    for color in ["yellow", "green", "red"]:
+    for color in colors:
         if color not in data:
             data[color] = []
+    config = data
     return data
 
 def match(lvl, line):
-    index = levels.index(lvl)
-    needed = "|".join(levels[:index + 1])
-    regex = r"^\S+\s+\d+\s+\d+:\d+:\d+(\.\d+){{0,1}}\s+\S+\s+({})\s+"
-    cre = re.compile(regex.format(needed.upper()))
-    return cre.search(line)
+    if lvl not in match_cres:
+        index = levels.index(lvl)
+        needed = "|".join(levels[:index + 1])
+        regex = r"^\S+\s+\d+\s+\d+:\d+:\d+(\.\d+){{0,1}}\s+\S+\s+({})\s+"
+        match_cres[lvl] = re.compile(regex.format(needed.upper()))
+    return match_cres[lvl].search(line)
+
+class SyslogClassifier(object):
+    """
+    classifies the syslog messages with the yellow, green and red patterns
+    compiled once, counting the hits per pattern
+    @data patterns per color, defaults to reporting/syslogs.yaml
+    @cache_size number of distinct messages whose classification is remembered
+    """
+    def __init__(self, data=None, cache_size=10000):
+        data = get_config() if data is None else data
+        self.patterns = OrderedDict()
+        self.hits = OrderedDict()
+        for color in colors:
+            self.patterns[color] = [(regex, re.compile(regex)) for regex in data.get(color) or []]
+            self.hits[color] = OrderedDict([(regex, 0) for regex in data.get(color) or []])
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def _match(self, color, msg):
+        for regex, cre in self.patterns[color]:
+            if cre.match(msg):
+                return regex
+        return None
+
+    def classify_message(self, msg):
+        """
+        returns the first matching (green, yellow, red) patterns of the message,
+        green only when it matches a green pattern
+        """
+        if msg in self.cache:
+            return self.cache[msg]
+        gmatch = self._match("green", msg)
+        if gmatch is not None:
+            rv = (gmatch, None, None)
+        else:
+            rv = (None, self._match("yellow", msg), self._match("red", msg))
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[msg] = rv
+        return rv
+
+    def classify(self, msgs):
+        return [self.classify_message(msg) for msg in msgs]
+
+    def count(self, color, regex):
+        if regex is not None:
+            self.hits[color][regex] = self.hits[color].get(regex, 0) + 1
+
+    def store(self, prev, current, seen=None, offset=7):
+        """
+        appends the entries of current to prev, discarding green messages and
+        yellow messages already in prev, returns the first red entry or None
+        @seen set of the messages in prev, updated with the appended ones
+        """
+        if seen is None:
+            seen = set([entry[offset] for entry in prev])
+        rmatch = None
+        results = self.classify([entry[offset] for entry in current])
+        for entry, (gmatch, ymatch, redmatch) in zip(current, results):
+
+            # discard green syslogs
+            if gmatch is not None:
+                self.count("green", gmatch)
+                continue
+
+            # report yellow syslogs only once
+            msg = entry[offset]
+            if ymatch is not None and msg in seen:
+                self.count("yellow", ymatch)
+                continue
+
+            # add the entry to current syslogs
+            prev.append(entry)
+            seen.add(msg)
+            self.count("yellow", ymatch)
+            self.count("red", redmatch)
+
+            # first red syslog to report SW Issue
+            if rmatch is None and redmatch is not None:
+                rmatch = " ".join(entry)
+
+        return rmatch
+
+    def report(self):
+        """
+        returns the rows [color, pattern, hits] of all the patterns
+        """
+        rows = []
+        for color, hits in self.hits.items():
+            for regex, count in hits.items():
+                rows.append([color, regex, count])
+        return rows
+
+    def save_report(self, csv_file, htm_file=None):
+        header = ["#", "Color", "Pattern", "Hits"]
+        rows = [[index + 1] + row for index, row in enumerate(self.report())]
+        utils.write_csv_file(header, rows, csv_file)
+        if htm_file:
+            align = {col: True for col in ["Pattern"]}
+            utils.write_html_table3(header, rows, htm_file, align=align, total=False)
+
+def get_classifier():
+    global classifier
+    if not classifier:
+        classifier = SyslogClassifier()
+    return classifier
 
 def parse(lvl, msgtype, dut_name, output, filemode=False):
     entries = []
@@ -76,45 +188,5 @@ def parse(lvl, msgtype, dut_name, output, filemode=False):
 
     return entries
 
-def store(prev, current):
-    cfg = get_config()
-    rmatch, offset = None, 7
-    for entry in current:
-        gmatch, ymatch, pmatch = None, None, None
-
-        # find green syslogs to discard
-        for regex in cfg["green"]:
-            if re.compile(regex).match(entry[offset]):
-                gmatch = regex
-                break
-        if gmatch is not None:
-            continue # ignore the syslog
-
-        # find yellow syslogs to report only once
-        for regex in cfg["yellow"]:
-            if re.compile(regex).match(entry[offset]):
-                ymatch = regex
-                break
-
-        # check if yellow syslog already noted
-        for pentry in prev:
-            if pentry[offset] == entry[offset]:
-                pmatch = ymatch
-                break
-        if pmatch is not None:
-            continue # syslog already reported once
-
-        # add the entry to current syslogs
-        prev.append(entry)
-
-        if rmatch is not None:
-            continue # first red syslog already noted
-
-        # check if red syslog to report SW Issue
-        for regex in cfg["red"]:
-            if re.compile(regex).match(entry[offset]):
-                rmatch = " ".join(entry)
-                break
-
-    return rmatch
-
+def store(prev, current, seen=None):
+    return get_classifier().store(prev, current, seen)
@@ -2,6 +2,9 @@ import sys
 import os
 import re
 import json
+import hashlib
+import threading
+from collections import OrderedDict
 
 import textfsm
 try:
@@ -11,6 +14,123 @@ except Exception:
 
 import spytest.env as env
 
+# process wide registry of compiled templates and index lookups
+# shared by the Template instances of all the devices and threads
+registry_lock = threading.Lock()
+compiled_fsms = dict()   # template path => [mtime, TextFSM, lock]
+compiled_indexes = dict()   # index path => [mtime, IndexTable]
+index_lookups = dict()   # (index path, attributes) => template name
+max_index_lookups = 65536
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+# get the compiled FSM of the template file, compiled again when the file changes
+def get_fsm(path):
+    mtime = get_mtime(path)
+    entry = compiled_fsms.get(path)
+    if entry and entry[0] == mtime:
+        return entry
+    with registry_lock:
+        entry = compiled_fsms.get(path)
+        if not entry or entry[0] != mtime:
+            with open(path, "r") as tmpl_fp:
+                entry = [mtime, textfsm.TextFSM(tmpl_fp), threading.Lock()]
+            compiled_fsms[path] = entry
+    return entry
+
+# parse the data with the compiled template, returns header and rows
+def parse_text(path, data):
+    fsm, lock = get_fsm(path)[1:]
+    with lock:
+        fsm.Reset()
+        return fsm.header, fsm.ParseText(data)
+
+# get the index table, read again when the file changes
+def get_index(root, index_file):
+    path = os.path.join(root, index_file)
+    mtime = get_mtime(path)
+    entry = compiled_indexes.get(path)
+    if entry and entry[0] == mtime:
+        return entry[1]
+    with registry_lock:
+        entry = compiled_indexes.get(path)
+        if not entry or entry[0] != mtime:
+            # clitable caches the index for ever, drop it
+            clitable.CliTable.INDEX.pop(path, None)
+            entry = [mtime, clitable.CliTable(index_file, root).index]
+            compiled_indexes[path] = entry
+            for key in [key for key in index_lookups if key[0] == path]:
+                index_lookups.pop(key, None)
+    return entry[1]
+
+# find the template matching the attributes in the index table
+def lookup_index(root, index_file, attrs):
+    index = get_index(root, index_file)
+    key = (os.path.join(root, index_file), tuple(sorted(attrs.items())))
+    try:
+        return index_lookups[key]
+    except KeyError:
+        pass
+    row_idx = index.GetRowMatch(attrs)
+    tmpl = index.index[row_idx]['Template'] if row_idx else None
+    if len(index_lookups) >= max_index_lookups:
+        index_lookups.clear()
+    index_lookups[key] = tmpl
+    return tmpl
+
+# bounded LRU of parsed outputs keyed by (template, template mtime, platform, cli, output digest)
+# hits and misses are counted in the profile by the caller
+class ParseCache(object):
+
+    def __init__(self, size=256):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    # tmpl is the template name(s) of the index, separated by ":" when merged by clitable
+    def make_key(self, root, tmpl, platform, cli, output):
+        data = output.encode("utf-8") if not isinstance(output, bytes) else output
+        mtimes = tuple([get_mtime(os.path.join(root, name)) for name in (tmpl or "").split(":")])
+        return (tmpl, mtimes, platform, cli, len(data), hashlib.md5(data).hexdigest())
+
+    # rows are copied, so callers changing the result do not change the cached one
+    @staticmethod
+    def copy(parsed):
+        retval = []
+        for row in parsed:
+            row = dict(row)
+            for key, value in row.items():
+                if isinstance(value, list):
+                    row[key] = list(value)
+            retval.append(row)
+        return retval
+
+    def get(self, key):
+        with self.lock:
+            parsed = self.entries.pop(key, None)
+            if parsed is None:
+                return None
+            self.entries[key] = parsed
+        return self.copy(parsed)
+
+    def put(self, key, parsed):
+        if self.size <= 0:
+            return
+        parsed = self.copy(parsed)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = parsed
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
 class Template(object):
 
     def __init__(self, platform=None, cli=None):
@@ -19,18 +139,14 @@ class Template(object):
     def reinit(self, platform=None, cli=None):
         self.root = os.path.join(os.path.dirname(__file__), '..', 'templates')
         self.samples = os.path.join(self.root, 'test')
-        index_file = env.get("SPYTEST_TEXTFSM_INDEX_FILENAME", "index")
-        self.cli_table = clitable.CliTable(index_file, self.root)
+        self.index_file = env.get("SPYTEST_TEXTFSM_INDEX_FILENAME", "index")
+        self.cli_table = clitable.CliTable(self.index_file, self.root)
         self.platform = platform
         self.cli = cli
 
     # find the template given command
     def get_tmpl(self, cmd):
-        attrs = dict(Command=cmd)
-        row_idx = self.cli_table.index.GetRowMatch(attrs)
-        if row_idx == 0:
-            return None
-        return self.cli_table.index.index[row_idx]['Template']
+        return lookup_index(self.root, self.index_file, dict(Command=cmd))
 
     # retrive template and sameple file given the command
     def read_sample(self, cmd):
@@ -55,11 +171,33 @@ class Template(object):
                 return [tmpl_file, data]
         return [tmpl_file, ""]
 
-    # find template the given command and apply on given data
-    def apply(self, output, cmd):
+    def _apply_attrs(self, cmd):
         attrs = dict(Command=cmd)
         if self.platform: attrs["Platform"] = self.platform
         if self.cli: attrs["cli"] = self.cli
+        return attrs
+
+    # find the template used to apply on the output of given command
+    def get_apply_tmpl(self, cmd):
+        return lookup_index(self.root, self.index_file, self._apply_attrs(cmd))
+
+    # find template the given command and apply on given data
+    def apply(self, output, cmd):
+        attrs = self._apply_attrs(cmd)
+        templates = lookup_index(self.root, self.index_file, attrs)
+        if not templates:
+            msg = 'No template found for attributes: "%s"' % attrs
+            raise Exception('Unable to parse command "%s" - %s' % (cmd, msg))
+        if ":" in templates:
+            return self._apply_cli_table(output, cmd, attrs)
+        header, rows = parse_text(os.path.join(self.root, templates), output)
+        keys = [key.lower() for key in header]
+        objs = [dict(zip(keys, row)) for row in rows]
+        return [self.get_tmpl(cmd), objs]
+
+    # parse with several templates merged by clitable
+    def _apply_cli_table(self, output, cmd, attrs):
+        self.cli_table.index = get_index(self.root, self.index_file)
         try:
             self.cli_table.ParseCmd(output, attrs)
             objs = []
@@ -75,13 +213,21 @@ class Template(object):
         except clitable.CliTableError as e:
             raise Exception('Unable to parse command "%s" - %s' % (cmd, str(e)))
 
+    # apply templates on a list of (output, cmd), failed entries are [None, output]
+    def apply_bulk(self, items, ignore_errors=True):
+        retval = []
+        for output, cmd in items:
+            try:
+                retval.append(self.apply(output, cmd))
+            except Exception:
+                if not ignore_errors:
+                    raise
+                retval.append([None, output])
+        return retval
+
     # apply the given template on given data
     def apply_textfsm(self, tmpl_file, data):
-        tmpl_file2 = os.path.join(self.root, tmpl_file)
-        tmpl_fp = open(tmpl_file2, "r")
-        out = textfsm.TextFSM(tmpl_fp).ParseText(data)
-        tmpl_fp.close()
-        return out
+        return parse_text(os.path.join(self.root, tmpl_file), data)[1]
 
 if __name__ == "__main__":
     template = Template()
@@ -1,13 +1,24 @@
 """
-AF_PACKET receive support
+AF_PACKET receive and batched transmit support
 
 When VLAN offload is enabled on the NIC Linux will not deliver the VLAN tag
 in the data returned by recv. Instead, it delivers the VLAN TCI in a control
 message. Python 2.x doesn't have built-in support for recvmsg, so we have to
 use ctypes to call it. The recv function exported by this module reconstructs
 the VLAN tag if it was offloaded.
+
+TxSocket sends a batch of frames with a single system call, either through
+a memory mapped PACKET_TX_RING or with sendmmsg, falling back to one send
+per frame when neither is available.
+
+RxRing reads the frames in blocks from a memory mapped PACKET_RX_RING. The
+frame length and a slice of its tail are read in place in the ring, so the
+frames can be classified without copying them out.
 """
 
+import mmap
+import select
+import socket
 import struct
 from ctypes import sizeof
 from ctypes import get_errno
@@ -24,12 +35,44 @@ from ctypes import c_ushort
 from ctypes import c_uint
 from ctypes import Structure
 from ctypes import c_uint32
+from ctypes import addressof
+from ctypes import memmove
+from ctypes import string_at
+from ctypes import c_ubyte
 
 ETH_P_8021Q = 0x8100
 SOL_PACKET = 263
 PACKET_AUXDATA = 8
 TP_STATUS_VLAN_VALID = 1 << 4
 
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+PACKET_TX_RING = 13
+TPACKET_V2 = 1
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TP_STATUS_AVAILABLE = 0
+TP_STATUS_SEND_REQUEST = 1
+TP_STATUS_SENDING = 2
+TP_STATUS_WRONG_FORMAT = 4
+# TPACKET_ALIGN(sizeof(struct tpacket2_hdr)), frame data offset in TX ring
+TPACKET2_HDRLEN = 32
+TPACKET_ALIGNMENT = 16
+# tp_status, tp_len, tp_snaplen, tp_mac, tp_net, tp_sec, tp_nsec, tp_vlan_tci
+TPACKET2_HDR = struct.Struct("IIIHHIIH")
+# room for the sockaddr_ll and the alignment before the frame data in RX ring
+RX_FRAME_OFFSET = 64
+
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+BPF_LD_W_LEN = 0x80
+BPF_ALU_SUB_K = 0x14
+BPF_TAX = 0x07
+BPF_LD_W_IND = 0x40
+BPF_JEQ_K = 0x15
+BPF_RET_K = 0x06
+BPF_MAX_JUMP = 255
+
 class struct_iovec(Structure):
     _fields_ = [
         ("iov_base", c_void_p),
@@ -47,6 +90,26 @@ class struct_msghdr(Structure):
         ("msg_flags", c_int),
     ]
 
+class struct_mmsghdr(Structure):
+    _fields_ = [
+        ("msg_hdr", struct_msghdr),
+        ("msg_len", c_uint),
+    ]
+
+class struct_sock_filter(Structure):
+    _fields_ = [
+        ("code", c_ushort),
+        ("jt", c_ubyte),
+        ("jf", c_ubyte),
+        ("k", c_uint32),
+    ]
+
+class struct_sock_fprog(Structure):
+    _fields_ = [
+        ("len", c_ushort),
+        ("filter", POINTER(struct_sock_filter)),
+    ]
+
 class struct_cmsghdr(Structure):
     _fields_ = [
         ("cmsg_len", c_size_t),
@@ -70,6 +133,11 @@ recvmsg = libc.recvmsg
 recvmsg.argtypes = [c_int, POINTER(struct_msghdr), c_int]
 recvmsg.retype = c_int
 
+sendmmsg = getattr(libc, "sendmmsg", None)
+if sendmmsg:
+    sendmmsg.argtypes = [c_int, POINTER(struct_mmsghdr), c_uint, c_int]
+    sendmmsg.restype = c_int
+
 def enable_auxdata(sk):
     """
     Ask the kernel to return the VLAN tag in a control message
@@ -124,3 +192,271 @@ def recv(sk, bufsize):
         return buf.raw[:12] + tag + buf.raw[12:rv]
     else:
         return buf.raw[:rv]
+
+def align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+def ring_open(sk, option, max_len, frame_count):
+    """
+    Setup a TPACKET_V2 ring on the socket
+    @sk Socket
+    @option PACKET_RX_RING or PACKET_TX_RING
+    @max_len Maximum frame size including the ring frame header
+    @frame_count Minimum number of frames in the ring
+    Returns the mmap of the ring and the offset of each frame in it
+    """
+    frame_size = align(TPACKET2_HDRLEN + max_len, TPACKET_ALIGNMENT)
+    block_size = align(frame_size, mmap.PAGESIZE)
+    frames_per_block = block_size // frame_size
+    block_count = (frame_count + frames_per_block - 1) // frames_per_block
+    frame_count = block_count * frames_per_block
+    sk.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V2)
+    req = struct.pack("IIII", block_size, block_count, frame_size, frame_count)
+    sk.setsockopt(SOL_PACKET, option, req)
+    ring = mmap.mmap(sk.fileno(), block_size * block_count,
+                     mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+    offsets = [(index // frames_per_block) * block_size + (index % frames_per_block) * frame_size
+               for index in range(frame_count)]
+    return (ring, offsets)
+
+def signature_filter(prefixes, tail, snaplen):
+    """
+    BPF program accepting the frames having one of the prefixes as the
+    32 bit word starting tail bytes before the end of the frame
+    The other frames are truncated to snaplen bytes
+    @prefixes List of 32 bit values
+    @tail Offset of the word from the end of the frame
+    @snaplen Bytes to keep in the other frames
+    Returns None when there are too many prefixes for a single program
+    """
+    prefixes = sorted(set(prefixes))
+    if len(prefixes) > BPF_MAX_JUMP:
+        return None
+    insns = [(BPF_LD_W_LEN, 0, 0, 0), (BPF_ALU_SUB_K, 0, 0, tail),
+             (BPF_TAX, 0, 0, 0), (BPF_LD_W_IND, 0, 0, 0)]
+    for index, prefix in enumerate(prefixes):
+        insns.append((BPF_JEQ_K, len(prefixes) - index, 0, prefix))
+    insns.append((BPF_RET_K, 0, 0, snaplen))
+    insns.append((BPF_RET_K, 0, 0, 0x40000))
+    return insns
+
+def attach_filter(sk, insns):
+    """
+    Attach a classic BPF program to the socket
+    @sk Socket
+    @insns List of (code, jt, jf, k) instructions
+    """
+    filters = (struct_sock_filter * len(insns))(*insns)
+    fprog = struct_sock_fprog(len(insns), cast(filters, POINTER(struct_sock_filter)))
+    sk.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, string_at(addressof(fprog), sizeof(fprog)))
+
+def detach_filter(sk):
+    try:
+        sk.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+    except Exception:
+        # no filter attached
+        pass
+
+class RxRing(object):
+    """
+    Memory mapped PACKET_RX_RING
+    @sk Bound AF_PACKET socket
+    @max_len Maximum frame size
+    @frame_count Number of frames in the RX ring
+    """
+    def __init__(self, sk, max_len=9216, frame_count=256):
+        self.sock = sk
+        (self.ring, self.offsets) = ring_open(sk, PACKET_RX_RING, RX_FRAME_OFFSET + max_len, frame_count)
+        self.head = 0
+        self.pending = []
+        self.poller = select.poll()
+        self.poller.register(sk.fileno(), select.POLLIN | select.POLLERR)
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def _ready(self):
+        return TPACKET2_HDR.unpack_from(self.ring, self.offsets[self.head])[0] & TP_STATUS_USER
+
+    def release(self):
+        """
+        Give the frames returned by the last recv_block back to the kernel
+        """
+        for index in self.pending:
+            struct.pack_into("I", self.ring, self.offsets[index], TP_STATUS_KERNEL)
+        self.pending = []
+
+    def recv_block(self, timeout=1.0, tail=12, size=8):
+        """
+        Wait for frames and return the list of (index, length, signature)
+        of the frames available in the ring
+        The length includes the VLAN tag when it is offloaded. The signature
+        is the size bytes starting tail bytes before the end of the frame,
+        None when the frame is truncated. The frames returned by the previous
+        call are released, so frame must be called before the next one.
+        """
+        self.release()
+        if not self._ready():
+            self.poller.poll(int(timeout * 1000))
+        (ring, offsets, frames) = (self.ring, self.offsets, [])
+        (head, count, unpack) = (self.head, len(self.offsets), TPACKET2_HDR.unpack_from)
+        while len(frames) < count:
+            offset = offsets[head]
+            (status, length, snaplen, mac, _, _, _, tci) = unpack(ring, offset)
+            if not status & TP_STATUS_USER:
+                break
+            signature = None
+            if snaplen == length and length >= tail:
+                end = offset + mac + length - tail
+                signature = ring[end:end+size]
+            if tci != 0 or status & TP_STATUS_VLAN_VALID:
+                length = length + 4
+            frames.append((head, length, signature))
+            head = (head + 1) % count
+        self.head = head
+        self.pending = [index for index, _, _ in frames]
+        return frames
+
+    def frame(self, index):
+        """
+        Copy of a frame returned by the last recv_block with its VLAN tag
+        and its receive timestamp
+        """
+        offset = self.offsets[index]
+        (status, _, snaplen, mac, _, sec, nsec, tci) = TPACKET2_HDR.unpack_from(self.ring, offset)
+        data = self.ring[offset+mac:offset+mac+snaplen]
+        if tci != 0 or status & TP_STATUS_VLAN_VALID:
+            # Insert VLAN tag
+            tag = struct.pack("!HH", ETH_P_8021Q, tci)
+            data = data[:12] + tag + data[12:]
+        return (data, sec + nsec / 1000000000.0)
+
+class TxSocket(object):
+    """
+    Batched AF_PACKET transmit
+    @iface Interface to send on
+    @backend "ring" for PACKET_TX_RING, "mmsg" for sendmmsg or "socket"
+    @max_len Maximum frame size
+    @frame_count Number of frames in the TX ring
+    """
+    def __init__(self, iface, backend="ring", max_len=9216, frame_count=256):
+        # protocol 0: transmit only, nothing is queued for receive
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        self.sock.bind((iface, 0))
+        self.max_len = max_len
+        self.ring = None
+        self.backend = "socket"
+        if backend == "ring":
+            try:
+                (self.ring, self.offsets) = ring_open(self.sock, PACKET_TX_RING, max_len, frame_count)
+                self.head = 0
+                self.backend = "ring"
+            except Exception:
+                self.ring = None
+                backend = "mmsg"
+        if backend == "mmsg" and sendmmsg:
+            self.backend = "mmsg"
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        self.sock.close()
+
+    def send(self, frames):
+        """
+        Send the frames, returns the indexes of the frames that were dropped
+        """
+        if self.backend == "ring":
+            return self._ring_send(frames)
+        if self.backend == "mmsg":
+            return self._mmsg_send(frames)
+        dropped = []
+        for index, data in enumerate(frames):
+            try:
+                self.sock.send(data)
+            except Exception:
+                dropped.append(index)
+        return dropped
+
+    def _ring_flush(self):
+        try:
+            self.sock.send(b"")
+        except Exception:
+            pass
+
+    def _ring_send(self, frames):
+        (ring, offsets, count) = (self.ring, self.offsets, len(self.offsets))
+        (dropped, queued) = ([], [])
+        for index, data in enumerate(frames):
+            if len(data) > self.max_len:
+                dropped.append(index)
+                continue
+            offset = offsets[self.head]
+            if struct.unpack_from("I", ring, offset)[0] != TP_STATUS_AVAILABLE:
+                # ring full, let the kernel drain it
+                dropped.extend(self._ring_complete(queued))
+                queued = []
+                if struct.unpack_from("I", ring, offset)[0] != TP_STATUS_AVAILABLE:
+                    dropped.append(index)
+                    continue
+            ring[offset+TPACKET2_HDRLEN:offset+TPACKET2_HDRLEN+len(data)] = data
+            struct.pack_into("I", ring, offset+4, len(data))
+            struct.pack_into("I", ring, offset, TP_STATUS_SEND_REQUEST)
+            queued.append((index, offset))
+            self.head = (self.head + 1) % count
+        dropped.extend(self._ring_complete(queued))
+        return dropped
+
+    def _ring_complete(self, queued):
+        # blocking send returns when the queued frames are transmitted
+        self._ring_flush()
+        dropped = []
+        for index, offset in queued:
+            status = struct.unpack_from("I", self.ring, offset)[0]
+            if status in [TP_STATUS_SEND_REQUEST, TP_STATUS_SENDING]:
+                self._ring_flush()
+                status = struct.unpack_from("I", self.ring, offset)[0]
+            if status != TP_STATUS_AVAILABLE:
+                # rejected by the kernel or the device queue
+                struct.pack_into("I", self.ring, offset, TP_STATUS_AVAILABLE)
+                dropped.append(index)
+        return dropped
+
+    def _mmsg_alloc(self, count):
+        # frames are copied in a preallocated buffer, one iovec per frame
+        self.mmsg_count = count
+        self.mmsg_buf = create_string_buffer(count * self.max_len)
+        self.mmsg_iovs = (struct_iovec * count)()
+        self.mmsg_msgs = (struct_mmsghdr * count)()
+        base = addressof(self.mmsg_buf)
+        for index in range(count):
+            self.mmsg_iovs[index].iov_base = base + index * self.max_len
+            self.mmsg_msgs[index].msg_hdr.msg_iov = pointer(self.mmsg_iovs[index])
+            self.mmsg_msgs[index].msg_hdr.msg_iovlen = 1
+
+    def _mmsg_send(self, frames):
+        if len(frames) > getattr(self, "mmsg_count", 0):
+            self._mmsg_alloc(len(frames))
+        (iovs, msgs, dropped) = (self.mmsg_iovs, self.mmsg_msgs, set())
+        # only the frames that fit are in the message vector, slots maps them back to the frame indexes
+        slots = []
+        for index, data in enumerate(frames):
+            if len(data) > self.max_len:
+                dropped.add(index)
+                continue
+            slot = len(slots)
+            memmove(iovs[slot].iov_base, data, len(data))
+            iovs[slot].iov_len = len(data)
+            slots.append(index)
+        (sent, count) = (0, len(slots))
+        while sent < count:
+            rv = sendmmsg(self.sock.fileno(), byref(msgs[sent]), count - sent, 0)
+            if rv <= 0:
+                # the frame that failed is dropped, carry on with the rest
+                dropped.add(slots[sent])
+                rv = 1
+            sent = sent + rv
+        return sorted(dropped)
@@ -0,0 +1,151 @@
+import os
+import time
+import struct
+import binascii
+import tempfile
+import threading
+
+# Capture buffer: the raw bytes of the captured frames are kept in memory
+# up to max_frames, then the buffer is spilled to a pcap file, so the memory
+# used by a long capture is bounded and the frames are read back in pages
+
+PCAP_HEADER = struct.Struct("IHHiIII")
+PCAP_RECORD = struct.Struct("IIII")
+PCAP_MAGIC = 0xa1b2c3d4
+LINKTYPE_ETHERNET = 1
+# file offset of every INDEX_STEP frame in the spill file
+INDEX_STEP = 256
+
+def parse_pattern(pattern):
+    # "00 00 0a 01", "00.00.0a.01" or "00000a01"
+    value = str(pattern).replace(" ", "").replace(".", "").replace(":", "")
+    if value.lower().startswith("0x"):
+        value = value[2:]
+    return binascii.unhexlify(value)
+
+class CaptureBuffer(object):
+    """
+    bounded capture of the raw frames with their timestamps
+    @iface interface name used in the spill file name
+    @max_frames frames kept in memory before spilling to the pcap file
+    @max_spill maximum size of the spill file in bytes, frames are dropped beyond
+    @spill_dir directory of the spill file
+    """
+    def __init__(self, iface, max_frames=10000, max_spill=1024*1024*1024, spill_dir=None):
+        self.iface = iface or "none"
+        self.max_frames = max_frames
+        self.max_spill = max_spill
+        self.spill_dir = spill_dir or tempfile.gettempdir()
+        self.slice_size = 0
+        self.patterns = []
+        self.spill_file = None
+        self.spill_path = None
+        self.lock = threading.Lock()
+        self.clear()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.spill_file:
+            self.spill_file.close()
+            self.spill_file = None
+        if self.spill_path and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+        self.spill_path = None
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        self.close()
+        self.frames = []
+        self.spilled = 0
+        self.spill_size = 0
+        self.spill_index = []
+        self.dropped = 0
+
+    def set_slice_size(self, slice_size):
+        self.slice_size = max(int(slice_size or 0), 0)
+
+    def set_filter(self, patterns):
+        """
+        @patterns list of (offset, pattern) all matching the captured frames
+        """
+        self.patterns = [(int(offset), parse_pattern(pattern)) for offset, pattern in patterns]
+
+    def match(self, data):
+        for offset, pattern in self.patterns:
+            if data[offset:offset+len(pattern)] != pattern:
+                return False
+        return True
+
+    def add(self, data, timestamp=None):
+        """
+        add a frame when it matches the filter, returns True when it matches
+        """
+        if self.patterns and not self.match(data):
+            return False
+        length = len(data)
+        if self.slice_size and length > self.slice_size:
+            data = data[:self.slice_size]
+        with self.lock:
+            self.frames.append((timestamp or time.time(), length, data))
+            if len(self.frames) >= self.max_frames:
+                self._spill()
+        return True
+
+    def count(self):
+        return self.spilled + len(self.frames)
+
+    def _spill(self):
+        if not self.frames:
+            return
+        if not self.spill_file:
+            (fd, self.spill_path) = tempfile.mkstemp(prefix="capture-{}-".format(self.iface),
+                                                     suffix=".pcap", dir=self.spill_dir)
+            self.spill_file = os.fdopen(fd, "w+b")
+            self.spill_file.write(PCAP_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET))
+            self.spill_size = PCAP_HEADER.size
+        self.spill_file.seek(0, os.SEEK_END)
+        for timestamp, length, data in self.frames:
+            size = PCAP_RECORD.size + len(data)
+            if self.spill_size + size > self.max_spill:
+                self.dropped = self.dropped + 1
+                continue
+            if self.spilled % INDEX_STEP == 0:
+                self.spill_index.append(self.spill_size)
+            (sec, usec) = (int(timestamp), int((timestamp % 1) * 1000000))
+            self.spill_file.write(PCAP_RECORD.pack(sec, usec, len(data), length))
+            self.spill_file.write(data)
+            self.spill_size = self.spill_size + size
+            self.spilled = self.spilled + 1
+        self.frames = []
+
+    def _read_spilled(self, start, count):
+        if start >= self.spilled or count <= 0:
+            return []
+        self.spill_file.flush()
+        self.spill_file.seek(self.spill_index[start // INDEX_STEP])
+        (frames, index) = ([], start // INDEX_STEP * INDEX_STEP)
+        end = min(start + count, self.spilled)
+        while index < end:
+            (sec, usec, caplen, length) = PCAP_RECORD.unpack(self.spill_file.read(PCAP_RECORD.size))
+            data = self.spill_file.read(caplen)
+            if index >= start:
+                frames.append((sec + usec / 1000000.0, length, data))
+            index = index + 1
+        return frames
+
+    def read(self, start=0, count=None):
+        """
+        returns list of (timestamp, length, data) for the frames start..start+count
+        in the order of capture, from the spill file and then from the memory
+        """
+        with self.lock:
+            if count is None:
+                count = self.count()
+            frames = self._read_spilled(start, count)
+            start = max(start - self.spilled, 0)
+            return frames + self.frames[start:start + count - len(frames)]
@@ -0,0 +1,278 @@
+import sys
+import zlib
+import socket
+import struct
+import binascii
+
+from scapy.packet import Padding, Raw, NoPayload
+from scapy.layers.l2 import Ether, Dot1Q, ARP
+from scapy.layers.inet import IP, UDP, TCP, ICMP
+from scapy.layers.inet6 import IPv6, ICMPv6ND_NA
+from scapy.contrib.igmp import IGMP
+from utils import Utils
+
+# Compiled streams: the first frame of a stream is serialized by scapy once,
+# the next frames are produced by patching the varying fields in place in a
+# bytearray and updating the checksums covering them incrementally (RFC 1624)
+
+if sys.version_info[0] < 3:
+    def body_view(frame, size):
+        return buffer(frame, 0, size) # pylint: disable=undefined-variable
+else:
+    def body_view(frame, size):
+        return memoryview(frame)[:size]
+
+known_layers = (Ether, Dot1Q, ARP, IP, IPv6, TCP, UDP, ICMP, ICMPv6ND_NA, IGMP, Padding, Raw)
+
+step_modes = ["increment", "decrement"]
+port_step_modes = ["increment", "decrement", "incr", "decr"]
+
+def mac2int(mac):
+    return int(mac.replace(':', '').replace(".", ''), 16)
+
+def ipv42int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+def ipv62int(ip):
+    return Utils.ipv6_ip2long(ip)
+
+def pack_mac(frame, offset, value):
+    struct.pack_into("!HI", frame, offset, value >> 32, value & 0xFFFFFFFF)
+
+def pack_ipv4(frame, offset, value):
+    struct.pack_into("!I", frame, offset, value)
+
+def pack_ipv6(frame, offset, value):
+    struct.pack_into("!QQ", frame, offset, value >> 64, value & 0xFFFFFFFFFFFFFFFF)
+
+def pack_short(frame, offset, value):
+    struct.pack_into("!H", frame, offset, value)
+
+def pack_vlan(frame, offset, value):
+    tci = struct.unpack_from("!H", frame, offset)[0]
+    struct.pack_into("!H", frame, offset, (tci & 0xF000) | value)
+
+# kind: (width, mask, to int, pack)
+field_kinds = {
+    "mac": (6, (1 << 48) - 1, mac2int, pack_mac),
+    "ipv4": (4, (1 << 32) - 1, ipv42int, pack_ipv4),
+    "ipv6": (16, (1 << 128) - 1, ipv62int, pack_ipv6),
+    "port": (2, 0xFFFF, int, pack_short),
+    "vlan": (2, 0xFFF, int, pack_vlan),
+}
+
+def _first_mac(kws, name, default):
+    value = kws.get(name, default)
+    if isinstance(value, list):
+        value = value[0]
+    return value.replace(".", ":")
+
+def _kws_int(kws, name, default):
+    return Utils.intval(kws, name, default)
+
+# name, layer, offset in layer, kind, modes, step default, reset value
+# same defaults and reset values as ScapyPacket.build_next_dma
+field_specs = [
+    ("mac_src", Ether, 6, "mac", step_modes + ["list"], "00:00:00:00:00:01",
+        lambda kws: _first_mac(kws, "mac_src", "00:00:01:00:00:01")),
+    ("mac_dst", Ether, 0, "mac", step_modes + ["list"], "00:00:00:00:00:01",
+        lambda kws: _first_mac(kws, "mac_dst", "00:00:00:00:00:00")),
+    ("arp_src_hw", ARP, 8, "mac", step_modes, "00:00:00:00:00:01",
+        lambda kws: _first_mac(kws, "arp_src_hw_addr", "00:00:01:00:00:02")),
+    ("arp_dst_hw", ARP, 18, "mac", step_modes, "00:00:00:00:00:01",
+        lambda kws: _first_mac(kws, "arp_dst_hw_addr", "00:00:00:00:00:00")),
+    ("ip_src", IP, 12, "ipv4", step_modes, "0.0.0.1",
+        lambda kws: kws.get("ip_src_addr", "0.0.0.0")),
+    ("ip_dst", IP, 16, "ipv4", step_modes, "0.0.0.1",
+        lambda kws: kws.get("ip_dst_addr", "192.0.0.1")),
+    ("ipv6_src", IPv6, 8, "ipv6", step_modes, "::1",
+        lambda kws: kws.get("ipv6_src_addr", "fe80:0:0:0:0:0:0:12")),
+    ("ipv6_dst", IPv6, 24, "ipv6", step_modes, "::1",
+        lambda kws: kws.get("ipv6_dst_addr", "fe80:0:0:0:0:0:0:22")),
+    ("vlan_id", Dot1Q, 0, "vlan", step_modes, 1,
+        lambda kws: _kws_int(kws, "vlan_id", 0)),
+    ("tcp_src_port", TCP, 0, "port", port_step_modes, 1,
+        lambda kws: _kws_int(kws, "tcp_src_port", 0)),
+    ("tcp_dst_port", TCP, 2, "port", port_step_modes, 1,
+        lambda kws: _kws_int(kws, "tcp_dst_port", 0)),
+    ("udp_src_port", UDP, 0, "port", port_step_modes, 1,
+        lambda kws: _kws_int(kws, "udp_src_port", 0)),
+    ("udp_dst_port", UDP, 2, "port", port_step_modes, 1,
+        lambda kws: _kws_int(kws, "udp_dst_port", 0)),
+]
+
+class CompileError(Exception):
+    pass
+
+class Checksum(object):
+    def __init__(self, frame, offset, udp=False):
+        self.offset = offset
+        self.udp = udp
+        self.value = struct.unpack_from("!H", frame, offset)[0]
+
+    def update(self, frame, old, new):
+        # HC' = ~(~HC + ~m + m')
+        total = ~self.value & 0xFFFF
+        count = len(old) // 2
+        for word in struct.unpack("!%dH" % count, old):
+            total += ~word & 0xFFFF
+        for word in struct.unpack("!%dH" % count, new):
+            total += word
+        while total >> 16:
+            total = (total & 0xFFFF) + (total >> 16)
+        value = ~total & 0xFFFF
+        if self.udp and value == 0:
+            value = 0xFFFF
+        self.value = value
+        struct.pack_into("!H", frame, self.offset, value)
+
+class Field(object):
+    def __init__(self, frame, name, offset, kind, mode, step, count, reset, values):
+        (self.width, self.mask, to_int, self.pack) = field_kinds[kind]
+        self.name = name
+        self.offset = offset
+        self.mode = mode
+        self.step = to_int(step)
+        if mode in ["decrement", "decr"]:
+            self.step = -self.step
+        self.count = count
+        self.reset = to_int(reset)
+        self.values = [to_int(v) for v in values]
+        self.index = 0
+        self.checksums = []
+        # bytes of the field without the signature which may overlap it
+        self.raw = bytearray(frame[offset:offset+self.width])
+        self.value = self.values[0] if self.values else self.current(kind)
+
+    def current(self, kind):
+        if kind == "vlan":
+            return struct.unpack_from("!H", self.raw, 0)[0] & 0xFFF
+        return int(binascii.hexlify(bytes(self.raw)), 16)
+
+    def next_value(self):
+        self.index = self.index + 1
+        if self.values:
+            if self.index >= len(self.values):
+                self.index = 0
+            return self.values[self.index]
+        if self.count > 0 and self.index >= self.count:
+            self.index = 0
+            return self.reset
+        return (self.value + self.step) & self.mask
+
+    def patch(self, frame):
+        self.value = self.next_value()
+        old = bytes(self.raw)
+        self.pack(self.raw, 0, self.value)
+        frame[self.offset:self.offset+self.width] = self.raw
+        if self.checksums:
+            new = bytes(self.raw)
+            for checksum in self.checksums:
+                checksum.update(frame, old, new)
+
+class CompiledStream(object):
+    """
+    byte template of a stream built by ScapyPacket.build_first
+    raises CompileError when the stream needs the scapy path
+    """
+    def __init__(self, pwa):
+        if pwa.length_mode != "fixed" or pwa.padding:
+            raise CompileError("length_mode {}".format(pwa.length_mode))
+
+        data = bytes(pwa.pkt)
+        self.size = len(data)
+        self.frame = bytearray(data + b"\0" * 4)
+        self.view = body_view(self.frame, self.size)
+        layers = self._layers(pwa.pkt, self.size)
+        self.fields = self._fields(pwa.stream.kws, layers)
+        checksums = self._checksums(layers)
+
+        # insert stream id before CRC, again after each patch if it
+        # overlaps a varying field or checksum like the scapy path does
+        (self.sid, self.sid_start, overlap) = (None, self.size, False)
+        if pwa.add_signature:
+            sid = pwa.stream.get_sid()
+            if not sid: sid = "DeadBeef"
+            self.sid_start = self.size - len(sid)
+            self.frame[self.sid_start:self.size] = bytearray(sid.encode("ascii"))
+            ranges = [(f.offset, f.offset + f.width) for f in self.fields]
+            ranges.extend([(c.offset, c.offset + 2) for c in checksums])
+            overlap = any(end > self.sid_start for _, end in ranges)
+            self.sid = self.frame[self.sid_start:self.size] if overlap else None
+
+        self.cached = None if self.fields else self._finish()
+        # the frame differs from the packet of the stream work area
+        self.changed = False
+
+    @staticmethod
+    def _layers(pkt, size):
+        # offset of the first instance of each layer class
+        (layers, layer, offset) = ({}, pkt, 0)
+        while not isinstance(layer, NoPayload):
+            if not isinstance(layer, known_layers):
+                raise CompileError("layer {}".format(layer.name))
+            layers.setdefault(type(layer), (offset, layer))
+            offset = size - len(layer.payload)
+            layer = layer.payload
+        return layers
+
+    def _fields(self, kws, layers):
+        fields = []
+        for name, layer_type, offset, kind, modes, step, reset in field_specs:
+            mode = kws.get("{}_mode".format(name), "fixed").strip()
+            if layer_type not in layers or mode == "fixed":
+                continue
+            if mode not in modes:
+                raise CompileError("{}_mode {}".format(name, mode))
+            values = kws.get(name, []) if mode == "list" else []
+            fields.append(Field(self.frame, name, layers[layer_type][0] + offset, kind, mode,
+                                kws.get("{}_step".format(name), step),
+                                _kws_int(kws, "{}_count".format(name), 0),
+                                reset(kws), values))
+        return fields
+
+    def _add_checksum(self, checksums, offset, names, udp=False):
+        checksum = Checksum(self.frame, offset, udp)
+        for field in self.fields:
+            if field.name in names:
+                field.checksums.append(checksum)
+        checksums.append(checksum)
+
+    def _checksums(self, layers):
+        (checksums, pseudo) = ([], [])
+        if IP in layers:
+            self._add_checksum(checksums, layers[IP][0] + 10, ["ip_src", "ip_dst"])
+            pseudo = ["ip_src", "ip_dst"]
+        elif IPv6 in layers:
+            pseudo = ["ipv6_src", "ipv6_dst"]
+        if TCP in layers:
+            self._add_checksum(checksums, layers[TCP][0] + 16, pseudo + ["tcp_src_port", "tcp_dst_port"])
+        if UDP in layers:
+            self._add_checksum(checksums, layers[UDP][0] + 6, pseudo + ["udp_src_port", "udp_dst_port"], True)
+        if ICMPv6ND_NA in layers and IPv6 in layers:
+            self._add_checksum(checksums, layers[ICMPv6ND_NA][0] + 2, pseudo)
+        names = set(field.name for field in self.fields)
+        for layer_type in [TCP, UDP, ICMPv6ND_NA]:
+            if layer_type in layers and names.intersection(pseudo):
+                layer = layers[layer_type][1]
+                if not isinstance(layer.underlayer, (IP, IPv6)) or \
+                   layer.underlayer is not layers[type(layer.underlayer)][1]:
+                    raise CompileError("{} not carried by the first IP header".format(layer.name))
+        return checksums
+
+    def _finish(self):
+        crc = zlib.crc32(self.view) & 0xFFFFFFFF
+        struct.pack_into("!I", self.frame, self.size, socket.htonl(crc))
+        return bytes(self.frame)
+
+    def build_next(self):
+        self.changed = bool(self.fields)
+        for field in self.fields:
+            field.patch(self.frame)
+        if self.sid:
+            self.frame[self.sid_start:self.size] = self.sid
+
+    def get_frame(self):
+        if self.cached is not None:
+            return self.cached
+        return self._finish()
@@ -1,9 +1,11 @@
 import os
 import time
+import binascii
 import traceback
 import threading
 
 from packet import ScapyPacket
+from capture import CaptureBuffer
 from or_event import OrEvent
 from utils import Utils
 from logger import Logger
@@ -29,6 +31,7 @@ class ScapyDriver(object):
         self.utils = Utils(self.dry, logger=self.logger)
         self.iface = port.iface
         self.iface_status = None
+        self.tx_batch = self.utils.get_env_int("SPYTEST_SCAPY_TX_BATCH", 64)
         self.packet = ScapyPacket(port.iface, dry=self.dry, dbg=self.dbg,
                                   logger=self.logger)
         self.rxInit()
@@ -54,10 +57,14 @@ class ScapyDriver(object):
         self.statState.clear()
         self.txState.clear()
         self.protocolState.clear()
+        self.capture.close()
         self.packet.cleanup()
 
     def rxInit(self):
         self.captureQueueInit()
+        self.rx_index = dict()
+        self.rx_track_key = None
+        self.rx_track_lock = threading.Lock()
         self.captureState = threading.Event()
         self.captureState.clear()
         self.protocolState = threading.Event()
@@ -73,34 +80,48 @@ class ScapyDriver(object):
         self.linkThread = None
 
     def captureQueueInit(self):
-        self.pkts_captured = []
+        max_frames = self.utils.get_env_int("SPYTEST_SCAPY_CAPTURE_FRAMES", 10000)
+        max_spill = self.utils.get_env_int("SPYTEST_SCAPY_CAPTURE_SPILL_MB", 1024)
+        spill_dir = os.getenv("SPYTEST_SCAPY_CAPTURE_PATH", None)
+        self.capture = CaptureBuffer(self.iface, max_frames, max_spill * 1024 * 1024, spill_dir)
+
+    def configCapture(self, slice_size=None, patterns=None):
+        self.logger.debug("config-cap: {} slice: {} filter: {}".format(self.iface, slice_size, patterns))
+        if slice_size is not None:
+            self.capture.set_slice_size(slice_size)
+        if patterns is not None:
+            self.capture.set_filter(patterns)
 
     def startCapture(self):
         self.logger.debug("start-cap: {}".format(self.iface))
-        self.pkts_captured = []
+        self.capture.clear()
         self.captureState.set()
+        self.rx_track_update()
 
     def stopCapture(self):
         self.logger.debug("stop-cap: {}".format(self.iface))
         self.captureState.clear()
         time.sleep(1)
-        return len(self.pkts_captured)
+        if self.capture.dropped:
+            self.logger.error("capture {} dropped {} frames".format(self.iface, self.capture.dropped))
+        return self.capture.count()
 
     def clearCapture(self):
         self.logger.debug("clear-cap: {}".format(self.iface))
         self.captureState.clear()
         time.sleep(3)
-        self.pkts_captured = []
-        return len(self.pkts_captured)
+        self.capture.clear()
+        return self.capture.count()
 
-    def getCapture(self):
-        self.logger.debug("get-cap: {}".format(self.iface))
+    def getCaptureCount(self):
+        return self.capture.count()
+
+    def getCapture(self, start=0, count=None):
+        self.logger.debug("get-cap: {} start: {} count: {}".format(self.iface, start, count))
         retval = []
-        for pkt in self.pkts_captured:
-            (data, hex_bytes) = (str(pkt), [])
-            for index in range(len(data)):
-                hex_bytes.append("%02X"% ord(data[index]))
-            retval.append(hex_bytes)
+        for _, _, data in self.capture.read(start, count):
+            hex_str = str(binascii.hexlify(data).decode("ascii")).upper()
+            retval.append([hex_str[i:i+2] for i in range(0, len(hex_str), 2)])
         return retval
 
     def rx_any_enable(self):
@@ -118,9 +139,10 @@ class ScapyDriver(object):
             # read packets
             while self.rx_any_enable():
                 try:
-                    packet = self.packet.readp(iface=self.iface)
-                    if packet:
-                        self.handle_recv(None, packet)
+                    self.rx_track_update()
+                    frames = self.packet.read_frames(iface=self.iface)
+                    if frames:
+                        self.handle_frames(frames)
                 except Exception as e:
                     if str(e) != "[Errno 100] Network is down":
                         self.logger.debug(e, traceback.format_exc())
@@ -142,28 +164,52 @@ class ScapyDriver(object):
                 self.packet.set_link(status)
             self.iface_status = status
 
-    def handle_stats(self, packet):
-        pktlen = 0 if not packet else len(packet)
-        framesReceived = self.port.incrStat('framesReceived')
-        self.port.incrStat('bytesReceived', pktlen)
+    def rx_track_update(self):
+        # the signature index and the kernel filter follow
+        # the tracked streams and the capture state
+        with self.rx_track_lock:
+            capture = self.captureState.is_set()
+            key = (tuple([(s.get_sid(), s.serial) for s in self.port.track_streams]), capture)
+            if key == self.rx_track_key: return
+            streams = list(self.port.track_streams)
+            index = dict()
+            for stream in streams:
+                index[stream.get_sid().encode("ascii")] = stream.rx_counters
+            self.rx_index = index
+            self.packet.set_rx_filter([stream.get_sid() for stream in streams], capture)
+            self.rx_track_key = key
+
+    def handle_stats(self, frames):
+        # stream counters are only written by this thread
+        (octets, oversize, index) = (0, 0, self.rx_index)
+        for _, pktlen, signature in frames:
+            octets = octets + pktlen
+            if pktlen > 1518:
+                oversize = oversize + 1
+            counters = index.get(signature)
+            if counters:
+                counters[0] = counters[0] + 1
+                counters[1] = counters[1] + pktlen
+
+        # increment port counters once per block
+        framesReceived = self.port.incrStat('framesReceived', len(frames))
+        self.port.incrStat('bytesReceived', octets)
+        if oversize:
+            self.port.incrStat('oversizeFramesReceived', oversize)
         if self.dbg > 2:
             self.logger.debug("{} framesReceived: {}".format(self.iface, framesReceived))
-        if pktlen > 1518:
-            self.port.incrStat('oversizeFramesReceived')
-        for stream in self.port.track_streams:
-            if self.packet.match_stream(stream, packet):
-                stream.incrStat('framesReceived')
-                stream.incrStat('bytesReceived', pktlen)
-                break # no need to check in other streams
-
-    def handle_capture(self, packet):
-        self.pkts_captured.append(packet)
-
-    def handle_recv(self, hdr, packet):
+
+    def handle_capture(self, data, timestamp):
+        if self.capture.add(data, timestamp):
+            self.port.incrStat('captureFilter')
+
+    def handle_frames(self, frames):
         if self.statState.is_set():
-            self.handle_stats(packet)
+            self.handle_stats(frames)
+        # frames are captured as bytes, no scapy packet is built
         if self.captureState.is_set():
-            self.handle_capture(packet)
+            for index, _, _ in frames:
+                self.handle_capture(*self.packet.get_frame(index))
 
     def txInit(self):
         self.txState = threading.Event()
@@ -301,7 +347,7 @@ class ScapyDriver(object):
                     self.logger.debug(" start {} {}/{}".format(stream.stream_id, stream.enable, stream.enable2))
                 if stream.enable and stream.enable2:
                     pwa = self.packet.build_first(stream)
-                    pwa.tx_time = time.clock()
+                    pwa.tx_time = time.time() if self.tx_batch > 1 else time.clock()
                     pwa_list.append(pwa)
                     sids[stream.stream_id] = 0
                     self.stop_ack_wait(stream.stream_id)
@@ -311,6 +357,8 @@ class ScapyDriver(object):
         return bool(pwa_list)
 
     def txThreadMainInner(self):
+        if self.tx_batch > 1:
+            return self.txThreadMainInnerBatch()
 
         sids = {}
         pwa_list = []
@@ -369,6 +417,90 @@ class ScapyDriver(object):
             pwa_list = pwa_next_list
         self.logger.debug("txThreadMainInner {} Completed {}".format(self.iface, tx_count))
 
+    def txThreadMainInnerBatch(self):
+
+        sids = {}
+        pwa_list = []
+        self.logger.debug("txThreadMainInnerBatch {} start {}".format(self.iface, self.port.streams.keys()))
+        if not self.txThreadMainInnerStart(pwa_list, sids):
+            self.logger.debug("txThreadMainInnerBatch {} Nothing Todo".format(self.iface))
+            return
+
+        (tx_count, start_time) = (0, time.time())
+        while (self.txState.is_set()):
+            # call start again to see if new streams are created
+            # while there are transmitting streams
+            if not self.txThreadMainInnerStart(pwa_list, sids):
+                break
+
+            pwa_list = [pwa for pwa in pwa_list if pwa.stream.enable and pwa.stream.enable2]
+            if not pwa_list:
+                continue
+
+            # sleep till the first stream is due, rate is controlled per batch
+            pwa_list.sort(key=self.pwa_sort)
+            delay = pwa_list[0].tx_time - time.time()
+            if delay > 0:
+                time.sleep(min(delay, 1.0))
+                continue
+
+            # collect the frames of all the streams which are due
+            (now, batch, pwa_next_list) = (time.time(), [], [])
+            for pwa in pwa_list:
+                while pwa and pwa.tx_time <= now and len(batch) < self.tx_batch:
+                    try:
+                        batch.append((pwa.stream, self.packet.build_frame(pwa)))
+                    except Exception as e:
+                        self.logger.log_exception(e, traceback.format_exc())
+                        pwa.stream.enable2 = False
+                        pwa = None
+                        break
+                    pwa = self.packet.build_next(pwa)
+                    if pwa:
+                        # do not catch up more than a second of lag
+                        ipg = self.packet.build_ipg(pwa)
+                        pwa.tx_time = max(pwa.tx_time + ipg, now - 1.0)
+                if pwa:
+                    pwa_next_list.append(pwa)
+            pwa_list = pwa_next_list
+            if batch:
+                tx_count = tx_count + self.send_batch(batch)
+                elapsed = time.time() - start_time
+                if elapsed > 0:
+                    self.port.stats["framesSentRate"] = int(tx_count / elapsed)
+        self.logger.debug("txThreadMainInnerBatch {} Completed {} rate {} pps".format(self.iface,
+                          tx_count, self.port.stats.get("framesSentRate", 0)))
+
+    def send_batch(self, batch):
+        dropped = set(self.packet.send_batch([frame for _, frame in batch], self.iface))
+        counts = dict()
+        for index, (stream, frame) in enumerate(batch):
+            if stream.stream_id not in counts:
+                counts[stream.stream_id] = [stream, 0, 0, 0]
+            if dropped and index in dropped:
+                counts[stream.stream_id][3] += 1
+                continue
+            counts[stream.stream_id][1] += 1
+            counts[stream.stream_id][2] += len(frame)
+
+        # increment port and stream counters once per batch
+        sent = 0
+        for stream, frames, octets, drops in counts.values():
+            stream.incrStat('framesSent', frames)
+            stream.incrStat('bytesSent', octets)
+            self.port.incrStat('framesSent', frames)
+            self.port.incrStat('bytesSent', octets)
+            if drops:
+                stream.incrStat('framesDropped', drops)
+                self.port.incrStat('framesDropped', drops)
+            stream_tx = self.stream_pkts.get(stream.stream_id, 0) + frames
+            self.stream_pkts[stream.stream_id] = stream_tx
+            if self.dbg > 1:
+                self.logger.debug("{}/{} framesSent: {} dropped: {}".format(self.iface,
+                                  stream.stream_id, stream_tx, drops))
+            sent = sent + frames
+        return sent
+
     def pwa_sort(self, pwa):
         return pwa.tx_time
 
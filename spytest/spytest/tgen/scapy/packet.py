@@ -8,6 +8,7 @@ import random
 import textwrap
 import binascii
 import socket
+import struct
 import afpacket
 import traceback
 import ipaddress
@@ -22,6 +23,7 @@ from scapy.config import Conf
 from dicts import SpyTestDict
 from utils import Utils
 from logger import Logger
+from compiled import CompiledStream, CompileError
 
 try: print("SCAPY VERSION = {}".format(Conf().version))
 except Exception: print("SCAPY VERSION = UNKNOWN")
@@ -120,6 +122,19 @@ stale_list_ignore = [
     "ipv6_dst_count",
 ]
 
+class PacketWork(SpyTestDict):
+    """
+    work area of a stream built by ScapyPacket.build_first
+    pkt of a compiled stream is decoded from its current frame when read
+    """
+    @property
+    def pkt(self):
+        compiled = self.get("compiled")
+        if compiled and compiled.changed:
+            compiled.changed = False
+            self["pkt"] = Ether(compiled.get_frame()[:compiled.size])
+        return self["pkt"]
+
 class ScapyPacket(object):
 
     def __init__(self, iface, dbg=0, dry=False, hex=False, logger=None):
@@ -130,6 +145,9 @@ class ScapyPacket(object):
         except Exception: self.logger.info("SCAPY VERSION = UNKNOWN")
         self.utils = Utils(self.dry, logger=self.logger)
         self.max_rate_pps = self.utils.get_env_int("SPYTEST_SCAPY_MAX_RATE_PPS", 100)
+        self.compiled_streams = self.utils.get_env_int("SPYTEST_SCAPY_COMPILED_STREAMS", 1)
+        self.tx_backend = os.getenv("SPYTEST_SCAPY_TX_BACKEND", "ring")
+        self.rx_ring_enable = self.utils.get_env_int("SPYTEST_SCAPY_RX_RING", 1)
         self.dbg = dbg
         self.show_summary = bool(self.dbg > 2)
         self.hex = hex
@@ -138,7 +156,11 @@ class ScapyPacket(object):
         self.tx_count = 0
         self.rx_count = 0
         self.rx_sock = None
+        self.rx_ring = None
+        self.rx_data = None
+        self.rx_filter = None
         self.tx_sock = None
+        self.tx_batch_sock = None
         self.finished = False
         self.exabgp_nslist = []
         self.cleanup()
@@ -225,8 +247,10 @@ class ScapyPacket(object):
         self.logger.info("ScapyPacket {} cleanup...".format(self.iface))
         self.exabgpd_stop_all()
         self.finished = True
+        self.rx_ring = self.close_sock(self.rx_ring)
         self.rx_sock = self.close_sock(self.rx_sock)
         self.tx_sock = self.close_sock(self.tx_sock)
+        self.tx_batch_sock = self.close_sock(self.tx_batch_sock)
         self.init_bridge(self.iface)
         self.finished = False
 
@@ -237,39 +261,83 @@ class ScapyPacket(object):
         self.rx_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 12 * 1024)
         self.rx_sock.bind((self.iface+"-rx", 3))
         afpacket.enable_auxdata(self.rx_sock)
+        self.rx_filter = None
+        if self.rx_ring_enable:
+            try:
+                self.rx_ring = afpacket.RxRing(self.rx_sock, self.mtu + 22)
+            except Exception as exp:
+                self.logger.debug("Failed to create RxRing {} {}".format(self.iface, exp))
+                self.rx_ring = None
 
     def set_link(self, status):
         msg = "link:{} status:{}".format
         self.logger.debug(msg(iface, status))
 
-    def readp(self, iface):
+    def set_rx_filter(self, sids, capture):
+        """
+        let the kernel truncate the frames not carrying the signature of
+        one of the tracked streams, all the frames are kept when capturing
+        """
+        if self.dry or not self.rx_ring: return
+        prefixes = None
+        if not capture:
+            prefixes = [struct.unpack("!I", sid[:4].encode("ascii"))[0] for sid in sids]
+            prefixes = tuple(sorted(set(prefixes)))
+        if prefixes == self.rx_filter: return
+        insns = None if prefixes is None else afpacket.signature_filter(prefixes, 12, 64)
+        if insns:
+            afpacket.attach_filter(self.rx_sock, insns)
+        else:
+            afpacket.detach_filter(self.rx_sock)
+        self.rx_filter = prefixes
+        self.logger.debug("rx filter {} {}".format(self.iface, prefixes))
+
+    def read_frames(self, iface):
+        """
+        read the next block of received frames
+        returns list of (index, length, signature) where signature is the
+        stream id bytes of the frame, index is to be passed to get_packet
+        """
 
         if self.dry:
             time.sleep(2)
-            return None
+            return []
 
         if not self.iface:
-            return None
+            return []
 
         try:
-            data = afpacket.recv(self.rx_sock, 12 * 1024)
+            if self.rx_ring:
+                frames = self.rx_ring.recv_block(0.1)
+            else:
+                data = afpacket.recv(self.rx_sock, 12 * 1024)
+                self.rx_data = (data, time.time())
+                frames = [(0, len(data), data[-12:-4])]
         except Exception as exp:
             if self.finished:
-                return None
+                return []
             raise exp
-        packet = Ether(data)
-        self.rx_count = self.rx_count + 1
+        self.rx_count = self.rx_count + len(frames)
         self.trace_stats()
 
-        if self.dbg > 1:
-            cmd = "" if not self.show_summary else packet.command()
-            msg = "readp:{} len:{} count:{} {}".format
-            self.logger.debug(msg(iface, len(data), self.rx_count, cmd))
+        if self.dbg > 1 and frames:
+            msg = "read_frames:{} count:{} total:{}".format
+            self.logger.debug(msg(iface, len(frames), self.rx_count))
 
         if self.dbg > 2:
-            self.trace_packet(packet, self.hex)
+            for index, _, _ in frames:
+                self.trace_packet(self.get_packet(index), self.hex)
+
+        return frames
+
+    def get_frame(self, index):
+        # (bytes, timestamp) of a frame returned by read_frames
+        if self.rx_ring:
+            return self.rx_ring.frame(index)
+        return self.rx_data
 
-        return packet
+    def get_packet(self, index):
+        return Ether(self.get_frame(index)[0])
 
     def sendp(self, pkt, data, iface, stream_name, left):
         self.tx_count = self.tx_count + 1
@@ -316,7 +384,60 @@ class ScapyPacket(object):
         if fields: self.show_pkt(pkt)
         if hex: hexdump(pkt)
 
+    def send_batch(self, frames, iface):
+        self.tx_count = self.tx_count + len(frames)
+        if self.dbg > 2:
+            msg = "send_batch:{} count:{} total:{}".format
+            self.logger.debug(msg(iface, len(frames), self.tx_count))
+
+        if self.dry:
+            return []
+
+        if not self.tx_batch_sock:
+            try:
+                self.tx_batch_sock = afpacket.TxSocket(iface, self.tx_backend, self.mtu + 22)
+                self.logger.debug("TX backend {} {}".format(iface, self.tx_batch_sock.backend))
+            except Exception as exp:
+                self.logger.debug("Failed to create TxSocket {} {}".format(iface, exp))
+                return self.send_frames(frames, iface)
+
+        return self.tx_batch_sock.send(frames)
+
+    def send_frames(self, frames, iface):
+        # send one frame at a time as sendp does, returns the indexes of the frames not sent
+        if not self.tx_sock:
+            try:
+                self.tx_sock = L2Socket(iface)
+            except Exception as exp:
+                self.logger.debug("Failed to create L2Socket {} {}".format(iface, exp))
+
+        failed = []
+        for index, data in enumerate(frames):
+            if self.tx_sock:
+                try:
+                    self.tx_sock.send(data)
+                    continue
+                except Exception: pass
+            try:
+                sendp(data, iface=iface, verbose=False)
+            except Exception as exp:
+                self.logger.debug("Failed to send legacy {} {}".format(iface, exp))
+                failed.append(index)
+
+        if failed and self.is_vde: self.os_system("ip link set dev {0} up".format(iface))
+        return failed
+
     def send_packet(self, pwa, iface, stream_name, left):
+        bstr = self.build_frame(pwa)
+        # the packet of a compiled stream is decoded only for the traces
+        pkt = pwa.pkt if not pwa.compiled or self.dbg > 1 else None
+        self.sendp(pkt, bstr, iface, stream_name, left)
+        return bstr
+
+    def build_frame(self, pwa):
+        if pwa.compiled:
+            return pwa.compiled.get_frame()
+
         if pwa.padding:
             strpkt = str(pwa.pkt/pwa.padding)
         else:
@@ -334,9 +455,7 @@ class ScapyPacket(object):
             crc = binascii.unhexlify(crc1)
         except Exception:
             crc = binascii.unhexlify('00' * 4)
-        bstr = bytes(strpkt+crc)
-        self.sendp(pwa.pkt, bstr, iface, stream_name, left)
-        return bstr
+        return bytes(strpkt+crc)
 
     def check(self, pkt):
         pkt.do_build()
@@ -730,7 +849,7 @@ class ScapyPacket(object):
             if key not in stale_list_ignore:
                 self.error("unhandled option {} = {}".format(key, value))
 
-        pwa = SpyTestDict()
+        pwa = PacketWork()
         pwa.add_signature = add_signature
         pwa.pkt = pkt
         pwa.left = left
@@ -767,9 +886,24 @@ class ScapyPacket(object):
         pwa.frame_size_max = frame_size_max
         pwa.frame_size_step = frame_size_step
         self.add_padding(pwa, True)
+        pwa.compiled = self.compile_stream(pwa)
 
         return pwa
 
+    def compile_stream(self, pwa):
+        if not self.compiled_streams:
+            return None
+        try:
+            compiled = CompiledStream(pwa)
+            self.logger.debug("compiled stream {} fields {}".format(pwa.stream.stream_id,
+                              [field.name for field in compiled.fields]))
+            return compiled
+        except CompileError as exp:
+            self.logger.debug("stream {} using scapy: {}".format(pwa.stream.stream_id, exp))
+        except Exception as exp:
+            self.logger.log_exception(exp, traceback.format_exc())
+        return None
+
     def add_padding(self, pwa, first):
         pwa.padding = None
         if pwa.length_mode == "random":
@@ -796,6 +930,10 @@ class ScapyPacket(object):
 
     def build_next_dma(self, pwa):
 
+        if pwa.compiled:
+            pwa.compiled.build_next()
+            return pwa
+
         # Change Ether SRC MAC
         mac_src_mode  = pwa.stream.kws.get("mac_src_mode", "fixed").strip()
         mac_src_step  = pwa.stream.kws.get("mac_src_step", "00:00:00:00:00:01")
@@ -985,9 +1123,9 @@ class ScapyPacket(object):
             tcp_dst_port_count  = self.utils.intval(pwa.stream.kws, "tcp_dst_port_count", 0)
             if tcp_dst_port_mode in ["increment", "decrement", "incr", "decr"]:
                 if tcp_dst_port_mode in ["increment", "incr"]:
-                    pwa.pkt[TCP].dport = pwa.pkt[TCP].sport + tcp_dst_port_step
+                    pwa.pkt[TCP].dport = pwa.pkt[TCP].dport + tcp_dst_port_step
                 else:
-                    pwa.pkt[TCP].dport = pwa.pkt[TCP].sport - tcp_dst_port_step
+                    pwa.pkt[TCP].dport = pwa.pkt[TCP].dport - tcp_dst_port_step
                 pwa.tcp_dst_port_count = pwa.tcp_dst_port_count + 1
                 if tcp_dst_port_count > 0 and pwa.tcp_dst_port_count >= tcp_dst_port_count:
                     pwa.pkt[TCP].dport = self.utils.intval(pwa.stream.kws, "tcp_dst_port", 0)
@@ -1019,9 +1157,9 @@ class ScapyPacket(object):
             udp_dst_port_count  = self.utils.intval(pwa.stream.kws, "udp_dst_port_count", 0)
             if udp_dst_port_mode in ["increment", "decrement", "incr", "decr"]:
                 if udp_dst_port_mode in ["increment", "incr"]:
-                    pwa.pkt[UDP].dport = pwa.pkt[UDP].sport + udp_dst_port_step
+                    pwa.pkt[UDP].dport = pwa.pkt[UDP].dport + udp_dst_port_step
                 else:
-                    pwa.pkt[UDP].dport = pwa.pkt[UDP].sport - udp_dst_port_step
+                    pwa.pkt[UDP].dport = pwa.pkt[UDP].dport - udp_dst_port_step
                 pwa.udp_dst_port_count = pwa.udp_dst_port_count + 1
                 if udp_dst_port_count > 0 and pwa.udp_dst_port_count >= udp_dst_port_count:
                     pwa.pkt[UDP].dport = self.utils.intval(pwa.stream.kws, "udp_dst_port", 0)
@@ -1072,16 +1210,6 @@ class ScapyPacket(object):
         pps = self.utils.min_value(pwa.rate_pps, self.max_rate_pps)
         return (1.0 * pwa.pkts_per_burst)/float(pps)
 
-    def match_stream(self, stream, pkt):
-        sid = stream.get_sid()
-        if not sid: return False
-        strpkt = str(pkt)
-        if sid == strpkt[-12:-4]:
-            self.logger.debug("{}: CMP0: {} {}".format(self.iface, sid, strpkt[-12:-4]))
-            return True
-        #self.logger.debug("{}: CMP1: {} {}".format(self.iface, sid, strpkt[-12:-4]))
-        return False
-
     def if_delete_cmds(self, index, intf):
         ns = "{}_{}".format(intf.name, index)
 
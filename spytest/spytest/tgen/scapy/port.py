@@ -1,4 +1,5 @@
 import copy
+import itertools
 import threading
 
 from dicts import SpyTestDict
@@ -10,6 +11,8 @@ def initStatistics(stats):
     stats.clear()
     stats["framesSent"] = 0
     stats["bytesSent"] = 0
+    stats["framesDropped"] = 0
+    stats["framesSentRate"] = 0
     stats["framesReceived"] = 0
     stats["bytesReceived"] = 0
     stats["oversizeFramesReceived"] = 0
@@ -24,9 +27,13 @@ def incrStat(stats, name, val = 1):
     return val
 
 class ScapyStream(object):
+    # serial numbers are never reused, unlike id() or a re-created stream_id
+    serials = itertools.count(1)
+
     def __init__(self, port, index, stream_id, track_port, *args, **kws):
         self.port = port
         self.index = index
+        self.serial = next(ScapyStream.serials)
         self.track_port = track_port
         self.stream_id = stream_id
         self.args = args
@@ -35,6 +42,10 @@ class ScapyStream(object):
         self.enable2 = False
         self.stats = SpyTestDict()
         initStatistics(self.stats)
+        # frames and bytes received, written only by the RX thread of the
+        # track port and aggregated in getStats, clearing moves the base
+        self.rx_counters = [0, 0]
+        self.rx_base = [0, 0]
         #print("ScapyStream: {} {} {}".format(self.port, self.stream_id, kws))
         if self.track_port:
             self.track_port.track_streams.append(self)
@@ -60,6 +71,16 @@ class ScapyStream(object):
         #print("incrStat: {} {} {} = {}".format(self.port, self.stream_id, name, val))
         return val
 
+    def clearStats(self):
+        initStatistics(self.stats)
+        self.rx_base = list(self.rx_counters)
+
+    def getStats(self):
+        (frames, octets) = self.rx_counters
+        self.stats["framesReceived"] = frames - self.rx_base[0]
+        self.stats["bytesReceived"] = octets - self.rx_base[1]
+        return self.stats
+
     def __str__(self):
         return ''.join([('%s=%s' % x) for x in self.kws.items()])
 
@@ -171,7 +192,7 @@ class ScapyPort(object):
     def getStreamStats(self):
         res = []
         for _, stream in self.streams.items():
-            res.append([stream, stream.stats])
+            res.append([stream, stream.getStats()])
         return res
 
     def traffic_control_complete(self, *args, **kws):
@@ -193,7 +214,7 @@ class ScapyPort(object):
         elif action == "clear_stats":
             initStatistics(self.stats)
             for stream in self.streams.values():
-                initStatistics(stream.stats)
+                stream.clearStats()
             self.driver.clear_stats()
         else:
             self.error("unsupported", "traffic_control: action", action)
@@ -211,8 +232,34 @@ class ScapyPort(object):
             self.error("unsupported", "packet_control: action", action)
         return True
 
+    def packet_config_buffers(self, *args, **kws):
+        slice_size = kws.get('slice_size', None)
+        self.driver.configCapture(slice_size=slice_size)
+        return True
+
+    def packet_config_filter(self, *args, **kws):
+        mode = kws.get('mode', "create")
+        patterns = []
+        if mode in ["create", "modify"]:
+            for index in [1, 2]:
+                pattern = kws.get('pattern{}'.format(index), None)
+                if pattern:
+                    offset = kws.get('pattern_offset{}'.format(index), 0)
+                    patterns.append([offset, pattern])
+        elif mode not in ["remove", "reset"]:
+            self.error("unsupported", "packet_config_filter: mode", mode)
+        self.driver.configCapture(patterns=patterns)
+        return True
+
+    def packet_stats_count(self):
+        return self.driver.getCaptureCount()
+
     def packet_stats(self, *args, **kws):
-        return self.driver.getCapture()
+        # frame_id_start and frame_id_end are 1 based, end included
+        start = Utils.intval(kws, 'frame_id_start', 1)
+        end = Utils.intval(kws, 'frame_id_end', 0)
+        count = None if end <= 0 else max(end - start + 1, 0)
+        return self.driver.getCapture(max(start - 1, 0), count)
 
     def stream_validate(self, handles):
         for handle in Utils.make_list(handles):
@@ -254,6 +254,18 @@ class ScapyServer(object):
         res = port.packet_control(*args, **kws)
         return self.trace_result(res)
 
+    def exposed_tg_packet_config_buffers(self, node_name, *args, **kws):
+        if not self.validate_node_name(node_name, *args, **kws): return ""
+        port = self.ensure_port_handle(kws.get('port_handle', None))
+        res = port.packet_config_buffers(*args, **kws)
+        return self.trace_result(res)
+
+    def exposed_tg_packet_config_filter(self, node_name, *args, **kws):
+        if not self.validate_node_name(node_name, *args, **kws): return ""
+        port = self.ensure_port_handle(kws.get('port_handle', None))
+        res = port.packet_config_filter(*args, **kws)
+        return self.trace_result(res)
+
     def exposed_tg_packet_stats(self, node_name, *args, **kws):
         if not self.validate_node_name(node_name, *args, **kws): return ""
         res = SpyTestDict()
@@ -263,12 +275,13 @@ class ScapyServer(object):
         if port_handle and port_handle in self.ports:
             port = self.ports[port_handle]
             pkts = port.packet_stats(*args, **kws)
+            first = max(Utils.intval(kws, 'frame_id_start', 1) - 1, 0)
             res[port_handle] = SpyTestDict()
             res[port_handle][mode] = SpyTestDict()
-            res[port_handle][mode]["num_frames"] = len(pkts)
+            res[port_handle][mode]["num_frames"] = port.packet_stats_count()
             res[port_handle]["frame"] = SpyTestDict()
             for i, pkt in enumerate(pkts):
-                index = str(i)
+                index = str(first + i)
                 res[port_handle]["frame"][index] = SpyTestDict()
                 res[port_handle]["frame"][index]["length"] = len(pkt)
                 res[port_handle]["frame"][index]["frame_pylist"] = pkt
@@ -558,7 +571,7 @@ class ScapyServer(object):
 
     def fill_stats(self, res, tx_stats, rx_stats, detailed=False):
         res["tx"] = SpyTestDict()
-        res["tx"]["total_pkt_rate"] = self.stat_value(1, detailed)
+        res["tx"]["total_pkt_rate"] = self.stat_value(tx_stats.get("framesSentRate") or 1, detailed)
         res["tx"]["raw_pkt_count"] = self.stat_value(tx_stats.framesSent, detailed)
         res["tx"]["pkt_byte_count"] = self.stat_value(tx_stats.bytesSent, detailed)
         res["tx"]["total_pkts"] = self.stat_value(tx_stats.framesSent, detailed)
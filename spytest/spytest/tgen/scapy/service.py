@@ -42,6 +42,12 @@ class ScapyService(object):
     def tg_packet_stats(self, *args, **kws):
         self.server.trace_api(*args, **kws)
         return self.server.exposed_tg_packet_stats(*args, **kws)
+    def tg_packet_config_buffers(self, *args, **kws):
+        self.server.trace_api(*args, **kws)
+        return self.server.exposed_tg_packet_config_buffers(*args, **kws)
+    def tg_packet_config_filter(self, *args, **kws):
+        self.server.trace_api(*args, **kws)
+        return self.server.exposed_tg_packet_config_filter(*args, **kws)
     def tg_traffic_config(self, *args, **kws):
         self.server.trace_api(*args, **kws)
         return self.server.exposed_tg_traffic_config(*args, **kws)
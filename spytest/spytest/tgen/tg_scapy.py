@@ -223,7 +223,38 @@ class ScapyClient(object):
     def tg_packet_stats(self, *args, **kwargs):
         self.log_api(*args, **kwargs)
         if self.filemode: return self.sim_execute(*args, **kwargs)
-        return self.execute(self.conn.tg_packet_stats, *args, **kwargs)
+        if "frame_id_start" in kwargs or "frame_id_end" in kwargs:
+            return self.execute(self.conn.tg_packet_stats, *args, **kwargs)
+
+        # read the captured frames in pages instead of a single response
+        try: page = int(os.getenv("SPYTEST_SCAPY_CAPTURE_PAGE", "1000"))
+        except Exception: page = 1000
+        port_handle = kwargs.get("port_handle", None)
+        mode = kwargs.get("mode", "aggregate")
+        (res, start) = (None, 1)
+        while True:
+            kwargs["frame_id_start"] = start
+            kwargs["frame_id_end"] = start + page - 1
+            ret = self._execute("tg_packet_stats", self.conn.tg_packet_stats, *args, **kwargs)
+            if port_handle not in ret:
+                return ret
+            if res is None:
+                res = ret
+            else:
+                res[port_handle]["frame"].update(ret[port_handle]["frame"])
+                res[port_handle][mode] = ret[port_handle][mode]
+            frames = len(ret[port_handle]["frame"])
+            start = start + frames
+            if frames < page or start > ret[port_handle][mode]["num_frames"]:
+                return res
+    def tg_packet_config_buffers(self, *args, **kwargs):
+        self.log_api(*args, **kwargs)
+        if self.filemode: return self.sim_execute(*args, **kwargs)
+        return self.execute(self.conn.tg_packet_config_buffers, *args, **kwargs)
+    def tg_packet_config_filter(self, *args, **kwargs):
+        self.log_api(*args, **kwargs)
+        if self.filemode: return self.sim_execute(*args, **kwargs)
+        return self.execute(self.conn.tg_packet_config_filter, *args, **kwargs)
     def tg_traffic_config(self, *args, **kwargs):
         self.log_api(*args, **kwargs)
         if self.filemode: return self.sim_execute(*args, **kwargs)
@@ -10,6 +10,8 @@ import string
 import struct
 import shutil
 import hashlib
+import gzip
+import io
 import textwrap
 import datetime
 import fnmatch
@@ -326,6 +328,29 @@ def b64encode(file_path):
         retval.append(encoded_data[i*76:(i+1)*76])
     return retval
 
+def b64encode_gzip(file_path, width=76, compress=True):
+    """
+    gzip compress and base64 encode the content of the given file
+    :param file_path: file to encode
+    :param width: length of each encoded line
+    :param compress: compress the content before encoding when True
+    :return: tuple of (encoded lines, md5 of the file content, file size)
+    """
+    with open(file_path, "rb") as fh:
+        data = fh.read()
+    digest = hashlib.md5(data).hexdigest()
+    if compress:
+        buf = io.BytesIO()
+        # fixed mtime so that the same content always gives the same payload
+        with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as gz:
+            gz.write(data)
+        payload = buf.getvalue()
+    else:
+        payload = data
+    encoded_data = str_decode(base64.b64encode(payload))
+    retval = [encoded_data[i:i+width] for i in range(0, len(encoded_data), width)]
+    return retval, digest, len(data)
+
 ######################## to be removed after refactoring ####################
 ######################## to be removed after refactoring ####################
 class ExecAllFunc(object):
@@ -1,14 +1,20 @@
 from __future__ import print_function, division, absolute_import
 
+import fcntl
 import inspect
+import json
 import logging
 import os
 import cPickle as pickle
+import re
 import shutil
 import sys
+import tempfile
+import time
 
-from collections import defaultdict
-from threading import Lock
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from threading import Lock, RLock
 from six import with_metaclass
 
 
@@ -19,6 +25,12 @@ CACHE_LOCATION = os.path.join(CURRENT_PATH, '../../../_cache')
 
 SIZE_LIMIT = 1000000000  # 1G bytes, max disk usage allowed by cache
 ENTRY_LIMIT = 1000000    # Max number of pickle files allowed in cache.
+EVICT_WATERMARK = 0.9    # When a limit is exceeded, least recently used entries are evicted down to 90% of it
+MEMORY_ENTRY_LIMIT = 4096  # Max number of facts held in memory
+
+INDEX_FILE = '.index.json'
+INDEX_LOCK_FILE = '.index.lock'
+INDEX_VERSION = 2
 
 
 class Singleton(type):
@@ -39,6 +51,13 @@ class FactsCache(with_metaclass(Singleton, object)):
 
     Used singleton design pattern. Only a single instance of this class can be initialized.
 
+    Facts are held in a bounded in memory LRU tier in front of the pickle files. Size and last access time of the
+    pickle files are tracked in an index file shared by all the pytest processes, so the usage limits are checked
+    without walking the cache folder and the least recently used files are evicted when a limit is exceeded.
+
+    Writes and reads are recorded in memory and merged into the index file by flush(), at the end of the session or
+    as soon as the usage estimated from the last loaded index exceeds a limit.
+
     Args:
         with_metaclass ([function]): Python 2&3 compatible function from the six library for adding metaclass.
     """
@@ -47,24 +66,203 @@ class FactsCache(with_metaclass(Singleton, object)):
 
     def __init__(self, cache_location=CACHE_LOCATION):
         self._cache_location = os.path.abspath(cache_location)
-        self._cache = defaultdict(dict)
-        self._write_lock = Lock()
-
-    def _check_usage(self):
-        """Check cache usage, raise exception if usage exceeds the limitations.
+        self._cache = OrderedDict()     # (zone, key) => (value, write timestamp), in LRU order
+        self._accessed = {}             # (zone, key) => access timestamp, not yet saved to the index
+        self._written = {}              # '<zone>/<key>' => [size, write timestamp], not yet saved to the index
+        self._usage = None              # [total size, entries] of the last loaded index plus the pending writes
+        self._write_lock = RLock()
+        self._default_ttl = None
+        self._zone_ttl = {}
+        self._stats = defaultdict(int)
+
+    # Index of the pickle files
+
+    @contextmanager
+    def _locked_index(self, save=True):
+        """Lock the index file across processes and yield its content, save it back when done.
+
+        The index is {'version': INDEX_VERSION, 'total_size': <sum of the sizes>, 'entries': {'<zone>/<key>': [size,
+        atime]}, 'zones': {<zone>: {}}}. The pending writes and access times are merged into the saved index.
         """
-        total_size = 0
-        total_entries = 0
+        if not os.path.exists(self._cache_location):
+            os.makedirs(self._cache_location)
+        with open(os.path.join(self._cache_location, INDEX_LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = self._load_index()
+                yield index
+                if save:
+                    self._save_index(index)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _merge_pending(self, index):
+        """Merge the writes and access times of this process into the index, evict entries if a limit is exceeded."""
+        entries = index['entries']
+        for name, entry in self._written.items():
+            old = entries.get(name)
+            if old:
+                index['total_size'] -= old[0]
+                entry[1] = max(entry[1], old[1])
+            entries[name] = entry
+            index['total_size'] += entry[0]
+        for (zone, key), atime in self._accessed.items():
+            entry = entries.get('{}/{}'.format(zone, key))
+            if entry:
+                entry[1] = max(entry[1], atime)
+        self._written = {}
+        self._accessed = {}
+        self._evict(index)
+        self._usage = [index['total_size'], len(entries)]
+
+    def _load_index(self):
+        index_file = os.path.join(self._cache_location, INDEX_FILE)
+        try:
+            with open(index_file) as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                return index
+        except (IOError, ValueError) as e:
+            if os.path.exists(index_file):
+                logger.warning('Load cache index "{}" failed with exception: {}'.format(index_file, repr(e)))
+        return self._build_index()
+
+    def _build_index(self):
+        """Build the index from the pickle files, only done when the index file is missing or invalid."""
+        logger.info('Build cache index of "{}"'.format(self._cache_location))
+        entries = {}
         for root, _, files in os.walk(self._cache_location):
             for f in files:
-                fp = os.path.join(root, f)
-                total_size += os.path.getsize(fp)
-                total_entries += 1
+                if not f.endswith('.pickle') or f.startswith('.'):
+                    continue
+                st = os.stat(os.path.join(root, f))
+                zone = os.path.relpath(root, self._cache_location)
+                entries['{}/{}'.format(zone, f[:-len('.pickle')])] = [st.st_size, st.st_mtime]
+        return {'version': INDEX_VERSION, 'total_size': sum(entry[0] for entry in entries.values()),
+                'entries': entries, 'zones': {}}
+
+    def _save_index(self, index):
+        self._atomic_dump(os.path.join(self._cache_location, INDEX_FILE),
+                          lambda f: json.dump(index, f), mode='w')
+
+    @staticmethod
+    def _atomic_dump(path, dump, mode='wb'):
+        """Write a file through a temp file renamed over it, readers never see a partially written file."""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.{}.'.format(os.path.basename(path)),
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode) as f:
+                dump(f)
+            # mkstemp creates the file as 0600, the cache directory is shared by other users and processes
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict(self, index):
+        """Remove least recently used pickle files until the usage is under the watermark of the limits."""
+        entries = index['entries']
+        if index['total_size'] <= SIZE_LIMIT and len(entries) <= ENTRY_LIMIT:
+            return
+        size_target = SIZE_LIMIT * EVICT_WATERMARK
+        entry_target = ENTRY_LIMIT * EVICT_WATERMARK
+        for name in sorted(entries, key=lambda name: entries[name][1]):
+            if index['total_size'] <= size_target and len(entries) <= entry_target:
+                break
+            zone, key = name.rsplit('/', 1)
+            try:
+                os.remove(os.path.join(self._cache_location, zone, '{}.pickle'.format(key)))
+            except OSError:
+                pass
+            index['total_size'] -= entries.pop(name)[0]
+            self._cache.pop((zone, key), None)
+            self._stats['evictions'] += 1
+            logger.debug('Evicted cached facts "{}.{}"'.format(zone, key))
 
-        if total_size > SIZE_LIMIT or total_entries > ENTRY_LIMIT:
-            msg = 'Cache usage exceeds limitations. total_size={}, SIZE_LIMIT={}, total_entries={}, ENTRY_LIMIT={}' \
-                .format(total_size, SIZE_LIMIT, total_entries, ENTRY_LIMIT)
-            raise Exception(msg)
+    # TTL and invalidation
+
+    def set_ttl(self, ttl, zone=None):
+        """Set time to live of cached facts.
+
+        Args:
+            ttl (int or float): Seconds after writing that cached facts expire. None for no expiry.
+            zone (str): Zone the TTL applies to. Default to None, set the default TTL of all zones.
+        """
+        if zone is None:
+            self._default_ttl = ttl
+        else:
+            self._zone_ttl[zone] = ttl
+
+    def _expired(self, zone, written):
+        ttl = self._zone_ttl.get(zone, self._default_ttl)
+        return ttl is not None and time.time() - written > ttl
+
+    def invalidate_on_change(self, zone, tag):
+        """Cleanup the zone if it was cached with a different tag, for example another image version of the DUT.
+
+        The zones of the ASIC namespaces of the zone, named '<zone>-asic<N>', are cleaned up as well.
+
+        Args:
+            zone (str): Zone name, usually hostname.
+            tag (str): Tag of the current state of the zone.
+
+        Returns:
+            boolean: The zone was invalidated.
+        """
+        with self._write_lock:
+            with self._locked_index(save=False) as index:
+                zone_info = index['zones'].setdefault(zone, {})
+                old_tag = zone_info.get('tag')
+                if old_tag == tag:
+                    return False
+                zone_info['tag'] = tag
+                if old_tag is not None:
+                    zones = set(name.rsplit('/', 1)[0] for name in list(index['entries']) + list(self._written))
+                    related = [z for z in zones if z == zone or re.match(re.escape(zone) + r'-asic\d+$', z)]
+                    for z in related:
+                        self._cleanup_zone(index, z)
+                self._merge_pending(index)
+                self._save_index(index)
+            if old_tag is None:
+                return False
+            logger.info('Cached facts of zone "{}" invalidated, tag changed from "{}" to "{}"'.format(zone, old_tag, tag))
+            self._stats['invalidations'] += 1
+            return True
+
+    # Statistics
+
+    @property
+    def stats(self):
+        """Dict of the cache statistics of the current process."""
+        stats = dict(self._stats)
+        stats['memory_entries'] = len(self._cache)
+        return stats
+
+    def stats_summary(self):
+        stats = self._stats
+        reads = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        hit_ratio = float(stats['memory_hits'] + stats['disk_hits']) / reads if reads else 0.0
+        return 'Facts cache: {} reads, {} memory hits, {} disk hits, {} misses ({} expired), hit ratio {:.1%}, ' \
+            '{} writes, {} evictions, {} invalidations, {} entries in memory'.format(
+                reads, stats['memory_hits'], stats['disk_hits'], stats['misses'], stats['expired'], hit_ratio,
+                stats['writes'], stats['evictions'], stats['invalidations'], len(self._cache))
+
+    def flush(self):
+        """Merge the facts written and read since the last flush into the index, evict entries if a limit is exceeded."""
+        with self._write_lock:
+            if (self._written or self._accessed) and os.path.exists(self._cache_location):
+                with self._locked_index() as index:
+                    self._merge_pending(index)
+
+    # Memory tier
+
+    def _remember(self, zone, key, value, written):
+        self._cache.pop((zone, key), None)
+        self._cache[(zone, key)] = (value, written)
+        while len(self._cache) > MEMORY_ENTRY_LIMIT:
+            self._cache.popitem(last=False)
 
     def read(self, zone, key):
         """Read cached facts.
@@ -77,25 +275,46 @@ class FactsCache(with_metaclass(Singleton, object)):
         Returns:
             obj: Cached object, usually a dictionary.
         """
-        # Lazy load
-        if zone in self._cache and key in self._cache[zone]:
-            logger.debug('Read cached facts "{}.{}"'.format(zone, key))
-            return self._cache[zone][key]
-        else:
+        with self._write_lock:
+            cached = self._cache.get((zone, key))
+            if cached is not None:
+                value, written = cached
+                if not self._expired(zone, written):
+                    logger.debug('Read cached facts "{}.{}"'.format(zone, key))
+                    self._remember(zone, key, value, written)
+                    self._accessed[(zone, key)] = time.time()
+                    self._stats['memory_hits'] += 1
+                    return value
+
+            # Lazy load
             facts_file = os.path.join(self._cache_location, '{}/{}.pickle'.format(zone, key))
             try:
-                with open(facts_file) as f:
-                    self._cache[zone][key] = pickle.load(f)
+                with open(facts_file, 'rb') as f:
+                    written = os.fstat(f.fileno()).st_mtime
+                    if self._expired(zone, written):
+                        logger.info('Cached facts "{}.{}" expired'.format(zone, key))
+                        self._stats['expired'] += 1
+                        self._stats['misses'] += 1
+                        self._cache.pop((zone, key), None)
+                        return self.NOTEXIST
+                    value = pickle.load(f)
+                    self._remember(zone, key, value, written)
+                    self._accessed[(zone, key)] = time.time()
+                    self._stats['disk_hits'] += 1
                     logger.debug('Loaded cached facts "{}.{}" from {}'.format(zone, key, facts_file))
-                    return self._cache[zone][key]
-            except (IOError, ValueError) as e:
+                    return value
+            except (IOError, ValueError, EOFError, pickle.UnpicklingError) as e:
                 logger.info('Load cache file "{}" failed with exception: {}'\
                     .format(os.path.abspath(facts_file), repr(e)))
+                self._stats['misses'] += 1
                 return self.NOTEXIST
 
     def write(self, zone, key, value):
         """Store facts to cache.
 
+        The pickle file is written to a temp file renamed over the cache file, so it is safe for concurrent pytest
+        processes. When the usage limits are exceeded, the least recently used cache files are evicted.
+
         Args:
             zone (str): Cached facts are organized by zones. This argument is to specify the zone name.
                 The zone name could be hostname.
@@ -106,23 +325,54 @@ class FactsCache(with_metaclass(Singleton, object)):
             boolean: Caching facts is successful or not.
         """
         with self._write_lock:
-            self._check_usage()
             facts_file = os.path.join(self._cache_location, '{}/{}.pickle'.format(zone, key))
             try:
                 cache_subfolder = os.path.join(self._cache_location, zone)
                 if not os.path.exists(cache_subfolder):
                     logger.info('Create cache dir {}'.format(cache_subfolder))
-                    os.makedirs(cache_subfolder)
-
-                with open(facts_file, 'w') as f:
-                    pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
-                    self._cache[zone][key] = value
-                    logger.info('Cached facts "{}.{}" to {}'.format(zone, key, facts_file))
-                    return True
-            except (IOError, ValueError) as e:
+                    try:
+                        os.makedirs(cache_subfolder)
+                    except OSError:
+                        # Created by another process in the meantime
+                        if not os.path.isdir(cache_subfolder):
+                            raise
+
+                self._atomic_dump(facts_file, lambda f: pickle.dump(value, f, pickle.HIGHEST_PROTOCOL))
+                now = time.time()
+                self._remember(zone, key, value, now)
+                self._stats['writes'] += 1
+                size = os.path.getsize(facts_file)
+                self._written['{}/{}'.format(zone, key)] = [size, now]
+                if self._usage is None:
+                    self.flush()
+                else:
+                    # Overwritten files are counted twice, the estimate errs on the side of an early flush
+                    self._usage[0] += size
+                    self._usage[1] += 1
+                    if self._usage[0] > SIZE_LIMIT or self._usage[1] > ENTRY_LIMIT:
+                        self.flush()
+                logger.info('Cached facts "{}.{}" to {}'.format(zone, key, facts_file))
+                return True
+            except (IOError, OSError, ValueError, pickle.PicklingError) as e:
                 logger.error('Dump cache file "{}" failed with exception: {}'.format(facts_file, repr(e)))
                 return False
 
+    def _cleanup_zone(self, index, zone):
+        for cached_zone, key in list(self._cache):
+            if cached_zone == zone:
+                del self._cache[(cached_zone, key)]
+        prefix = '{}/'.format(zone)
+        for name in [name for name in self._written if name.startswith(prefix)]:
+            del self._written[name]
+        for name in [name for name in index['entries'] if name.startswith(prefix)]:
+            index['total_size'] -= index['entries'].pop(name)[0]
+        try:
+            cache_subfolder = os.path.join(self._cache_location, zone)
+            shutil.rmtree(cache_subfolder)
+            logger.debug('Removed cache subfolder "{}"'.format(cache_subfolder))
+        except OSError as e:
+            logger.error('Remove cache subfolder "{}" failed with exception: {}'.format(zone, repr(e)))
+
     def cleanup(self, zone=None, key=None):
         """Cleanup cached files.
 
@@ -132,35 +382,38 @@ class FactsCache(with_metaclass(Singleton, object)):
                 will be cleaned up.
             key (str): Name of cached facts. Default is None.
         """
-        if zone:
-            if key:
-                if zone in self._cache and key in self._cache[zone]:
-                    del self._cache[zone][key]
-                    logger.debug('Removed "{}.{}" from cache.'.format(zone, key))
-                try:
-                    cache_file = os.path.join(self._cache_location, zone, '{}.pickle'.format(key))
-                    os.remove(cache_file)
-                    logger.debug('Removed cache file "{}.pickle"'.format(cache_file))
-                except OSError as e:
-                    logger.error('Cleanup cache {}.{}.pickle failed with exception: {}'.format(zone, key, repr(e)))
+        with self._write_lock:
+            if zone:
+                with self._locked_index() as index:
+                    if key:
+                        if (zone, key) in self._cache:
+                            del self._cache[(zone, key)]
+                            logger.debug('Removed "{}.{}" from cache.'.format(zone, key))
+                        name = '{}/{}'.format(zone, key)
+                        self._written.pop(name, None)
+                        if name in index['entries']:
+                            index['total_size'] -= index['entries'].pop(name)[0]
+                        try:
+                            cache_file = os.path.join(self._cache_location, zone, '{}.pickle'.format(key))
+                            os.remove(cache_file)
+                            logger.debug('Removed cache file "{}.pickle"'.format(cache_file))
+                        except OSError as e:
+                            logger.error('Cleanup cache {}.{}.pickle failed with exception: {}'.format(zone, key, repr(e)))
+                    else:
+                        self._cleanup_zone(index, zone)
+                        index['zones'].pop(zone, None)
+                        logger.debug('Removed zone "{}" from cache'.format(zone))
             else:
-                if zone in self._cache:
-                    del self._cache[zone]
-                    logger.debug('Removed zone "{}" from cache'.format(zone))
+                self._cache = OrderedDict()
+                self._accessed = {}
+                self._written = {}
+                self._usage = None
                 try:
-                    cache_subfolder = os.path.join(self._cache_location, zone)
-                    shutil.rmtree(cache_subfolder)
-                    logger.debug('Removed cache subfolder "{}"'.format(cache_subfolder))
+                    shutil.rmtree(self._cache_location)
+                    logger.debug('Removed all cache files under "{}"'.format(self._cache_location))
                 except OSError as e:
-                    logger.error('Remove cache subfolder "{}" failed with exception: {}'.format(zone, repr(e)))
-        else:
-            self._cache = defaultdict(dict)
-            try:
-                shutil.rmtree(self._cache_location)
-                logger.debug('Removed all cache files under "{}"'.format(self._cache_location))
-            except OSError as e:
-                logger.error('Remove cache folder "{}" failed with exception: {}'\
-                    .format(self._cache_location, repr(e)))
+                    logger.error('Remove cache folder "{}" failed with exception: {}'\
+                        .format(self._cache_location, repr(e)))
 
 
 def _get_default_zone(function, func_args, func_kargs):
@@ -1,6 +1,9 @@
+import copy
 import inspect
 import json
 import logging
+import threading
+import time
 
 from multiprocessing.pool import ThreadPool
 
@@ -23,6 +26,116 @@ except Exception as e:
     logging.error("Hack for https://github.com/ansible/pytest-ansible/issues/47 failed: {}".format(repr(e)))
 
 
+class ResultCache(object):
+    """
+    @summary: TTL-bounded cache of ansible module results.
+
+    Only results of calls explicitly marked as cacheable (read-only commands) are stored. Cached results are
+    returned as deep copies, so callers can't modify the cached ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(module_name, module_args, complex_args):
+        return json.dumps([module_name, module_args, complex_args], sort_keys=True)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key, result, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, copy.deepcopy(result))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class BatchResult(dict):
+    """
+    @summary: Placeholder for the result of a command queued in a CommandBatch.
+
+    The dictionary is empty until the batch is executed, after that it has the same keys as the result of the
+    'shell' module: cmd, rc, stdout, stderr, stdout_lines, stderr_lines.
+    """
+    pass
+
+
+class CommandBatch(object):
+    """
+    @summary: Collect several shell/command invocations and run them on the host as one 'shell_cmds' module call.
+
+    Every command is run by /bin/sh on the host, one after another, and every command is run even if a previous
+    one failed. Results are filled into the BatchResult objects returned when the commands were queued.
+
+    Usage:
+        with duthost.batch() as batch:
+            swss = batch.shell("docker exec swss supervisorctl status", module_ignore_errors=True)
+            monit = batch.shell("sudo monit status", module_ignore_errors=True)
+        logger.info(swss["stdout"])
+
+    RunAnsibleModuleFail is raised after the batch is executed if any command queued without
+    module_ignore_errors=True failed.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self._queue = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    def shell(self, cmd, module_ignore_errors=False):
+        result = BatchResult()
+        self._queue.append((cmd, module_ignore_errors, result))
+        return result
+
+    # Commands are executed by /bin/sh anyway, the 'command' alias is for call sites ported from host.command()
+    command = shell
+
+    def execute(self):
+        """
+        @summary: Run queued commands on the host.
+
+        @return: List of results of the queued commands, in the order they were queued.
+        """
+        queue, self._queue = self._queue, []
+        if not queue:
+            return []
+
+        res = self.host.shell_cmds(cmds=[item[0] for item in queue], continue_on_fail=True,
+                                   module_ignore_errors=True, verbose=False)
+        results = res.get("results", [])
+        if len(results) != len(queue):
+            raise RunAnsibleModuleFail("run batch of {} commands failed".format(len(queue)), res)
+
+        for (cmd, module_ignore_errors, result), cmd_result in zip(queue, results):
+            result.update(cmd_result)
+        for cmd, module_ignore_errors, result in queue:
+            if result["rc"] != 0 and not module_ignore_errors:
+                raise RunAnsibleModuleFail("run command '{}' in batch failed".format(cmd), result)
+        return [item[2] for item in queue]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+
 class AnsibleHostBase(object):
     """
     @summary: The base class for various objects.
@@ -39,6 +152,19 @@ class AnsibleHostBase(object):
             self.host = ansible_adhoc(become=True, *args, **kwargs)[hostname]
             self.mgmt_ip = self.host.options["inventory_manager"].get_host(hostname).vars["ansible_host"]
         self.hostname = hostname
+        self.result_cache = ResultCache()
+
+    def batch(self):
+        """
+        @summary: Create a CommandBatch for running several commands on this host with one ansible module call.
+        """
+        return CommandBatch(self)
+
+    def clear_result_cache(self):
+        """
+        @summary: Drop all cached module results, call it after changing state of the host.
+        """
+        self.result_cache.clear()
 
     def __getattr__(self, module_name):
         if self.host.has_module(module_name):
@@ -53,20 +179,27 @@ class AnsibleHostBase(object):
     def _run(self, *module_args, **complex_args):
 
         previous_frame = inspect.currentframe().f_back
-        filename, line_number, function_name, lines, index = inspect.getframeinfo(previous_frame)
+        # inspect.getframeinfo reads the source file for context lines, take only what is logged from the frame
+        filename = previous_frame.f_code.co_filename
+        line_number = previous_frame.f_lineno
+        function_name = previous_frame.f_code.co_name
+        debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
 
         verbose = complex_args.pop('verbose', True)
 
-        if verbose:
-            logging.debug("{}::{}#{}: [{}] AnsibleModule::{}, args={}, kwargs={}"\
-                .format(filename, function_name, line_number, self.hostname,
-                        self.module_name, json.dumps(module_args), json.dumps(complex_args)))
-        else:
-            logging.debug("{}::{}#{}: [{}] AnsibleModule::{} executing..."\
-                .format(filename, function_name, line_number, self.hostname, self.module_name))
+        if debug_enabled:
+            if verbose:
+                logging.debug("{}::{}#{}: [{}] AnsibleModule::{}, args={}, kwargs={}"\
+                    .format(filename, function_name, line_number, self.hostname,
+                            self.module_name, json.dumps(module_args), json.dumps(complex_args)))
+            else:
+                logging.debug("{}::{}#{}: [{}] AnsibleModule::{} executing..."\
+                    .format(filename, function_name, line_number, self.hostname, self.module_name))
 
         module_ignore_errors = complex_args.pop('module_ignore_errors', False)
         module_async = complex_args.pop('module_async', False)
+        # Opt-in caching for read-only calls, the result is reused for cache_ttl seconds
+        cache_ttl = complex_args.pop('cache_ttl', None)
 
         if module_async:
             def run_module(module_args, complex_args):
@@ -75,15 +208,27 @@ class AnsibleHostBase(object):
             result = pool.apply_async(run_module, (module_args, complex_args))
             return pool, result
 
-        res = self.module(*module_args, **complex_args)[self.hostname]
-
-        if verbose:
-            logging.debug("{}::{}#{}: [{}] AnsibleModule::{} Result => {}"\
-                .format(filename, function_name, line_number, self.hostname, self.module_name, json.dumps(res)))
-        else:
-            logging.debug("{}::{}#{}: [{}] AnsibleModule::{} done, is_failed={}, rc={}"\
-                .format(filename, function_name, line_number, self.hostname, self.module_name, \
-                        res.is_failed, res.get('rc', None)))
+        res = None
+        if cache_ttl:
+            cache_key = ResultCache.make_key(self.module_name, module_args, complex_args)
+            res = self.result_cache.get(cache_key)
+            if res is not None and debug_enabled:
+                logging.debug("{}::{}#{}: [{}] AnsibleModule::{} result from cache"\
+                    .format(filename, function_name, line_number, self.hostname, self.module_name))
+
+        if res is None:
+            res = self.module(*module_args, **complex_args)[self.hostname]
+            if cache_ttl and not (res.is_failed or 'exception' in res):
+                self.result_cache.put(cache_key, res, cache_ttl)
+
+        if debug_enabled:
+            if verbose:
+                logging.debug("{}::{}#{}: [{}] AnsibleModule::{} Result => {}"\
+                    .format(filename, function_name, line_number, self.hostname, self.module_name, json.dumps(res)))
+            else:
+                logging.debug("{}::{}#{}: [{}] AnsibleModule::{} done, is_failed={}, rc={}"\
+                    .format(filename, function_name, line_number, self.hostname, self.module_name, \
+                            res.is_failed, res.get('rc', None)))
 
         if (res.is_failed or 'exception' in res) and not module_ignore_errors:
             raise RunAnsibleModuleFail("run module {} failed".format(self.module_name), res)
@@ -14,8 +14,10 @@ from ansible import constants
 from ansible.plugins.loader import connection_loader
 
 from tests.common.devices.base import AnsibleHostBase
+from tests.common.helpers import show_parser
 from tests.common.helpers.dut_utils import is_supervisor_node
 from tests.common.cache import cached
+from tests.common.cache import FactsCache
 from tests.common.helpers.constants import DEFAULT_ASIC_ID, DEFAULT_NAMESPACE
 from tests.common.errors import RunAnsibleModuleFail
 
@@ -66,8 +68,10 @@ class SonicHost(AnsibleHostBase):
             }
             self.host.options['variable_manager'].extra_vars.update(evars)
 
-        self._facts = self._gather_facts()
         self._os_version = self._get_os_version()
+        # Facts cached for another image are stale
+        FactsCache().invalidate_on_change(self.hostname, self._os_version)
+        self._facts = self._gather_facts()
         self.is_multi_asic = True if self.facts["num_asic"] > 1 else False
         self._kernel_version = self._get_kernel_version()
 
@@ -379,9 +383,15 @@ class SonicHost(AnsibleHostBase):
         @return: A dictionary in which key is the service name and values are service status
                  and service type.
         """
-        monit_services_status = {}
-
         services_status_result = self.shell("sudo monit status", module_ignore_errors=True, verbose=False)
+        return self.parse_monit_services_status(services_status_result)
+
+    @staticmethod
+    def parse_monit_services_status(services_status_result):
+        """
+        @summary: Parse the result of the 'sudo monit status' command, see get_monit_services_status.
+        """
+        monit_services_status = {}
 
         exit_code = services_status_result["rc"]
         if exit_code != 0:
@@ -406,14 +416,34 @@ class SonicHost(AnsibleHostBase):
                   critical_processes file in the specified container
         @return: Two lists which include the critical groups and critical processes respectively
         """
+        file_content = self.shell(self._critical_processes_file_cmd(container_name), module_ignore_errors=True)
+        critical_group_list, critical_process_list, succeeded = \
+            self._parse_critical_processes_file(file_content["stdout_lines"])
+
+        # For PMon container, since different daemons are enabled in different platforms, we need find common processes
+        # which are not only in the critical_processes file and also are configured to run on that platform.
+        if succeeded and container_name == "pmon":
+            process_list = self.shell("docker exec {} supervisorctl status".format(container_name), module_ignore_errors=True)
+            critical_group_list, critical_process_list = self._filter_pmon_critical_processes(
+                critical_group_list, critical_process_list, process_list["stdout_lines"])
+
+        return critical_group_list, critical_process_list, succeeded
+
+    @staticmethod
+    def _critical_processes_file_cmd(container_name):
+        return "docker exec {} bash -c '[ -f /etc/supervisor/critical_processes ] \
+                && cat /etc/supervisor/critical_processes'".format(container_name)
+
+    def _parse_critical_processes_file(self, lines):
+        """
+        @summary: Parse content of the critical_processes file of a container
+        @return: Critical group list, critical process list and whether the file was parsed successfully
+        """
         critical_group_list = []
         critical_process_list = []
         succeeded = True
 
-
-        file_content = self.shell("docker exec {} bash -c '[ -f /etc/supervisor/critical_processes ] \
-                && cat /etc/supervisor/critical_processes'".format(container_name), module_ignore_errors=True)
-        for line in file_content["stdout_lines"]:
+        for line in lines:
             line_info = line.strip().split(':')
             if len(line_info) != 2:
                 if '201811' in self._os_version and len(line_info) == 1:
@@ -434,28 +464,45 @@ class SonicHost(AnsibleHostBase):
                 succeeded = False
                 break
 
-        # For PMon container, since different daemons are enabled in different platforms, we need find common processes
-        # which are not only in the critical_processes file and also are configured to run on that platform.
-        if succeeded and container_name == "pmon":
-            expected_critical_group_list = []
-            expected_critical_process_list = []
-            process_list = self.shell("docker exec {} supervisorctl status".format(container_name), module_ignore_errors=True)
-            for process_info in process_list["stdout_lines"]:
-                process_name = process_info.split()[0].strip()
-                process_status = process_info.split()[1].strip()
-                if ":" in process_name:
-                    group_name = process_name.split(":")[0]
-                    process_name = process_name.split(":")[1]
-                    if process_status == "RUNNING" and group_name in critical_group_list:
-                        expected_critical_group_list.append(process_name)
-                else:
-                    if process_status == "RUNNING" and process_name in critical_process_list:
-                        expected_critical_process_list.append(process_name)
+        return critical_group_list, critical_process_list, succeeded
 
-            critical_group_list = expected_critical_group_list
-            critical_process_list = expected_critical_process_list
+    @staticmethod
+    def _filter_pmon_critical_processes(critical_group_list, critical_process_list, supervisor_status_lines):
+        """
+        @summary: Keep only the PMon critical groups and processes which are running on the platform
+        """
+        expected_critical_group_list = []
+        expected_critical_process_list = []
+        for process_info in supervisor_status_lines:
+            process_name = process_info.split()[0].strip()
+            process_status = process_info.split()[1].strip()
+            if ":" in process_name:
+                group_name = process_name.split(":")[0]
+                process_name = process_name.split(":")[1]
+                if process_status == "RUNNING" and group_name in critical_group_list:
+                    expected_critical_group_list.append(process_name)
+            else:
+                if process_status == "RUNNING" and process_name in critical_process_list:
+                    expected_critical_process_list.append(process_name)
 
-        return critical_group_list, critical_process_list, succeeded
+        return expected_critical_group_list, expected_critical_process_list
+
+    @staticmethod
+    def _parse_critical_process_status(result, critical_group_list, critical_process_list, supervisor_status_lines):
+        """
+        @summary: Fill running and exited critical processes of a service into result
+        """
+        for l in supervisor_status_lines:
+            (pname, status, info) = re.split("\s+", l, 2)
+            if status != "RUNNING":
+                if pname in critical_group_list or pname in critical_process_list:
+                    result['exited_critical_process'].append(pname)
+                    result['status'] = False
+            else:
+                if pname in critical_group_list or pname in critical_process_list:
+                    result['running_critical_process'].append(pname)
+
+        return result
 
     def critical_process_status(self, service):
         """
@@ -485,25 +532,72 @@ class SonicHost(AnsibleHostBase):
         output = self.command("docker exec {} supervisorctl status".format(service), module_ignore_errors=True)
         logging.info("====== supervisor process status for service {} ======".format(service))
 
-        for l in output['stdout_lines']:
-            (pname, status, info) = re.split("\s+", l, 2)
-            if status != "RUNNING":
-                if pname in critical_group_list or pname in critical_process_list:
-                    result['exited_critical_process'].append(pname)
-                    result['status'] = False
-            else:
-                if pname in critical_group_list or pname in critical_process_list:
-                    result['running_critical_process'].append(pname)
-
-        return result
+        return self._parse_critical_process_status(result, critical_group_list, critical_process_list,
+                                                   output['stdout_lines'])
 
     def all_critical_process_status(self):
         """
         @summary: Check whether all critical processes status for all critical services
+
+        The container state, critical_processes file and supervisor status of all the critical services are
+        collected with one batch of commands instead of several ansible calls per service.
+        """
+        with self.batch() as batch:
+            outputs = self.queue_critical_process_status(batch)
+        return self.parse_critical_process_status(outputs)
+
+    @staticmethod
+    def container_running_cmd(service):
+        return "docker inspect -f \{\{.State.Running\}\} %s" % service
+
+    @staticmethod
+    def is_container_running_output(output):
+        """
+        @summary: Whether the result of the container_running_cmd command reports a running container
+        """
+        return output["rc"] == 0 and output["stdout"].strip() == "true"
+
+    def queue_critical_process_status(self, batch, services=None):
+        """
+        @summary: Queue the commands reading the critical processes status of the services into a CommandBatch
+
+        @param services: Names of the services, all the critical services by default
+        @return: A dictionary of the service name and the results of the queued commands, to be parsed by
+                 parse_critical_process_status once the batch is executed
+        """
+        outputs = {}
+        for service in (self.critical_services if services is None else services):
+            outputs[service] = (
+                batch.command(self.container_running_cmd(service), module_ignore_errors=True),
+                batch.shell(self._critical_processes_file_cmd(service), module_ignore_errors=True),
+                batch.command("docker exec {} supervisorctl status".format(service), module_ignore_errors=True)
+            )
+        return outputs
+
+    def parse_critical_process_status(self, outputs):
+        """
+        @summary: Parse the outputs collected by queue_critical_process_status, see all_critical_process_status
         """
         result = {}
-        for service in self.critical_services:
-            result[service] = self.critical_process_status(service)
+        for service, (running, critical_file, supervisor_status) in outputs.items():
+            service_result = {'status': True, 'exited_critical_process': [], 'running_critical_process': []}
+            result[service] = service_result
+
+            if not self.is_container_running_output(running):
+                service_result['status'] = False
+                continue
+
+            critical_group_list, critical_process_list, succeeded = \
+                self._parse_critical_processes_file(critical_file["stdout_lines"])
+            if not succeeded:
+                service_result['status'] = False
+                continue
+            if service == "pmon":
+                critical_group_list, critical_process_list = self._filter_pmon_critical_processes(
+                    critical_group_list, critical_process_list, supervisor_status["stdout_lines"])
+
+            self._parse_critical_process_status(service_result, critical_group_list, critical_process_list,
+                                                supervisor_status["stdout_lines"])
         return result
 
     def get_crm_resources(self):
@@ -1056,59 +1150,12 @@ default via fc00::1a dev PortChannel0004 proto 186 src fc00:1::32 metric 20  pre
             Returns a list. Each item is a tuple with two elements. The first element is start position of a column. The
             second element is the end position of the column.
         """
-        prev = ' ',
-        positions = []
-        for pos, char in enumerate(sep_line + ' '):
-            if char == sep_char:
-                if char != prev:
-                    left = pos
-            else:
-                if char != prev:
-                    right = pos
-                    positions.append((left, right))
-            prev = char
-        return positions
-
-
-    def _parse_show(self, output_lines):
+        return show_parser.parse_column_positions(sep_line, sep_char)
 
-        result = []
-
-        sep_line_pattern = re.compile(r"^( *-+ *)+$")
-        sep_line_found = False
-        for idx, line in enumerate(output_lines):
-            if sep_line_pattern.match(line):
-                sep_line_found = True
-                header_line = output_lines[idx-1]
-                sep_line = output_lines[idx]
-                content_lines = output_lines[idx+1:]
-                break
-
-        if not sep_line_found:
-            logging.error('Failed to find separation line in the show command output')
-            return result
-
-        try:
-            positions = self._parse_column_positions(sep_line)
-        except Exception as e:
-            logging.error('Possibly bad command output, exception: {}'.format(repr(e)))
-            return result
-
-        headers = []
-        for (left, right) in positions:
-            headers.append(header_line[left:right].strip().lower())
-
-        for content_line in content_lines:
-            item = {}
-            for idx, (left, right) in enumerate(positions):
-                k = headers[idx]
-                v = content_line[left:right].strip()
-                item[k] = v
-            result.append(item)
-
-        return result
+    def _parse_show(self, output_lines, result_format=show_parser.ROWS):
+        return show_parser.parse_show(output_lines, result_format)
 
-    def show_and_parse(self, show_cmd, **kwargs):
+    def show_and_parse(self, show_cmd, result_format=show_parser.ROWS, multi_table=False, stream=False, **kwargs):
         """Run a show command and parse the output using a generic pattern.
 
         This method can adapt to the column changes as long as the output format follows the pattern of
@@ -1168,14 +1215,26 @@ default via fc00::1a dev PortChannel0004 proto 186 src fc00:1::32 metric 20  pre
 
         Args:
             show_cmd: The show command that will be executed.
+            result_format: 'rows' for a list of dictionary (the default), 'columns' for a dictionary of lists keyed by
+                the column headers in lowercase, 'tuples' for a list of namedtuple.
+            multi_table: The output has several tables, each with its own header and separation lines. Return a list
+                of the parsed tables.
+            stream: Return a generator of the parsed rows, the 'stdout' of the command is parsed a line at a time.
+                Several tables are supported, 'columns' format is not and raises ValueError.
 
         Returns:
             Return the parsed output of the show command in a list of dictionary. Each list item is a dictionary,
             corresponding to one content line under the header in the output. Keys of the dictionary are the column
             headers in lowercase.
         """
-        output = self.shell(show_cmd, **kwargs)["stdout_lines"]
-        return self._parse_show(output)
+        if stream and result_format == show_parser.COLUMNS:
+            raise ValueError("The 'columns' result format can not be streamed")
+        output = self.shell(show_cmd, **kwargs)["stdout"]
+        if stream:
+            return show_parser.iter_show_rows(output, result_format)
+        if multi_table:
+            return show_parser.parse_show_tables(output, result_format)
+        return self._parse_show(output, result_format)
 
     @cached(name='mg_facts')
     def get_extended_minigraph_facts(self, tbinfo, namespace = DEFAULT_NAMESPACE):
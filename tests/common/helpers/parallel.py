@@ -4,127 +4,329 @@ import os
 import shutil
 import tempfile
 import signal
+import threading
+import time
 import traceback
-from multiprocessing import Process, Manager, Pipe
+from multiprocessing import Process, Pipe, cpu_count
+from multiprocessing.pool import ThreadPool
 from tests.common.helpers.assertions import pytest_assert as pt_assert
 
 logger = logging.getLogger(__name__)
 
 
+BACKEND_PROCESS = "process"
+BACKEND_POOL = "pool"
+BACKEND_THREAD = "thread"
+BACKENDS = (BACKEND_PROCESS, BACKEND_POOL, BACKEND_THREAD)
+
+# Interval of polling the running workers for results, timeouts and free slots
+POLL_INTERVAL = 0.05
+
+# Set in the threads of the thread backend, see reset_ansible_local_tmp
+_thread_context = threading.local()
+
+
 class SonicProcess(Process):
     """
     Wrapper class around multiprocessing.Process that would capture the exception thrown if the Process throws
     an exception when run.
 
     This exception (including backtrace) can be logged in test log to provide better info of why a particular Process failed.
+
+    The 'results' dict passed to the target in kwargs is sent back to the parent process through the same pipe when
+    the target completes, so no multiprocessing.Manager() proxy is needed to collect the results.
     """
     def __init__(self, *args, **kwargs):
         Process.__init__(self, *args, **kwargs)
         self._pconn, self._cconn = Pipe()
         self._exception = None
+        self._results = None
+        self._received = False
 
     def run(self):
+        results = self._kwargs.get('results')
         try:
             Process.run(self)
-            self._cconn.send(None)
+            self._cconn.send((None, results))
         except Exception as e:
             tb = traceback.format_exc()
-            self._cconn.send((e, tb))
+            self._cconn.send(((e, tb), results))
             raise e
 
+    def receive(self):
+        """Receive the outcome of the target if the child process has sent it
+
+        The parent has to drain the pipe while waiting for the child, otherwise a child sending a result larger than
+        the pipe buffer would block forever.
+
+        Returns:
+            bool: True if the outcome has been received.
+        """
+        if not self._received and self._pconn.poll():
+            self._exception, self._results = self._pconn.recv()
+            self._received = True
+        return self._received
+
     @property
     def exception(self):
-        if self._pconn.poll():
-            self._exception = self._pconn.recv()
+        self.receive()
         return self._exception
 
+    @property
+    def results(self):
+        self.receive()
+        return self._results
+
 
-def parallel_run(target, args, kwargs, nodes, timeout=None):
-    """Run target function on nodes in parallel
+class _NodeTask(object):
+    """Common interface over a SonicProcess and a thread of the thread pool running the target for one node"""
+
+    def __init__(self, name, node):
+        self.name = name
+        self.node = node
+        self.start_time = None
+        self.timed_out = False
+
+    def elapsed(self):
+        return (datetime.datetime.now() - self.start_time).total_seconds()
+
+
+class _ProcessTask(_NodeTask):
+
+    def __init__(self, name, node, target, args, kwargs):
+        _NodeTask.__init__(self, name, node)
+        self.worker = SonicProcess(name=name, target=target, args=args, kwargs=kwargs)
+
+    def start(self):
+        self.start_time = datetime.datetime.now()
+        self.worker.start()
+        logger.debug('Started process {} running target "{}"'.format(self.worker.pid, self.name))
+
+    def done(self):
+        self.worker.receive()
+        return not self.worker.is_alive()
+
+    def stop(self):
+        self.timed_out = True
+        self.worker.receive()
+        if self.worker.is_alive():
+            logger.error('Process {} with pid {} is still alive, try to force terminate it.'.format(
+                self.name, self.worker.pid))
+            self.worker.terminate()
+            self.worker.join(1)
+        if self.worker.is_alive():
+            logger.error('Process {} with pid {} could not be terminated. Try to kill it.'.format(
+                self.name, self.worker.pid))
+            try:
+                os.kill(self.worker.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.worker.join(1)
+
+    @property
+    def alive(self):
+        return self.worker.is_alive()
+
+    def outcome(self):
+        """Returns (results, failure) of the task, failure is None when the target succeeded"""
+        self.worker.join()
+        self.worker.receive()
+        if self.timed_out:
+            return self.worker.results, {'exit_code': self.worker.exitcode, 'exception': None, 'timeout': True}
+        if self.worker.exitcode != 0:
+            return self.worker.results, {'exit_code': self.worker.exitcode, 'exception': self.worker.exception}
+        return self.worker.results, None
+
+
+class _ThreadTask(_NodeTask):
+
+    def __init__(self, name, node, target, args, kwargs, pool):
+        _NodeTask.__init__(self, name, node)
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.pool = pool
+        self.async_result = None
+
+    def _run(self):
+        _thread_context.in_thread_backend = True
+        try:
+            self.target(*self.args, **self.kwargs)
+        except Exception as e:
+            return (e, traceback.format_exc())
+        return None
+
+    def start(self):
+        self.start_time = datetime.datetime.now()
+        self.async_result = self.pool.apply_async(self._run)
+        logger.debug('Started thread running target "{}"'.format(self.name))
+
+    def done(self):
+        return self.async_result.ready()
+
+    def stop(self):
+        # A python thread cannot be killed, the task is abandoned and reported as failed
+        self.timed_out = True
+        logger.error('Thread running target "{}" is still alive, abandon it.'.format(self.name))
+
+    @property
+    def alive(self):
+        return not self.async_result.ready()
+
+    def outcome(self):
+        if self.timed_out:
+            return None, {'exit_code': None, 'exception': None, 'timeout': True}
+        exception = self.async_result.get()
+        if exception is not None:
+            return self.kwargs['results'], {'exit_code': None, 'exception': exception}
+        return self.kwargs['results'], None
+
+
+def parallel_run_iter(target, args, kwargs, nodes, timeout=None, backend=BACKEND_PROCESS, concurrency=None,
+                      node_timeout=None):
+    """Run target function on nodes in parallel and yield the results of each node as soon as it completes
 
     Args:
         target (function): The target function to be executed in parallel.
         args (list of tuple): List of arguments for the target function.
         kwargs (dict): Keyword arguments for the target function. It will be extended with two keys: 'node' and
-            'results'. The 'node' key will hold an item of the nodes list. The 'result' key will hold an instance of
-            multiprocessing.Manager().dict(). It is a proxy of the shared dict that will be used by each process for
-            returning execution results.
+            'results'. The 'node' key will hold an item of the nodes list. The 'results' key will hold a dict private
+            to the node, the target stores its execution results in it.
         nodes (list of nodes): List of nodes to be used by the target function
-        timeout (int or float, optional): Total time allowed for the spawned multiple processes to run. Defaults to
-            None. When timeout is specified, this function will wait at most 'timeout' seconds for the processes to
-            run. When time is up, this function will try to terminate or even kill all the processes.
+        timeout (int or float, optional): Total time allowed for running the target on all nodes. Defaults to None.
+            When time is up, the targets still running are terminated, or abandoned with the thread backend.
+        backend (str, optional): How the target is run, one of:
+            'process': one process per node, all started at once, the default.
+            'pool': one process per node, at most 'concurrency' of them running at a time.
+            'thread': a pool of 'concurrency' threads in the current process. Suited for I/O bound targets such as
+                ansible module calls, the target must not rely on process isolation.
+        concurrency (int, optional): Maximum number of nodes processed at a time with the 'pool' and 'thread'
+            backends. Defaults to the number of nodes for 'thread' and to the number of CPUs for 'pool'.
+        node_timeout (int or float, optional): Time allowed for the target to run on a single node. Defaults to None.
 
     Raises:
-        flag.: In case any of the spawned process cannot be terminated, fail the test.
+        flag.: In case any of the nodes failed or timed out, fail the test once all the nodes are processed.
 
-    Returns:
-        dict: An instance of multiprocessing.Manager().dict(). It is a proxy to the shared dict that is used by all the
-            spawned processes.
+    Yields:
+        tuple: (node, results) where results is the dict filled by the target for this node.
     """
-    workers = []
-    results = Manager().dict()
-    start_time = datetime.datetime.now()
+    pt_assert(backend in BACKENDS, 'Unknown parallel_run backend "{}", expected one of {}'.format(backend, BACKENDS))
+    nodes = list(nodes)
+    if backend == BACKEND_PROCESS:
+        concurrency = len(nodes)
+    elif not concurrency:
+        concurrency = len(nodes) if backend == BACKEND_THREAD else cpu_count()
+    concurrency = max(1, min(concurrency, len(nodes) or 1))
+
+    pool = ThreadPool(concurrency) if backend == BACKEND_THREAD else None
+    tasks = []
     for node in nodes:
-        kwargs['node'] = node
-        kwargs['results'] = results
-        process_name = "{}--{}".format(target.__name__, node)
-        worker = SonicProcess(name=process_name, target=target, args=args, kwargs=kwargs)
-        worker.start()
-        logger.debug('Started process {} running target "{}"'.format(worker.pid, process_name))
-        workers.append(worker)
-
-    for worker in workers:
-        logger.debug('Wait for process "{}" with pid "{}" to complete, timeout={}'.format(worker.name, worker.pid, timeout))
-        worker.join(timeout)
-        logger.debug('Process "{}" with pid "{}" completed'.format(worker.name, worker.pid))
-
-        # If execution time of processes exceeds timeout, need to force terminate them all.
-        if timeout is not None:
-            if (datetime.datetime.now() - start_time).seconds > timeout:
+        node_kwargs = dict(kwargs)
+        node_kwargs['node'] = node
+        node_kwargs['results'] = {}
+        name = "{}--{}".format(target.__name__, node)
+        if backend == BACKEND_THREAD:
+            tasks.append(_ThreadTask(name, node, target, args, node_kwargs, pool))
+        else:
+            tasks.append(_ProcessTask(name, node, target, args, node_kwargs))
+
+    pending = list(tasks)
+    running = []
+    failed = {}
+    start_time = datetime.datetime.now()
+    try:
+        while pending or running:
+            while pending and len(running) < concurrency:
+                task = pending.pop(0)
+                task.start()
+                running.append(task)
+
+            for task in list(running):
+                if not task.done():
+                    if node_timeout is not None and task.elapsed() > node_timeout:
+                        logger.error('Target "{}" exceeds node timeout {} seconds.'.format(task.name, node_timeout))
+                        task.stop()
+                    else:
+                        continue
+                running.remove(task)
+                results, failure = task.outcome()
+                if failure is not None:
+                    failed[task.name] = failure
+                else:
+                    yield task.node, results
+
+            if timeout is not None and (datetime.datetime.now() - start_time).total_seconds() > timeout:
                 logger.error('Process execution time exceeds {} seconds.'.format(str(timeout)))
+                for task in running:
+                    task.stop()
+                    failed[task.name] = task.outcome()[1]
+                for task in pending:
+                    failed[task.name] = {'exit_code': None, 'exception': None, 'timeout': True}
+                running = []
+                pending = []
                 break
 
-    # check if we have any processes that failed - have exitcode non-zero
-    failed_processes = {}
-    for worker in workers:
-        if worker.exitcode != 0:
-            failed_processes[worker.name] = {}
-            failed_processes[worker.name]['exit_code'] = worker.exitcode
-            failed_processes[worker.name]['exception'] = worker.exception
-
-    # Force terminate spawned processes
-    for worker in workers:
-        if worker.is_alive():
-            logger.error('Process {} with pid {} is still alive, try to force terminate it.'.format(worker.name, worker.pid))
-            worker.terminate()
-
-    end_time = datetime.datetime.now()
-    delta_time = end_time - start_time
-
-    # Some processes cannot be terminated. Try to kill them and raise flag.
-    running_processes = [worker for worker in workers if worker.is_alive()]
-    if len(running_processes) > 0:
-        logger.error('Found processes still running: {}. Try to kill them.'.format(str(running_processes)))
-        for p in running_processes:
-            try:
-                os.kill(p.pid, signal.SIGKILL)
-            except OSError:
-                pass
+            if running:
+                time.sleep(POLL_INTERVAL)
+    finally:
+        # Reached when the consumer stops iterating early, the remaining workers must not be left behind
+        for task in running:
+            task.stop()
+        if pool is not None:
+            # Not terminate(), it would join the abandoned threads
+            pool.close()
 
+    # Abandoned threads cannot be killed, only processes are checked
+    still_alive = [task.name for task in tasks
+                   if isinstance(task, _ProcessTask) and task.start_time is not None and task.alive]
+    if still_alive:
+        logger.error('Found processes still running: {}.'.format(still_alive))
         pt_assert(False, \
             'Processes running target "{}" could not be terminated. Tried killing them. But please check'.format(target.__name__))
 
     # if we have failed processes, we should log the exception and exit code of each Process and fail
-    if len(failed_processes.keys()):
-        for process_name, process in failed_processes.items():
-            p_exception = process['exception'][0]
-            p_traceback = process['exception'][1]
-            p_exitcode = process['exit_code']
-            logger.error('Process {} had exit code {} and exception {} and traceback {}'.format(process_name, p_exitcode, p_exception, p_traceback))
-        pt_assert(False, 'Processes "{}" had failures. Please check the logs'.format(failed_processes.keys()))
+    if len(failed.keys()):
+        for name, failure in failed.items():
+            if failure.get('timeout'):
+                logger.error('{} timed out'.format(name))
+                continue
+            p_exception, p_traceback = failure['exception'] or (None, None)
+            logger.error('{} had exit code {} and exception {} and traceback {}'.format(
+                name, failure['exit_code'], p_exception, p_traceback))
+        pt_assert(False, 'Processes "{}" had failures. Please check the logs'.format(failed.keys()))
 
-    logger.info('Completed running processes for target "{}" in {} seconds'.format(target.__name__, str(delta_time)))
+    logger.info('Completed running {} for target "{}" in {} seconds'.format(
+        backend, target.__name__, str(datetime.datetime.now() - start_time)))
 
+
+def parallel_run(target, args, kwargs, nodes, timeout=None, backend=BACKEND_PROCESS, concurrency=None,
+                 node_timeout=None):
+    """Run target function on nodes in parallel
+
+    Args:
+        target (function): The target function to be executed in parallel.
+        args (list of tuple): List of arguments for the target function.
+        kwargs (dict): Keyword arguments for the target function. It will be extended with two keys: 'node' and
+            'results'. The 'node' key will hold an item of the nodes list. The 'results' key will hold a dict that the
+            target uses for returning execution results, the dicts of all the nodes are merged into the returned one.
+        nodes (list of nodes): List of nodes to be used by the target function
+        timeout (int or float, optional): Total time allowed for the spawned multiple processes to run. Defaults to
+            None. When timeout is specified, this function will wait at most 'timeout' seconds for the processes to
+            run. When time is up, this function will try to terminate or even kill all the processes.
+        backend (str, optional): 'process', 'pool' or 'thread', see parallel_run_iter. Defaults to 'process'.
+        concurrency (int, optional): Maximum number of nodes processed at a time, see parallel_run_iter.
+        node_timeout (int or float, optional): Time allowed for the target to run on a single node.
+
+    Raises:
+        flag.: In case any of the spawned process failed or cannot be terminated, fail the test.
+
+    Returns:
+        dict: The results of all the nodes.
+    """
+    results = {}
+    for _, node_results in parallel_run_iter(target, args, kwargs, nodes, timeout=timeout, backend=backend,
+                                             concurrency=concurrency, node_timeout=node_timeout):
+        results.update(node_results or {})
     return results
 
 
@@ -137,6 +339,11 @@ def reset_ansible_local_tmp(target):
 
     def wrapper(*args, **kwargs):
 
+        # The threads of the thread backend share the process wide ansible constants, resetting them from one
+        # thread would remove the tmp directory used by the others
+        if getattr(_thread_context, 'in_thread_backend', False):
+            return target(*args, **kwargs)
+
         # Reset the ansible default local tmp directory for the current subprocess
         # Otherwise, multiple processes could share a same ansible default tmp directory and there could be conflicts
         from ansible import constants
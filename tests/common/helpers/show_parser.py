@@ -0,0 +1,246 @@
+"""Parser of the tabular output of SONiC show commands
+
+The output of commands like 'show interface status', 'show interface counters' or 'crm show resources all' is a table
+made of a line of headers, a separation line with '-' under each column header and the content lines:
+
+      Interface            Lanes    Speed    MTU    FEC    Alias             Vlan    Oper    Admin
+    ---------------  ---------------  -------  -----  -----  -------  ---------------  ------  -------
+          Ethernet0          0,1,2,3      40G   9100    N/A     etp1  PortChannel0002      up       up
+
+The column layout is computed once per table from the separation line as slice objects, and the content lines are
+cut with them instead of parsing the column positions again for each line.
+
+The parsed table can be returned as:
+    ROWS: a list of dict, one per content line, keys are the lowercase headers. The legacy format.
+    COLUMNS: a dict of lists, one list of values per lowercase header.
+    TUPLES: a list of namedtuple, one per content line, fields are the lowercase headers with the characters that are
+        not valid in an identifier replaced by '_'.
+"""
+import logging
+import re
+
+from collections import namedtuple
+
+import six
+
+
+logger = logging.getLogger(__name__)
+
+ROWS = "rows"
+COLUMNS = "columns"
+TUPLES = "tuples"
+RESULT_FORMATS = (ROWS, COLUMNS, TUPLES)
+
+# Equivalent of r"^( *-+ *)+$" without the nested quantifiers that backtrack on long lines
+SEP_LINE_PATTERN = re.compile(r"^ *-[- ]*$")
+
+
+def parse_column_positions(sep_line, sep_char='-'):
+    """Parse the position of each columns in the command output
+
+    Args:
+        sep_line: The output line separating actual data and column headers
+        sep_char: The character used in separation line. Defaults to '-'.
+
+    Returns:
+        Returns a list. Each item is a tuple with two elements. The first element is start position of a column. The
+        second element is the end position of the column.
+    """
+    return [(m.start(), m.end()) for m in re.finditer(re.escape(sep_char) + '+', sep_line)]
+
+
+def is_sep_line(line):
+    return '-' in line and SEP_LINE_PATTERN.match(line) is not None
+
+
+def iter_lines(output):
+    """Iterate over the lines of a command output without splitting it into a list
+
+    Args:
+        output: The 'stdout' string of a command result, or an iterable of lines such as 'stdout_lines'.
+    """
+    if not isinstance(output, six.string_types):
+        for line in output:
+            yield line
+        return
+    start = 0
+    length = len(output)
+    while start < length:
+        end = output.find('\n', start)
+        if end < 0:
+            yield output[start:]
+            return
+        yield output[start:end]
+        start = end + 1
+
+
+class ShowTable(object):
+    """Column layout of a table, computed from its header line and separation line
+
+    Args:
+        header_line: The line of column headers.
+        sep_line: The separation line under the header line.
+    """
+
+    def __init__(self, header_line, sep_line):
+        self.slices = [slice(left, right) for left, right in parse_column_positions(sep_line)]
+        if not self.slices:
+            raise ValueError('No column in separation line "{}"'.format(sep_line))
+        self.headers = [header_line[s].strip().lower() for s in self.slices]
+        self._row_maker = None
+        self._tuple_maker = None
+        self._tuple_type = None
+
+    @property
+    def tuple_type(self):
+        if self._tuple_type is None:
+            fields = [re.sub(r'\W', '_', header) or 'column' for header in self.headers]
+            self._tuple_type = namedtuple('ShowRow', fields, rename=True)
+        return self._tuple_type
+
+    @property
+    def row_maker(self):
+        """Function returning the dict of a content line"""
+        if self._row_maker is None:
+            columns = list(zip(self.headers, self.slices))
+
+            def make_row(line):
+                return dict([(header, line[s].strip()) for header, s in columns])
+            self._row_maker = make_row
+        return self._row_maker
+
+    @property
+    def tuple_maker(self):
+        """Function returning the namedtuple of a content line"""
+        if self._tuple_maker is None:
+            make, slices = self.tuple_type._make, self.slices
+
+            def make_tuple(line):
+                return make([line[s].strip() for s in slices])
+            self._tuple_maker = make_tuple
+        return self._tuple_maker
+
+    def row(self, line, result_format=ROWS):
+        if result_format == COLUMNS:
+            raise ValueError('A single line can not be parsed to the columns format')
+        if result_format == TUPLES:
+            return self.tuple_maker(line)
+        return self.row_maker(line)
+
+    def parse(self, lines, result_format=ROWS):
+        """Parse the content lines of the table
+
+        Args:
+            lines: List of content lines.
+            result_format: ROWS, COLUMNS or TUPLES.
+        """
+        if result_format == COLUMNS:
+            # Cutting a column at a time with a constant slice
+            return dict((header, [line[s].strip() for line in lines]) for header, s in zip(self.headers, self.slices))
+        maker = self.tuple_maker if result_format == TUPLES else self.row_maker
+        return [maker(line) for line in lines]
+
+
+def _splitlines(output):
+    if isinstance(output, six.string_types):
+        return output.splitlines()
+    return output if isinstance(output, list) else list(output)
+
+
+def _empty(result_format):
+    return {} if result_format == COLUMNS else []
+
+
+def parse_show(output, result_format=ROWS):
+    """Parse the first table of a show command output
+
+    Every line after the separation line is a content line, like the legacy SonicHost._parse_show.
+
+    Args:
+        output: The 'stdout' string of a command result, or its 'stdout_lines'.
+        result_format: ROWS, COLUMNS or TUPLES.
+
+    Returns:
+        The parsed table, an empty one if the output has no separation line.
+    """
+    lines = _splitlines(output)
+    for idx, line in enumerate(lines):
+        if is_sep_line(line):
+            break
+    else:
+        logger.error('Failed to find separation line in the show command output')
+        return _empty(result_format)
+
+    try:
+        table = ShowTable(lines[idx - 1] if idx > 0 else '', lines[idx])
+    except Exception as e:
+        logger.error('Possibly bad command output, exception: {}'.format(repr(e)))
+        return _empty(result_format)
+    return table.parse(lines[idx + 1:], result_format)
+
+
+def parse_show_tables(output, result_format=ROWS):
+    """Parse all the tables of a show command output with several separation lines
+
+    The line above each separation line is the header line of a new table. Blank lines are not content lines.
+
+    Args:
+        output: The 'stdout' string of a command result, or its 'stdout_lines'.
+        result_format: ROWS, COLUMNS or TUPLES.
+
+    Returns:
+        list: The parsed tables, in order of the output.
+    """
+    lines = _splitlines(output)
+    sep_indexes = [idx for idx, line in enumerate(lines) if is_sep_line(line)]
+    tables = []
+    for number, idx in enumerate(sep_indexes):
+        end = sep_indexes[number + 1] - 1 if number + 1 < len(sep_indexes) else len(lines)
+        try:
+            table = ShowTable(lines[idx - 1] if idx > 0 else '', lines[idx])
+        except Exception as e:
+            logger.error('Possibly bad command output, exception: {}'.format(repr(e)))
+            continue
+        tables.append(table.parse([line for line in lines[idx + 1:end] if line.strip()], result_format))
+    return tables
+
+
+def iter_show_rows(output, result_format=ROWS):
+    """Parse the rows of a show command output one line at a time
+
+    The output is not split into a list of lines. Like parse_show_tables, a new table starts at each separation line
+    and blank lines are skipped.
+
+    Args:
+        output: The 'stdout' string of a command result, or any iterable of lines.
+        result_format: ROWS or TUPLES.
+
+    Returns:
+        A generator of a dict or a namedtuple per content line.
+
+    Raises:
+        ValueError: The result format is COLUMNS, which needs all the lines of a table.
+    """
+    if result_format not in (ROWS, TUPLES):
+        raise ValueError('Unsupported result format "{}" of streamed rows'.format(result_format))
+    return _iter_show_rows(output, result_format)
+
+
+def _iter_show_rows(output, result_format):
+    table = None
+    pending = None
+    for line in iter_lines(output):
+        if is_sep_line(line):
+            # The pending line is the header of the new table, not a content line of the previous one
+            try:
+                table = ShowTable(pending or '', line)
+            except Exception as e:
+                logger.error('Possibly bad command output, exception: {}'.format(repr(e)))
+                table = None
+            pending = None
+            continue
+        if table is not None and pending is not None and pending.strip():
+            yield table.row(pending, result_format)
+        pending = line
+    if table is not None and pending is not None and pending.strip():
+        yield table.row(pending, result_format)
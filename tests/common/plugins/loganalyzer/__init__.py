@@ -9,6 +9,11 @@ from tests.common.helpers.parallel import parallel_run, reset_ansible_local_tmp
 def pytest_addoption(parser):
     parser.addoption("--disable_loganalyzer", action="store_true", default=False,
                      help="disable loganalyzer analysis for 'loganalyzer' fixture")
+    parser.addoption("--loganalyzer_on_dut", action="store_true", default=False,
+                     help="match logs on the DUT for 'loganalyzer' fixture, extracted logs are downloaded only on failure")
+    parser.addoption("--loganalyzer_cursor", action="store_true", default=False,
+                     help="extract syslog from the cursor taken at start marker for 'loganalyzer' fixture, "
+                          "logrotate is not paused during analysis")
 
 
 @reset_ansible_local_tmp
@@ -52,7 +57,9 @@ def loganalyzer(duthosts, request):
     analyzers = {}
     parallel_run(analyzer_logrotate, [], {}, duthosts, timeout=120)
     for duthost in duthosts:
-        analyzers[duthost.hostname] = LogAnalyzer(ansible_host=duthost, marker_prefix=request.node.name)
+        analyzers[duthost.hostname] = LogAnalyzer(ansible_host=duthost, marker_prefix=request.node.name,
+                                                  analyze_on_dut=request.config.getoption("--loganalyzer_on_dut"),
+                                                  use_cursor=request.config.getoption("--loganalyzer_cursor"))
     markers = parallel_run(analyzer_add_marker, [analyzers], {}, duthosts, timeout=120)
 
     yield analyzers
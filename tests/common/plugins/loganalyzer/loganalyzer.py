@@ -1,13 +1,16 @@
 import sys
+import json
 import logging
 import os
-import re
 import time
 import pprint
 
+from contextlib import contextmanager
+
 import system_msg_handler
 
 from system_msg_handler import AnsibleLogAnalyzer as ansible_loganalyzer
+from system_msg_handler import create_matcher
 from os.path import join, split
 from os.path import normpath
 
@@ -16,6 +19,8 @@ COMMON_MATCH = join(split(__file__)[0], "loganalyzer_common_match.txt")
 COMMON_IGNORE = join(split(__file__)[0], "loganalyzer_common_ignore.txt")
 COMMON_EXPECT = join(split(__file__)[0], "loganalyzer_common_expect.txt")
 SYSLOG_TMP_FOLDER = "/tmp/syslog"
+SYSLOG_DIR = "/var/log"
+SYSLOG_FILE = "syslog"
 
 
 class LogAnalyzerError(Exception):
@@ -25,7 +30,8 @@ class LogAnalyzerError(Exception):
 
 
 class LogAnalyzer:
-    def __init__(self, ansible_host, marker_prefix, dut_run_dir="/tmp", start_marker=None, additional_files={}):
+    def __init__(self, ansible_host, marker_prefix, dut_run_dir="/tmp", start_marker=None, additional_files={}, analyze_on_dut=False,
+                 use_cursor=False):
         self.ansible_host = ansible_host
         self.dut_run_dir = dut_run_dir
         self.extracted_syslog = os.path.join(self.dut_run_dir, "syslog")
@@ -43,6 +49,59 @@ class LogAnalyzer:
 
         self.additional_files = list(additional_files.keys())
         self.additional_start_str = list(additional_files.values())
+        # Match the extracted logs on the DUT and download only the matching lines
+        self.analyze_on_dut = analyze_on_dut
+        # Extract syslog from the cursor (inode, offset) taken by init instead of searching for the start marker
+        self.use_cursor = use_cursor
+        self._cursors = {}
+        # Duration in seconds of each phase of the last init and analyze
+        self.phase_durations = {}
+
+    @contextmanager
+    def _phase(self, name):
+        """
+        @summary: Measure duration of a loganalyzer phase and store it in self.phase_durations.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phase_durations[name] = time.time() - start
+
+    def _log_marker(self, prefix, marker, before=None):
+        """
+        @summary: Write marker into DUT syslog with logger.
+
+        The marker prefix is passed through a shell variable, so the command line which ansible logs into
+        syslog does not contain the marker itself.
+
+        @param before: Shell command run in the same call before the marker is written.
+        @return: Result of the shell command.
+        """
+        cmd = "prefix={}; logger -p user.info -t LogAnalyzer $prefix-{}".format(prefix, marker)
+        if before:
+            cmd = "{} && {}".format(before, cmd)
+        return self.ansible_host.shell(cmd)
+
+    def _cursor_file(self, marker):
+        """
+        @summary: Path of the file on the DUT keeping the syslog cursor taken with the start marker, so "analyze"
+                  finds it when "init" was called by another LogAnalyzer object or process.
+        """
+        return os.path.join(self.dut_run_dir, "loganalyzer.{}.cursor".format(marker.replace(' ', '_')))
+
+    def _load_cursor(self, marker):
+        """
+        @summary: Read the syslog cursor of the start marker saved on the DUT by "init".
+
+        @return: (inode, offset) or None if the cursor was not saved.
+        """
+        res = self.ansible_host.shell("cat '{}'".format(self._cursor_file(marker)), module_ignore_errors=True)
+        try:
+            inode, offset = res["stdout"].split()
+            return int(inode), int(offset)
+        except (KeyError, ValueError):
+            return None
 
     def _add_end_marker(self, marker):
         """
@@ -147,21 +206,35 @@ class LogAnalyzer:
         @return: True for successfull execution False otherwise
         """
         logging.debug("Loganalyzer init")
+        self.phase_durations = {}
 
-        self.ansible_host.copy(src=ANSIBLE_LOGANALYZER_MODULE, dest=os.path.join(self.dut_run_dir, "loganalyzer.py"))
+        with self._phase("init"):
+            log_files = []
+            for idx, path in enumerate(self.additional_files):
+                if not self.additional_start_str or self.additional_start_str[idx] == '':
+                    log_files.append(path)
 
-        log_files = []
-        for idx, path in enumerate(self.additional_files):
-            if not self.additional_start_str or self.additional_start_str[idx] == '':
-                log_files.append(path)
+            if not (self.use_cursor and not log_files):
+                self.ansible_host.copy(src=ANSIBLE_LOGANALYZER_MODULE, dest=os.path.join(self.dut_run_dir, "loganalyzer.py"))
 
-        return self._setup_marker(log_files=log_files)
+            return self._setup_marker(log_files=log_files)
 
     def _setup_marker(self, log_files=None):
         """
         Adds the marker to the log files
         """
         start_marker = ".".join((self.marker_prefix, time.strftime("%Y-%m-%d-%H:%M:%S", time.gmtime())))
+        if self.use_cursor and not log_files:
+            # Take the cursor before adding the marker, so the marker is always after the cursor.
+            # The cursor is saved next to the marker on the DUT as well.
+            stat_cmd = "stat -c '%i %s' {} | tee '{}'".format(os.path.join(SYSLOG_DIR, SYSLOG_FILE),
+                                                            self._cursor_file(start_marker))
+            res = self._log_marker(ansible_loganalyzer.start_marker_prefix, start_marker, before=stat_cmd)
+            inode, offset = res["stdout"].split()
+            self._cursors[start_marker] = (int(inode), int(offset))
+            logging.debug("Added start marker '{}', syslog cursor inode {} offset {}".format(start_marker, inode, offset))
+            return start_marker
+
         cmd = "python {run_dir}/loganalyzer.py --action init --run_id {start_marker}".format(run_dir=self.dut_run_dir, start_marker=start_marker)
         if log_files:
             cmd += " --logs {}".format(','.join(log_files))
@@ -196,42 +269,119 @@ class LogAnalyzer:
         else:
             start_string = self.start_marker
 
-        try:
-            # Disable logrotate cron task
-            self.ansible_host.command("sed -i 's/^/#/g' /etc/cron.d/logrotate")
-
-            logging.debug("Waiting for logrotate from previous cron task run to finish")
-            # Wait for logrotate from previous cron task run to finish
-            end = time.time() + 60
-            while time.time() < end:
-                # Verify for exception because self.ansible_host automatically handle command return codes and raise exception for none zero code
-                try:
-                    self.ansible_host.command("pgrep -f logrotate")
-                except Exception:
-                    break
-                else:
-                    time.sleep(5)
-                    continue
+        cursor = self._cursors.pop(marker, None)
+        if cursor is None and self.use_cursor:
+            cursor = self._load_cursor(marker)
+        if cursor:
+            # Rotation is followed by inode of the cursor, no need to pause logrotate
+            with self._phase("end_marker"):
+                self._log_marker(ansible_loganalyzer.end_marker_prefix, marker,
+                                 before="rm -f '{}'".format(self._cursor_file(marker)))
+            with self._phase("extract"):
+                self._extract_logs(start_string, cursor)
+        else:
+            try:
+                with self._phase("logrotate_pause"):
+                    # Disable logrotate cron task
+                    self.ansible_host.command("sed -i 's/^/#/g' /etc/cron.d/logrotate")
+
+                    logging.debug("Waiting for logrotate from previous cron task run to finish")
+                    # Wait for logrotate from previous cron task run to finish
+                    end = time.time() + 60
+                    while time.time() < end:
+                        # Verify for exception because self.ansible_host automatically handle command return codes and raise exception for none zero code
+                        try:
+                            self.ansible_host.command("pgrep -f logrotate")
+                        except Exception:
+                            break
+                        else:
+                            time.sleep(5)
+                            continue
+                    else:
+                        logging.error("Logrotate from previous task was not finished during 60 seconds")
+
+                # Add end marker into DUT syslog
+                with self._phase("end_marker"):
+                    self._add_end_marker(marker)
+
+                with self._phase("extract"):
+                    self._extract_logs(start_string)
+            finally:
+                # Enable logrotate cron task back
+                self.ansible_host.command("sed -i 's/^#//g' /etc/cron.d/logrotate")
+
+        expect_messages_regex = create_matcher(self.expect_regex)
+        dut_file_list = [self.extracted_syslog]
+        for path in self.additional_files:
+            dut_file_list.append(os.path.join(self.dut_run_dir, split(path)[1]))
+        with self._phase("analyze"):
+            if self.analyze_on_dut:
+                analyzer_parse_result = self._analyze_file_list_on_dut(marker, dut_file_list)
+                # Count expected regex hits on the returned expected lines only
+                if expect_messages_regex is not None:
+                    for _, expecting_lines in analyzer_parse_result.values():
+                        for line in expecting_lines:
+                            expect_messages_regex.findall(line)
             else:
-                logging.error("Logrotate from previous task was not finished during 60 seconds")
+                analyzer_parse_result = self._analyze_file_list_locally(timestamp, tmp_folder, expect_messages_regex)
+        logging.info("Loganalyzer phase durations on {}: {}".format(
+            self.ansible_host.hostname, ", ".join("{} {:.2f}s".format(k, v) for k, v in sorted(self.phase_durations.items()))))
 
-            # Add end marker into DUT syslog
-            self._add_end_marker(marker)
+        for key, value in analyzer_parse_result.iteritems():
+            matching_lines, expecting_lines = value
+            analyzer_summary["total"]["match"] += len(matching_lines)
+            analyzer_summary["total"]["expected_match"] += len(expecting_lines)
+            analyzer_summary["match_files"][key] = {"match": len(matching_lines), "expected_match": len(expecting_lines)}
+            analyzer_summary["match_messages"][key] = matching_lines
+            analyzer_summary["expect_messages"][key] = expecting_lines
 
-            # On DUT extract syslog files from /var/log/ and create one file by location - /tmp/syslog
-            self.ansible_host.extract_log(directory='/var/log', file_prefix='syslog', start_string=start_string, target_filename=self.extracted_syslog)
-            for idx, path in enumerate(self.additional_files):
-                file_dir, file_name = split(path)
-                extracted_file_name = os.path.join(self.dut_run_dir, file_name)
-                if self.additional_start_str and self.additional_start_str[idx] != '':
-                    start_str = self.additional_start_str[idx]
-                else:
-                    start_str = start_string
-                self.ansible_host.extract_log(directory=file_dir, file_prefix=file_name, start_string=start_str, target_filename=extracted_file_name)
-        finally:
-            # Enable logrotate cron task back
-            self.ansible_host.command("sed -i 's/^#//g' /etc/cron.d/logrotate")
+        # Expected regex hits are counted while matching, unused ones fall out of the counters
+        unused_regex_messages = expect_messages_regex.unused() if expect_messages_regex is not None else []
+        analyzer_summary["total"]["expected_missing_match"] = len(unused_regex_messages)
+        analyzer_summary["unused_expected_regexp"] = unused_regex_messages
 
+        if fail:
+            try:
+                self._verify_log(analyzer_summary)
+            except LogAnalyzerError:
+                if self.analyze_on_dut:
+                    self._save_failed_logs(dut_file_list, timestamp)
+                raise
+        else:
+            return analyzer_summary
+
+    def _extract_logs(self, start_string, cursor=None):
+        """
+        @summary: On DUT extract syslog files from /var/log/ and create one file by location - /tmp/syslog.
+                  Additional files are extracted into the DUT run directory.
+
+        @param start_string: Start marker to search for in the logs.
+        @param cursor: Syslog (inode, offset) taken by "init", the syslog is extracted from it when specified.
+        """
+        kwargs = {}
+        if cursor:
+            kwargs = {"start_inode": cursor[0], "start_offset": cursor[1]}
+        res = self.ansible_host.extract_log(directory=SYSLOG_DIR, file_prefix=SYSLOG_FILE, start_string=start_string,
+                                            target_filename=self.extracted_syslog, **kwargs)
+        if cursor:
+            logging.debug("Syslog extracted from cursor {}, end cursor {}".format(cursor, res.get("cursor")))
+        for idx, path in enumerate(self.additional_files):
+            file_dir, file_name = split(path)
+            extracted_file_name = os.path.join(self.dut_run_dir, file_name)
+            if self.additional_start_str and self.additional_start_str[idx] != '':
+                start_str = self.additional_start_str[idx]
+            else:
+                start_str = start_string
+            self.ansible_host.extract_log(directory=file_dir, file_prefix=file_name, start_string=start_str, target_filename=extracted_file_name)
+
+    def _analyze_file_list_locally(self, timestamp, tmp_folder, expect_messages_regex):
+        """
+        @summary: Download extracted logs from the DUT and analyze them on the ansible host.
+
+        @param expect_messages_regex: MessageMatcher instance for expected messages, counts expected regex hits.
+
+        @return: Dictionary of matching and expected lines per downloaded file.
+        """
         # Download extracted logs from the DUT to the temporal folder defined in SYSLOG_TMP_FOLDER
         self.save_extracted_log(dest=tmp_folder)
         file_list = [tmp_folder]
@@ -243,9 +393,8 @@ class LogAnalyzer:
             self.save_extracted_file(dest=tmp_folder, src=extracted_file_name)
             file_list.append(tmp_folder)
 
-        match_messages_regex = re.compile('|'.join(self.match_regex)) if len(self.match_regex) else None
-        ignore_messages_regex = re.compile('|'.join(self.ignore_regex)) if len(self.ignore_regex) else None
-        expect_messages_regex = re.compile('|'.join(self.expect_regex)) if len(self.expect_regex) else None
+        match_messages_regex = create_matcher(self.match_regex)
+        ignore_messages_regex = create_matcher(self.ignore_regex)
 
         analyzer_parse_result = self.ansible_loganalyzer.analyze_file_list(file_list, match_messages_regex, ignore_messages_regex, expect_messages_regex)
         # Print file content and remove the file
@@ -254,34 +403,55 @@ class LogAnalyzer:
                 logging.debug("{} file content:\n\n{}".format(folder, fo.read()))
             os.remove(folder)
 
-        total_match_cnt = 0
-        total_expect_cnt = 0
-        expected_lines_total = []
-        unused_regex_messages = []
+        return analyzer_parse_result
 
-        for key, value in analyzer_parse_result.iteritems():
-            matching_lines, expecting_lines = value
-            analyzer_summary["total"]["match"] += len(matching_lines)
-            analyzer_summary["total"]["expected_match"] += len(expecting_lines)
-            analyzer_summary["match_files"][key] = {"match": len(matching_lines), "expected_match": len(expecting_lines)}
-            analyzer_summary["match_messages"][key] = matching_lines
-            analyzer_summary["expect_messages"][key] = expecting_lines
-            expected_lines_total.extend(expecting_lines)
+    def _analyze_file_list_on_dut(self, marker, file_list):
+        """
+        @summary: Ship the configured regular expressions to the DUT and analyze extracted logs there.
+                  Only matching and expected lines are returned to the ansible host.
 
-        # Find unused regex matches
-        for regex in self.expect_regex:
-            for line in expected_lines_total:
-                if re.search(regex, line):
-                    break
-            else:
-                unused_regex_messages.append(regex)
-        analyzer_summary["total"]["expected_missing_match"] = len(unused_regex_messages)
-        analyzer_summary["unused_expected_regexp"] = unused_regex_messages
+        @param marker: Marker obtained from "init" method.
+        @param file_list: List of extracted log files on the DUT.
 
-        if fail:
-            self._verify_log(analyzer_summary)
-        else:
-            return analyzer_summary
+        @return: Dictionary of matching and expected lines per extracted file.
+        """
+        if self.use_cursor:
+            # Not copied by "init" in cursor mode
+            self.ansible_host.copy(src=ANSIBLE_LOGANALYZER_MODULE, dest=os.path.join(self.dut_run_dir, "loganalyzer.py"))
+        regex_file = os.path.join(self.dut_run_dir, "loganalyzer_regex.{}.json".format(marker))
+        regex = {"match": self.match_regex, "ignore": self.ignore_regex, "expect": self.expect_regex}
+        self.ansible_host.copy(content=json.dumps(regex), dest=regex_file)
+
+        cmd = "python {run_dir}/loganalyzer.py --action analyze_on_dut --run_id {marker} --logs {logs} --regex_file {regex_file}"\
+            .format(run_dir=self.dut_run_dir, marker=marker, logs=",".join(file_list), regex_file=regex_file)
+        if self.ansible_loganalyzer.start_marker:
+            cmd += " --start_marker '{}'".format(self.ansible_loganalyzer.start_marker)
+
+        logging.debug("Analyzing extracted logs {} on DUT".format(file_list))
+        try:
+            res = self.ansible_host.command(cmd, module_ignore_errors=True, verbose=False)
+        finally:
+            self.ansible_host.file(path=regex_file, state="absent")
+        if res["rc"] != 0:
+            raise LogAnalyzerError("Log analysis on DUT failed, rc {}:\n{}".format(res["rc"], res["stdout"]))
+
+        analyzer_parse_result = {}
+        for key, value in json.loads(res["stdout"]).items():
+            analyzer_parse_result[key] = [[line.encode("utf-8") for line in lines] for lines in value]
+        return analyzer_parse_result
+
+    def _save_failed_logs(self, file_list, timestamp):
+        """
+        @summary: Download extracted logs from the DUT after failed analysis on DUT.
+
+        @param file_list: List of extracted log files on the DUT.
+        @param timestamp: Timestamp used for the name of downloaded files.
+        """
+        for path in file_list:
+            dest = ".".join((SYSLOG_TMP_FOLDER if path == self.extracted_syslog else path,
+                             self.ansible_host.hostname, timestamp))
+            self.save_extracted_file(dest=dest, src=path)
+            logging.info("Extracted log {} of failed analysis is saved to {}".format(path, dest))
 
     def save_extracted_log(self, dest):
         """
@@ -12,6 +12,7 @@ from tests.common.plugins.sanity_check import constants
 from tests.common.plugins.sanity_check import checks
 from tests.common.plugins.sanity_check.checks import *
 from tests.common.plugins.sanity_check.recover import recover
+from tests.common.plugins.sanity_check.snapshot import SNAPSHOT_CHECK_ITEMS, check_snapshot_items
 from tests.common.plugins.sanity_check.constants import STAGE_PRE_TEST, STAGE_POST_TEST
 from tests.common.helpers.assertions import pytest_assert as pt_assert
 
@@ -114,6 +115,12 @@ def filter_check_items(tbinfo, check_items):
 
 def do_checks(request, check_items, *args, **kwargs):
     check_results = []
+    if request.config.getoption("--sanity_engine") == "snapshot":
+        # Items supported by the snapshot engine are checked on all the DUTs against a shared snapshot of the DUT state
+        snapshot_items = [item for item in check_items if item in SNAPSHOT_CHECK_ITEMS]
+        check_items = [item for item in check_items if item not in SNAPSHOT_CHECK_ITEMS]
+        check_results.extend(check_snapshot_items(request.getfixturevalue("duthosts"), snapshot_items,
+                                                  *args, **kwargs))
     for item in check_items:
         check_fixture = request.getfixturevalue(_item2fixture(item))
         results = check_fixture(*args, **kwargs)
@@ -0,0 +1,335 @@
+"""
+Sanity check engine evaluating the DUT check items against a shared snapshot of the DUT state.
+
+The check fixtures in checks.py query the DUTs item by item, each item forking a process per DUT and reading the
+same state again (networking uptime, containers, ...). This engine collects the state needed by all the selected
+items of a DUT in one round: the shell commands of all the items are run as one batch, then the state read by
+ansible modules (interfaces, BGP) is collected. The modules of a DUT are run one after another, the host object keeps
+the module being called in its instance fields. All the DUTs are processed concurrently. While waiting for the DUT
+to stabilize, only the state of the failing items is collected again.
+
+The check results are the same as the ones of the check fixtures.
+"""
+import datetime
+import json
+import logging
+import time
+
+from tests.common.utilities import wait
+from tests.common.helpers.constants import DEFAULT_NAMESPACE
+from tests.common.helpers.parallel import parallel_run, reset_ansible_local_tmp, BACKEND_THREAD
+from tests.common.plugins.sanity_check.checks import SYSTEM_STABILIZE_MAX_TIME, MONIT_STABILIZE_MAX_TIME
+from tests.common.plugins.sanity_check.checks import _find_down_ports, _is_db_omem_over_threshold, \
+    _check_monit_services_status
+
+logger = logging.getLogger(__name__)
+
+RETRY_INTERVAL = 20
+# Time allowed for collecting a snapshot, on top of the stabilization time
+COLLECT_TIMEOUT = 300
+
+NETWORKING_START_CMD = "systemctl -p ExecMainStartTimestamp show networking"
+NOW_CMD = 'date +"%Y-%m-%d %H:%M:%S"'
+
+
+class _DedupBatch(object):
+    """
+    @summary: CommandBatch wrapper queuing a command once, the items reading the same state share its result
+    """
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.queued = {}
+
+    def shell(self, cmd, module_ignore_errors=True):
+        if cmd not in self.queued:
+            self.queued[cmd] = self.batch.shell(cmd, module_ignore_errors=True)
+        return self.queued[cmd]
+
+    command = shell
+
+
+class DutSnapshot(object):
+    """
+    @summary: State of a DUT read by the check items
+
+    Every call of collect() reads again the state of the given items only, the state of the other items is kept.
+    The networking uptime is read by the first call only.
+    """
+
+    def __init__(self, dut):
+        self.dut = dut
+        self.outputs = {}
+        self.facts = {}
+        self.networking_uptime = None
+        self.rounds = 0
+
+    def collect(self, items):
+        batch = self.dut.batch()
+        commands = _DedupBatch(batch)
+        # The stabilization deadlines are based on the networking uptime of the first round, it is not read again
+        if self.rounds == 0:
+            networking_start = commands.shell(NETWORKING_START_CMD)
+            now = commands.shell(NOW_CMD)
+        for item in items:
+            self.outputs[item.name] = item.queue(self.dut, commands)
+
+        # AnsibleHostBase.__getattr__ stores the module in the host object, the modules of a DUT are not
+        # run concurrently
+        batch.execute()
+        for item in items:
+            if item.uses_modules:
+                item.collect(self.dut, self.facts)
+
+        if self.rounds == 0:
+            self.networking_uptime = self._parse_networking_uptime(networking_start, now)
+        self.rounds += 1
+
+    @staticmethod
+    def _parse_networking_uptime(networking_start, now):
+        """
+        @summary: Seconds since the networking service was started, see SonicHost.get_networking_uptime
+        """
+        try:
+            start_time = networking_start["stdout"].strip().split("=", 1)[1]
+            return (datetime.datetime.strptime(now["stdout"].strip(), "%Y-%m-%d %H:%M:%S") -
+                    datetime.datetime.strptime(start_time, "%a %Y-%m-%d %H:%M:%S UTC")).total_seconds()
+        except Exception as e:
+            logger.error("Exception raised while getting networking restart time: %s" % repr(e))
+            return None
+
+
+class SnapshotCheckItem(object):
+    """
+    @summary: Check item evaluated against a DutSnapshot
+
+    queue() adds the shell commands of the item to the batch of the snapshot and returns their results,
+    collect() reads the state which needs ansible modules, evaluate() builds the check result from the state.
+    """
+    name = None
+    stabilize_time = SYSTEM_STABILIZE_MAX_TIME
+    frontend_only = False
+    uses_modules = False
+
+    def queue(self, dut, batch):
+        return None
+
+    def collect(self, dut, facts):
+        pass
+
+    def evaluate(self, dut, outputs, facts):
+        raise NotImplementedError
+
+    def check_result(self, dut, failed):
+        return {"failed": failed, "check_item": self.name, "host": dut.hostname}
+
+
+class ServicesCheckItem(SnapshotCheckItem):
+    name = "services"
+
+    def queue(self, dut, batch):
+        return dict([(service, batch.command(dut.container_running_cmd(service))) for service in dut.critical_services])
+
+    def evaluate(self, dut, outputs, facts):
+        services_status = dict([(service, dut.is_container_running_output(output))
+                                for service, output in outputs.items()])
+        check_result = self.check_result(dut, not all(services_status.values()))
+        check_result["services_status"] = services_status
+        return check_result
+
+
+class ProcessesCheckItem(SnapshotCheckItem):
+    name = "processes"
+
+    def queue(self, dut, batch):
+        return dut.queue_critical_process_status(batch)
+
+    def evaluate(self, dut, outputs, facts):
+        processes_status = dut.parse_critical_process_status(outputs)
+        check_result = self.check_result(dut, False)
+        check_result["processes_status"] = processes_status
+        check_result["services_status"] = {}
+        for k, v in processes_status.items():
+            if v['status'] == False or len(v['exited_critical_process']) > 0:
+                check_result['failed'] = True
+            check_result["services_status"].update({k: v['status']})
+        return check_result
+
+
+class MonitCheckItem(SnapshotCheckItem):
+    name = "monit"
+    stabilize_time = MONIT_STABILIZE_MAX_TIME
+
+    def queue(self, dut, batch):
+        return batch.shell("sudo monit status")
+
+    def evaluate(self, dut, outputs, facts):
+        check_result = self.check_result(dut, False)
+        monit_services_status = dut.parse_monit_services_status(outputs)
+        if not monit_services_status:
+            check_result["failed"] = True
+            check_result["failed_reason"] = "Monit was not running"
+            return check_result
+        return _check_monit_services_status(check_result, monit_services_status)
+
+
+class DbMemoryCheckItem(SnapshotCheckItem):
+    name = "dbmemory"
+    stabilize_time = 0      # Checked once, the memory of the database does not stabilize
+
+    def queue(self, dut, batch):
+        outputs = []
+        for asic in dut.asics:
+            if asic.namespace != DEFAULT_NAMESPACE:
+                cmd = "sudo ip netns exec {} /usr/bin/redis-cli client list".format(asic.namespace)
+            else:
+                cmd = "/usr/bin/redis-cli client list"
+            outputs.append((asic, batch.command(cmd)))
+        return outputs
+
+    def evaluate(self, dut, outputs, facts):
+        check_result = self.check_result(dut, False)
+        for asic, output in outputs:
+            if output["rc"] != 0:
+                logger.warning("Failed to list the redis clients on {} {}: {}".format(
+                    dut.hostname, str(asic.namespace or ''), output.get("stderr", "")))
+            result, total_omem = _is_db_omem_over_threshold(output.get("stdout_lines", []))
+            if result:
+                check_result["failed"] = True
+                check_result["total_omem"] = total_omem
+                logger.info("{} db memory over the threshold ".format(str(asic.namespace or '')))
+                break
+        return check_result
+
+
+class InterfacesCheckItem(SnapshotCheckItem):
+    name = "interfaces"
+    frontend_only = True
+    uses_modules = True
+
+    def collect(self, dut, facts):
+        # The persistent configuration doesn't change while waiting, it is read in the first round only
+        if "interfaces_config" not in facts:
+            interfaces_config = []
+            for asic in dut.asics:
+                cfg_facts = asic.config_facts(host=dut.hostname, source="persistent", verbose=False)['ansible_facts']
+                phy_interfaces = [k for k, v in cfg_facts["PORT"].items() if
+                                  "admin_status" in v and v["admin_status"] == "up"]
+                ip_interfaces = []
+                if "PORTCHANNEL_INTERFACE" in cfg_facts:
+                    ip_interfaces += list(cfg_facts["PORTCHANNEL_INTERFACE"].keys())
+                if "VLAN_INTERFACE" in cfg_facts:
+                    ip_interfaces += list(cfg_facts["VLAN_INTERFACE"].keys())
+                logger.debug("%s phy_interfaces=%s ip_interfaces=%s" % (dut.hostname, json.dumps(phy_interfaces),
+                                                                       json.dumps(ip_interfaces)))
+                interfaces_config.append((asic, phy_interfaces, ip_interfaces))
+            facts["interfaces_config"] = interfaces_config
+
+        down_ports = []
+        for asic, phy_interfaces, ip_interfaces in facts["interfaces_config"]:
+            down_ports += _find_down_ports(asic, phy_interfaces, ip_interfaces)
+        facts["down_ports"] = down_ports
+
+    def evaluate(self, dut, outputs, facts):
+        down_ports = facts["down_ports"]
+        check_result = self.check_result(dut, len(down_ports) > 0)
+        check_result["down_ports"] = down_ports
+        return check_result
+
+
+class BgpCheckItem(SnapshotCheckItem):
+    name = "bgp"
+    frontend_only = True
+    uses_modules = True
+
+    def collect(self, dut, facts):
+        facts["bgp_facts"] = dut.bgp_facts(asic_index='all')
+
+    def evaluate(self, dut, outputs, facts):
+        check_result = self.check_result(dut, False)
+        for asic_index, a_asic_facts in enumerate(facts["bgp_facts"]):
+            a_asic_neighbors = a_asic_facts['ansible_facts']['bgp_neighbors']
+            if a_asic_neighbors is None:
+                check_result['failed'] = True
+                continue
+            down_neighbors = [k for k, v in a_asic_neighbors.items() if v['state'] != 'established']
+            if down_neighbors:
+                key = 'bgp' if dut.facts['num_asic'] == 1 else 'bgp' + str(asic_index)
+                check_result[key] = {'down_neighbors': down_neighbors}
+                check_result['failed'] = True
+                logger.info('BGP neighbors down: %s on bgp instance %s on dut %s' % (
+                    down_neighbors, key, dut.hostname))
+        return check_result
+
+
+SNAPSHOT_CHECK_ITEMS = dict([(item.name, item) for item in [
+    ServicesCheckItem(),
+    ProcessesCheckItem(),
+    MonitCheckItem(),
+    DbMemoryCheckItem(),
+    InterfacesCheckItem(),
+    BgpCheckItem()]])
+
+
+def _stabilize_timeout(item, networking_uptime):
+    if networking_uptime is None:
+        return 0
+    return max(item.stabilize_time - networking_uptime, 0)
+
+
+@reset_ansible_local_tmp
+def _check_dut(*args, **kwargs):
+    dut = kwargs['node']
+    results = kwargs['results']
+    items = [item for item in kwargs['items'] if not item.frontend_only or dut.hostname in kwargs['frontend_nodes']]
+    logger.info("Checking %s on %s..." % (", ".join([item.name for item in items]), dut.hostname))
+
+    snapshot = DutSnapshot(dut)
+    check_results = {}
+    pending = items
+    timeouts = None
+    start = time.time()
+    while pending:
+        snapshot.collect(pending)
+        if timeouts is None:
+            timeouts = dict([(item.name, _stabilize_timeout(item, snapshot.networking_uptime)) for item in items])
+        failing = []
+        for item in pending:
+            check_results[item.name] = item.evaluate(dut, snapshot.outputs[item.name], snapshot.facts)
+            elapsed = time.time() - start
+            if check_results[item.name]["failed"] and elapsed + RETRY_INTERVAL < timeouts[item.name]:
+                failing.append(item)
+        if failing:
+            wait(RETRY_INTERVAL, msg="Check items %s failed on %s, networking_uptime=%s seconds, wait %d seconds to "
+                                     "check them again. Elapsed time: %d" % \
+                 ([item.name for item in failing], dut.hostname, snapshot.networking_uptime, RETRY_INTERVAL,
+                  int(time.time() - start)))
+        pending = failing
+
+    logger.info("Done checking %s on %s in %d rounds" % (", ".join([item.name for item in items]), dut.hostname,
+                                                          snapshot.rounds))
+    results[dut.hostname] = [check_results[item.name] for item in items]
+
+
+def check_snapshot_items(duthosts, check_items, *args, **kwargs):
+    """
+    @summary: Run the check items supported by the snapshot engine on all the DUTs
+
+    @param duthosts: The duthosts fixture
+    @param check_items: Names of the check items, see SNAPSHOT_CHECK_ITEMS
+    @return: List of the check results, grouped by check item like the results of the check fixtures
+    """
+    items = [SNAPSHOT_CHECK_ITEMS[name] for name in check_items]
+    if not items:
+        return []
+    frontend_nodes = [node.hostname for node in duthosts.frontend_nodes]
+    nodes = duthosts if any(not item.frontend_only for item in items) else duthosts.frontend_nodes
+    timeout = max([item.stabilize_time for item in items]) + COLLECT_TIMEOUT
+    results = parallel_run(_check_dut, args, {"items": items, "frontend_nodes": frontend_nodes}, nodes,
+                           timeout=timeout, backend=BACKEND_THREAD)
+
+    check_results = []
+    for item in items:
+        for dut_results in results.values():
+            check_results += [result for result in dut_results if result["check_item"] == item.name]
+    return check_results
@@ -0,0 +1,174 @@
+"""Shared SSH ControlMaster pool for the ansible connections of a test session
+
+Every ansible module call opens an ssh connection to the host. With ControlMaster=auto and ControlPersist the
+ssh client keeps a master connection open and the following calls are multiplexed over it. The control sockets are
+already shared by all the processes of the user (~/.ansible/cp by default), but the default ControlPersist of
+tests/ansible.cfg lets the master die after 2 minutes of idle time.
+
+With option --ssh_pool this plugin:
+    - raises ControlPersist to --ssh_pool_persist, so the masters survive the idle time between test modules
+    - points the ControlPath directory of the `multi_passwd_ssh` connection plugin to a directory created for the
+      session, shared by the pytest process and all its xdist workers only, so the masters of the session can be told
+      apart from the ones of other ansible runs and concurrent pytest sessions, and closed with --ssh_pool_close. A
+      directory given with --ssh_pool_dir may be shared by several sessions, --ssh_pool_close then closes all the
+      masters in it
+    - collects pool hit/miss and connect latency statistics, reported at the end of the session. A run is a hit when
+      a live master accepts a connection on the control socket
+
+The environment variables below are read by tests/plugins/connection/multi_passwd_ssh.py in the forked ansible
+workers, the xdist workers inherit them from the pytest process.
+"""
+import json
+import logging
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+
+logger = logging.getLogger(__name__)
+
+SSH_POOL_DIR_ENV = "SONIC_MGMT_SSH_POOL_DIR"
+SSH_POOL_PERSIST_ENV = "SONIC_MGMT_SSH_POOL_PERSIST"
+SSH_POOL_STATS_ENV = "SONIC_MGMT_SSH_POOL_STATS"
+
+
+def pytest_addoption(parser):
+    parser.addoption("--ssh_pool", action="store_true", default=False,
+                     help="share persistent ssh master connections between all pytest processes of the session")
+    parser.addoption("--ssh_pool_dir", action="store", default=None,
+                     help="directory of the ssh control sockets, default is a new directory of the session in the "
+                          "temp dir")
+    parser.addoption("--ssh_pool_persist", action="store", default="30m",
+                     help="ControlPersist idle timeout of the pooled ssh master connections")
+    parser.addoption("--ssh_pool_close", action="store_true", default=False,
+                     help="close the pooled ssh master connections at the end of the session")
+
+
+def _is_xdist_worker(config):
+    return hasattr(config, "workerinput")
+
+
+def pytest_configure(config):
+    if not config.getoption("ssh_pool") or _is_xdist_worker(config):
+        return
+
+    pool_dir = config.getoption("ssh_pool_dir")
+    session_dir = not pool_dir
+    if session_dir:
+        # Keep it short, the length of an unix socket path is limited to 108 characters
+        pool_dir = tempfile.mkdtemp(prefix="sonic-ssh-")
+    pool_dir = os.path.abspath(pool_dir)
+    if not os.path.isdir(pool_dir):
+        os.makedirs(pool_dir, 0o700)
+
+    os.environ[SSH_POOL_DIR_ENV] = pool_dir
+    os.environ[SSH_POOL_PERSIST_ENV] = config.getoption("ssh_pool_persist")
+    os.environ[SSH_POOL_STATS_ENV] = os.path.join(pool_dir, "stats-{}.jsonl".format(os.getpid()))
+    config.pluginmanager.register(SshPool(pool_dir, os.environ[SSH_POOL_STATS_ENV],
+                                          config.getoption("ssh_pool_close"), session_dir), "SshPool")
+
+
+class SshPoolStats(object):
+    """Pool statistics aggregated from the records of the `multi_passwd_ssh` connection plugin"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.connect_latency = []
+        self.hit_latency = []
+        self.hosts = {}
+
+    @classmethod
+    def load(cls, stats_file):
+        stats = cls()
+        if not os.path.exists(stats_file):
+            return stats
+        with open(stats_file) as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                stats.add(record["host"], record["hit"], record["elapsed"])
+        return stats
+
+    def add(self, host, hit, elapsed):
+        host_stats = self.hosts.setdefault(host, [0, 0])
+        if hit:
+            self.hits += 1
+            self.hit_latency.append(elapsed)
+            host_stats[0] += 1
+        else:
+            self.misses += 1
+            self.connect_latency.append(elapsed)
+            host_stats[1] += 1
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    @staticmethod
+    def _mean(values):
+        return sum(values) / len(values) if values else 0.0
+
+    def summary(self):
+        lines = [
+            "ssh pool: {} runs, {} hits, {} misses, hit ratio {:.1%}".format(
+                self.hits + self.misses, self.hits, self.misses, self.hit_ratio),
+            "ssh pool: connect latency mean {:.3f}s max {:.3f}s, multiplexed run mean {:.3f}s".format(
+                self._mean(self.connect_latency), max(self.connect_latency or [0.0]), self._mean(self.hit_latency)),
+        ]
+        for host in sorted(self.hosts):
+            hits, misses = self.hosts[host]
+            lines.append("ssh pool: {:<24} hits {:<6} misses {}".format(host, hits, misses))
+        return lines
+
+
+class SshPool(object):
+    """Session end handling of the ssh pool, registered on the controlling pytest process only"""
+
+    def __init__(self, pool_dir, stats_file, close, session_dir=False):
+        self.pool_dir = pool_dir
+        self.stats_file = stats_file
+        self.close = close
+        self.session_dir = session_dir
+        self.stats = None
+
+    def _control_sockets(self):
+        for name in os.listdir(self.pool_dir):
+            path = os.path.join(self.pool_dir, name)
+            if not name.startswith("stats-") and not os.path.isdir(path):
+                yield path
+
+    def close_masters(self):
+        with open(os.devnull, "w") as devnull:
+            for path in self._control_sockets():
+                # The host argument is required by ssh but not used when the ControlPath is given
+                ret = subprocess.call(["ssh", "-o", "ControlPath={}".format(path), "-O", "exit", "ssh-pool"],
+                                      stdout=devnull, stderr=subprocess.STDOUT)
+                logger.debug("Closed ssh master {}, rc={}".format(path, ret))
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_sessionfinish(self, session):
+        self.stats = SshPoolStats.load(self.stats_file)
+        for line in self.stats.summary():
+            logger.info(line)
+        if os.path.exists(self.stats_file):
+            os.remove(self.stats_file)
+        if self.close:
+            self.close_masters()
+            if self.session_dir:
+                try:
+                    os.rmdir(self.pool_dir)
+                except OSError:
+                    pass
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.stats is None:
+            return
+        terminalreporter.section("ssh pool")
+        for line in self.stats.summary():
+            terminalreporter.write_line(line)
@@ -46,6 +46,7 @@ pytest_plugins = ('tests.common.plugins.ptfadapter',
                   'tests.common.plugins.dut_monitor',
                   'tests.common.plugins.tacacs',
                   'tests.common.plugins.loganalyzer',
+                  'tests.common.plugins.ssh_pool',
                   'tests.common.plugins.pdu_controller',
                   'tests.common.plugins.sanity_check',
                   'tests.common.plugins.custom_markers',
@@ -108,6 +109,9 @@ def pytest_addoption(parser):
                      help="Change (add|remove) post test check items based on pre test check items")
     parser.addoption("--recover_method", action="store", default="adaptive",
                      help="Set method to use for recover if sanity failed")
+    parser.addoption("--sanity_engine", action="store", default="fixture", choices=["fixture", "snapshot"],
+                     help="Run the check items by the check fixtures (fixture) or against a shared snapshot of each "
+                          "DUT collected in threads (snapshot, experimental)")
 
     ########################
     #   pre-test options   #
@@ -538,6 +542,12 @@ def pytest_runtest_makereport(item, call):
 
     setattr(item, "rep_" + rep.when, rep)
 
+
+def pytest_sessionfinish(session, exitstatus):
+    # Save the access times of the cached facts for LRU eviction and report the cache usage of this process
+    cache.flush()
+    logger.info(cache.stats_summary())
+
 def fetch_dbs(duthost, testname):
     dbs = [[0, "appdb"], [1, "asicdb"], [2, "counterdb"], [4, "configdb"]]
     for db in dbs:
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Benchmark the backends of tests.common.helpers.parallel.parallel_run.
+
+The target simulates an I/O bound ansible module call: it sleeps --delay seconds and returns a result of
+--result-kb kilobytes. For each number of nodes, the legacy implementation (one process per node, results in a
+multiprocessing.Manager().dict()) and the 'process', 'pool' and 'thread' backends are run in a fresh interpreter.
+The wall time and the peak RSS of the whole process tree, sampled from /proc, are reported.
+
+Usage:
+    python tests/scripts/bench_parallel_run.py [--nodes 2 8 32] [--delay 1.0] [--result-kb 64] [--concurrency 8]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import Manager
+
+REPO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../')
+if REPO_PATH not in sys.path:
+    sys.path.append(REPO_PATH)
+
+from tests.common.helpers.parallel import SonicProcess, parallel_run  # noqa E402
+
+BACKENDS = ("legacy", "process", "pool", "thread")
+
+
+def target(delay, result_kb, node=None, results=None):
+    time.sleep(delay)
+    results[node] = {"stdout": "x" * (result_kb * 1024), "rc": 0}
+
+
+def legacy_parallel_run(target, args, kwargs, nodes):
+    """The Manager().dict() based implementation, without the error handling"""
+    workers = []
+    results = Manager().dict()
+    for node in nodes:
+        kwargs['node'] = node
+        kwargs['results'] = results
+        worker = SonicProcess(name="{}--{}".format(target.__name__, node), target=target, args=args, kwargs=kwargs)
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+    return dict(results)
+
+
+def _tree_rss_kb(pid):
+    """Sum of the resident memory of pid and all its descendants"""
+    total = 0
+    stack = [pid]
+    while stack:
+        pid = stack.pop()
+        try:
+            with open("/proc/{}/status".format(pid)) as fp:
+                for line in fp:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+            for tid in os.listdir("/proc/{}/task".format(pid)):
+                with open("/proc/{}/task/{}/children".format(pid, tid)) as fp:
+                    stack.extend(int(child) for child in fp.read().split())
+        except (IOError, OSError):
+            continue
+    return total
+
+
+class RssSampler(threading.Thread):
+
+    def __init__(self, interval=0.01):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, _tree_rss_kb(os.getpid()))
+            time.sleep(self.interval)
+
+
+def run_single(backend, nodes, delay, result_kb, concurrency):
+    sampler = RssSampler()
+    sampler.start()
+    start = time.time()
+    if backend == "legacy":
+        results = legacy_parallel_run(target, (delay, result_kb), {}, range(nodes))
+    else:
+        results = parallel_run(target, (delay, result_kb), {}, range(nodes), backend=backend,
+                               concurrency=concurrency)
+    elapsed = time.time() - start
+    sampler.stopped.set()
+    sampler.join()
+    assert len(results) == nodes
+    print(json.dumps({"elapsed": elapsed, "peak_rss_kb": sampler.peak}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel_run backends")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[2, 8, 32], help="numbers of nodes")
+    parser.add_argument("--delay", type=float, default=1.0, help="simulated duration of the target on a node")
+    parser.add_argument("--result-kb", type=int, default=64, help="size of the result of a node in KB")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrency of the pool and thread backends")
+    parser.add_argument("--single", nargs=2, metavar=("BACKEND", "NODES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_single(args.single[0], int(args.single[1]), args.delay, args.result_kb, args.concurrency)
+        return
+
+    print("target delay {}s, result {} KB, pool/thread concurrency {}".format(
+        args.delay, args.result_kb, args.concurrency))
+    print("{:>6} {:>8} {:>10} {:>14}".format("nodes", "backend", "wall (s)", "peak RSS (MB)"))
+    for nodes in args.nodes:
+        for backend in BACKENDS:
+            cmd = [sys.executable, os.path.abspath(__file__), "--single", backend, str(nodes),
+                   "--delay", str(args.delay), "--result-kb", str(args.result_kb),
+                   "--concurrency", str(args.concurrency)]
+            result = json.loads(subprocess.check_output(cmd).decode().strip().splitlines()[-1])
+            print("{:>6} {:>8} {:>10.3f} {:>14.1f}".format(
+                nodes, backend, result["elapsed"], result["peak_rss_kb"] / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
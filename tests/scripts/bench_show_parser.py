@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Benchmark tests.common.helpers.show_parser against the legacy SonicHost._parse_show.
+
+A 'show interface counters' like output of --rows content lines is generated and parsed by:
+    - legacy: the per column slicing loop formerly in SonicHost._parse_show
+    - rows: parse_show with list of dict result, checked identical to the legacy result
+    - columns: parse_show with dict of lists result
+    - tuples: parse_show with list of namedtuple result
+    - stream: iter_show_rows over the 'stdout' string
+
+Usage:
+    python tests/scripts/bench_show_parser.py [--rows 100000] [--rounds 3]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+REPO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../')
+if REPO_PATH not in sys.path:
+    sys.path.append(REPO_PATH)
+
+from tests.common.helpers import show_parser  # noqa E402
+
+HEADERS = ["IFACE", "STATE", "RX_OK", "RX_BPS", "RX_UTIL", "RX_ERR", "RX_DRP", "RX_OVR",
+           "TX_OK", "TX_BPS", "TX_UTIL", "TX_ERR", "TX_DRP", "TX_OVR"]
+WIDTHS = [12, 7, 14, 14, 9, 8, 8, 8, 14, 14, 9, 8, 8, 8]
+
+
+def generate_output(rows):
+    def fmt(values):
+        return "  ".join(str(value).rjust(width) for value, width in zip(values, WIDTHS))
+    lines = [fmt(HEADERS), "  ".join("-" * width for width in WIDTHS)]
+    for number in range(rows):
+        lines.append(fmt(["Ethernet{}".format(number * 4), "U", "{:,}".format(number * 7919), "{:.2f} MB/s".format(number % 97),
+                          "{:.2f}%".format(number % 100), number % 3, number % 5, 0,
+                          "{:,}".format(number * 104729), "{:.2f} KB/s".format(number % 89), "0.00%", 0, number % 7, 0]))
+    return "\n".join(lines)
+
+
+def legacy_parse_column_positions(sep_line, sep_char='-'):
+    prev = ' ',
+    positions = []
+    for pos, char in enumerate(sep_line + ' '):
+        if char == sep_char:
+            if char != prev:
+                left = pos
+        else:
+            if char != prev:
+                right = pos
+                positions.append((left, right))
+        prev = char
+    return positions
+
+
+def legacy_parse_show(output_lines):
+    result = []
+    sep_line_pattern = re.compile(r"^( *-+ *)+$")
+    for idx, line in enumerate(output_lines):
+        if sep_line_pattern.match(line):
+            header_line = output_lines[idx-1]
+            sep_line = output_lines[idx]
+            content_lines = output_lines[idx+1:]
+            break
+    else:
+        return result
+    positions = legacy_parse_column_positions(sep_line)
+    headers = []
+    for (left, right) in positions:
+        headers.append(header_line[left:right].strip().lower())
+    for content_line in content_lines:
+        item = {}
+        for idx, (left, right) in enumerate(positions):
+            item[headers[idx]] = content_line[left:right].strip()
+        result.append(item)
+    return result
+
+
+def timeit(func, rounds):
+    best = None
+    result = None
+    for _ in range(rounds):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark show command output parsing")
+    parser.add_argument("--rows", type=int, default=100000, help="number of content lines")
+    parser.add_argument("--rounds", type=int, default=3, help="rounds per measurement, best is reported")
+    args = parser.parse_args()
+
+    stdout = generate_output(args.rows)
+    stdout_lines = stdout.splitlines()
+
+    legacy_time, legacy_result = timeit(lambda: legacy_parse_show(stdout_lines), args.rounds)
+    results = [("legacy", legacy_time)]
+    rows_time, rows_result = timeit(lambda: show_parser.parse_show(stdout_lines), args.rounds)
+    results.append(("rows", rows_time))
+    results.append(("columns", timeit(lambda: show_parser.parse_show(stdout_lines, show_parser.COLUMNS),
+                                      args.rounds)[0]))
+    results.append(("tuples", timeit(lambda: show_parser.parse_show(stdout_lines, show_parser.TUPLES),
+                                     args.rounds)[0]))
+    stream_time, stream_result = timeit(lambda: list(show_parser.iter_show_rows(stdout)), args.rounds)
+    results.append(("stream", stream_time))
+
+    print("{} rows x {} columns".format(args.rows, len(HEADERS)))
+    for name, elapsed in results:
+        print("{:<8} {:8.3f} s  (x{:.1f})".format(name, elapsed, legacy_time / elapsed))
+    print("rows identical to legacy: {}".format(rows_result == legacy_result))
+    print("stream identical to legacy: {}".format(stream_result == legacy_result))
+
+
+if __name__ == '__main__':
+    main()